@@ -0,0 +1,22 @@
+-- Wakes the compiler engine's poller as soon as a commit enters the queue,
+-- instead of waiting for its next polling cycle. Install it once in the
+-- run.codes database; the channel must match RUNCODES_DB_NOTIFY_CHANNEL
+-- (default "runcodes_commits"). Without it the engine keeps polling.
+--
+-- The payload is empty so that Postgres folds the notifications of a single
+-- transaction into one.
+
+CREATE OR REPLACE FUNCTION runcodes_notify_commit_queued() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('runcodes_commits', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Status 0 is STATUS_IN_QUEUE: new submissions, and commits given back to
+-- the queue after a retryable failure.
+CREATE OR REPLACE TRIGGER runcodes_commit_queued
+    AFTER INSERT OR UPDATE OF status ON commits
+    FOR EACH ROW
+    WHEN (NEW.status = 0)
+    EXECUTE FUNCTION runcodes_notify_commit_queued();
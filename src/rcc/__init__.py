@@ -1,15 +1,15 @@
 import argparse
 import asyncio
+import contextlib
 import logging
 import logging.handlers
 import multiprocessing as mp
 import multiprocessing.queues as mp_queues
 import sys
-import time
 from typing import cast
 
-from . import config, util
-from .model import Commit
+from . import config, images, util
+from .model import Commit, PackedCommit
 from .provider import data
 
 
@@ -48,35 +48,66 @@ def setup_logger(name: str, log_config: dict[str, object] | None) -> logging.Log
     return logger
 
 
-def commit_filter(_: Commit) -> bool:
-    return True
+def claim_batch_size(
+    task_queue: mp_queues.JoinableQueue[PackedCommit | None], maxsize: int
+) -> int:
+    """Number of commits to claim next: the free slots of the task queue.
 
+    Claimed commits are held until processed, so the poller only claims what
+    the queue can take right away. When the queue is full it still claims
+    one: its blocking ``put`` then waits for a free slot (backpressure).
+    """
+    try:
+        return max(1, maxsize - task_queue.qsize())
+    except NotImplementedError:
+        # qsize() needs sem_getvalue(), missing on macOS.
+        return 1
 
-def select_new_commits(
-    commits: list[Commit], recently_enqueued: dict[int, float], suppression: float
-) -> list[Commit]:
-    """Filter out recently enqueued commits and prune stale tracking entries.
 
-    ``recently_enqueued`` maps a commit id to the ``time.monotonic()`` value
-    at which it was put on the task queue. An entry is pruned when:
+async def enqueue_claimed(
+    commits: list[Commit],
+    task_queue: mp_queues.JoinableQueue[PackedCommit | None],
+    data_provider: data.DataProvider,
+    logger: logging.Logger,
+) -> None:
+    """Put claimed commits on the task queue, in order.
 
-    * its commit left the ``STATUS_IN_QUEUE`` fetch — a worker claimed it, so
-      a commit released back to the queue after a retryable failure is
-      re-enqueued immediately; or
-    * ``suppression`` seconds elapsed — so a commit whose worker died between
-      pulling and claiming it is retried instead of being suppressed forever.
+    Claimed commits are held until a worker processes them, so the ones the
+    poller fails to enqueue (it is cancelled or a put fails) are released
+    back to the queue. A put cancelled while blocked may still complete in
+    its thread: that commit stays claimed, for a worker or the stale claim
+    recovery.
     """
-    fetched_ids = {commit.id for commit in commits}
-    cutoff = time.monotonic() - suppression
-    for commit_id in list(recently_enqueued):
-        if commit_id not in fetched_ids or recently_enqueued[commit_id] < cutoff:
-            del recently_enqueued[commit_id]
-    return [commit for commit in commits if commit.id not in recently_enqueued]
+    for i, commit in enumerate(commits):
+        try:
+            # Blocking put on a bounded queue = backpressure: the loop
+            # stalls here while the workers drain, so no join() barrier is
+            # needed.
+            await asyncio.to_thread(task_queue.put, commit.pack())
+        except asyncio.CancelledError:
+            await _release_claims(commits[i + 1 :], data_provider, logger)
+            raise
+        except BaseException:
+            await _release_claims(commits[i:], data_provider, logger)
+            raise
+
+
+async def _release_claims(
+    commits: list[Commit], data_provider: data.DataProvider, logger: logging.Logger
+) -> None:
+    """Release claimed commits that were never enqueued."""
+    for commit in commits:
+        try:
+            await data_provider.release_commit(commit)
+        except Exception:
+            logger.exception(f"[{commit.id}] Could not release the claim")
+    if commits:
+        logger.info(f"Released {len(commits)} claimed commits")
 
 
 async def _stop_workers(
     engine_workers: list[mp.Process],
-    task_queue: mp_queues.JoinableQueue[Commit | None],
+    task_queue: mp_queues.JoinableQueue[PackedCommit | None],
     logger: logging.Logger,
 ) -> None:
     """Ask the workers to stop and wait for them to finish.
@@ -152,11 +183,16 @@ async def main() -> None:
         logger.debug(f"Configuration: {cfg}")
 
         data_provider = data.from_config(cfg)
+        try:
+            image_puller = images.puller_from_config(cfg)
+        except config.ConfigError as e:
+            logger.error(f"Invalid configuration: {e}")
+            sys.exit(1)
 
         # Bounded task queue (2x the commit slots across all workers): a
         # blocking put() is the backpressure mechanism. Putting is offloaded
         # to a thread so a full queue never blocks the event loop.
-        task_queue: mp_queues.JoinableQueue[Commit | None] = mp.JoinableQueue(
+        task_queue: mp_queues.JoinableQueue[PackedCommit | None] = mp.JoinableQueue(
             maxsize=task_queue_maxsize(cfg)
         )
         engine_workers = [
@@ -165,6 +201,7 @@ async def main() -> None:
         ]
 
         # Poll for new commits and put them in our internal processing queue
+        pull_task: asyncio.Task[None] | None = None
         try:
             sleeper = util.Sleeper(
                 cast(float, cfg.min_sleep_time), cast(float, cfg.max_sleep_time)
@@ -172,6 +209,11 @@ async def main() -> None:
             for worker in engine_workers:
                 worker.start()
 
+            # Pull the language images in the background: commits of a
+            # language wait in their worker until its image is present.
+            if image_puller is not None:
+                pull_task = asyncio.create_task(image_puller.run())
+
             # Open this process's own connection pool. This happens after the
             # workers have been spawned so the pool is never forked into or
             # pickled towards a child process (every process opens its own
@@ -180,42 +222,61 @@ async def main() -> None:
             # and are retried
             await data_provider.open()
 
-            # Suppress duplicate enqueueing: the poller re-fetches every
-            # commit that is still STATUS_IN_QUEUE on each cycle, so without
-            # this a commit waiting in the queue for a free worker would be
-            # put on it again and again. Worker-side claiming already makes
-            # such duplicates harmless; this only avoids wasting queue
-            # capacity and claim round trips on them. See
-            # :func:`select_new_commits` for the pruning rules.
-            recently_enqueued: dict[int, float] = {}
-            commit_suppression = float(
-                str(
-                    cfg.get(
-                        "commit_enqueue_suppression",
-                        config.DEFAULT_COMMIT_ENQUEUE_SUPPRESSION,
+            maxsize = task_queue_maxsize(cfg)
+            loop = asyncio.get_running_loop()
+            recovered = False
+            next_sweep = loop.time()
+            while True:
+                if loop.time() >= next_sweep:
+                    # The first sweep runs before the first claim, so none of
+                    # this run's claims can be mistaken for stale ones. Later
+                    # ones put back the claims of crashed engines and dead
+                    # workers.
+                    try:
+                        released = await data_provider.release_stale_claims()
+                        if released > 0:
+                            logger.info(f"Released {released} stale claims")
+                    except Exception:
+                        logger.exception("Could not release stale claims")
+                        if not recovered:
+                            await asyncio.sleep(sleeper.sleep_time())
+                            continue
+                    recovered = True
+                    # An age of 0 releases every claim: only before claiming.
+                    next_sweep = (
+                        loop.time() + config.STALE_CLAIM_SWEEP_INTERVAL
+                        if data_provider.stale_claim_age > 0
+                        else float("inf")
                     )
+                # Claim the commits in the database before enqueueing them: a
+                # claimed commit leaves STATUS_IN_QUEUE, so it is enqueued
+                # exactly once and the workers need no claim of their own.
+                batch_size = min(
+                    claim_batch_size(task_queue, maxsize),
+                    data_provider.queue_page_size,
                 )
-            )
-
-            while True:
                 try:
-                    commits = await data_provider.fetch_commits_in_queue()
-                    commits = list(filter(commit_filter, commits))
-                    commits = select_new_commits(
-                        commits, recently_enqueued, commit_suppression
-                    )
+                    commits = await data_provider.claim_batch(batch_size)
                 except Exception:
-                    logger.exception("Could not fetch commits")
+                    logger.exception("Could not claim commits")
                     commits = []
+                await enqueue_claimed(commits, task_queue, data_provider, logger)
                 if len(commits) > 0:
-                    for commit in commits:
-                        # Blocking put on a bounded queue = backpressure:
-                        # the loop stalls here while the workers drain, so
-                        # no join() barrier is needed.
-                        await asyncio.to_thread(task_queue.put, commit)
-                        recently_enqueued[commit.id] = time.monotonic()
                     sleeper.reset()
-                await asyncio.sleep(sleeper.sleep_time())
+                if len(commits) == batch_size:
+                    # The batch was full: more commits may be waiting.
+                    continue
+                # Woken early by a notification that commits were queued;
+                # otherwise this is a regular polling cycle. While listening,
+                # polls only catch missed notifications and can be far apart;
+                # without notifications, polling backs off from
+                # min_sleep_time to max_sleep_time.
+                if data_provider.listening:
+                    timeout = data_provider.notify_poll_interval
+                else:
+                    timeout = sleeper.sleep_time()
+                if await data_provider.wait_for_commits(timeout):
+                    sleeper.reset()
         except KeyboardInterrupt:
             # Only possible for a second Ctrl-C while the first one is already
             # being handled (see the CancelledError branch below).
@@ -230,6 +291,13 @@ async def main() -> None:
             await _stop_workers(engine_workers, task_queue, logger)
             raise
         finally:
+            if pull_task is not None:
+                _ = pull_task.cancel()
+                try:
+                    with contextlib.suppress(asyncio.CancelledError):
+                        await pull_task
+                except Exception:
+                    logger.exception("Image puller failed")
             await data_provider.close()
             # Also reached on (gracefully handled) interruption.
             logger.info("Exited")
@@ -0,0 +1,590 @@
+"""
+Per-worker caches for files downloaded from the storage provider and for
+exercise metadata read from the database.
+"""
+
+import asyncio
+import collections
+import copy
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import time
+from collections.abc import Awaitable, Callable
+from typing import TYPE_CHECKING, cast
+
+from .config import (
+    DEFAULT_EXERCISE_CACHE_TTL,
+    DEFAULT_EXERCISE_CASES_CACHE_SIZE,
+    DEFAULT_TEST_CASE_CACHE_SIZE,
+    Config,
+)
+from .util import lock_pid_directory, remove_unlocked_siblings, unlock_pid_directory
+
+if TYPE_CHECKING:
+    from .model import TestCase
+
+# Permissions of cached files and of their copies in commit directories:
+# they are immutable once stored.
+CACHED_FILE_PERMISSIONS = 0o444
+
+# ``ioctl`` request cloning a whole file (``FICLONE`` from <linux/fs.h>).
+FICLONE = 0x40049409
+
+
+class FileCache:
+    """Byte-budgeted LRU cache of immutable files on local disk.
+
+    Entries are addressed by a caller-chosen key that must change whenever
+    the content changes (e.g. a test case id plus its ``last_update``), so a
+    cached file never needs revalidation. The file name of an entry is the
+    SHA-256 of its key.
+
+    One cache is owned by each worker process and shared by all of its
+    in-flight commits. Every process stores its entries in its own
+    ``<directory>/<pid>`` subdirectory, so the LRU accounting is exact
+    without any cross-process locking, and an eviction can never remove a
+    file another worker is materializing; leftovers of dead processes are
+    removed by :meth:`open`. The price is that a file is downloaded and
+    stored once per worker rather than once per host: the cache takes up to
+    ``num_workers * max_size`` bytes of disk.
+
+    A process holds an exclusive ``flock`` on ``<directory>/<pid>.lock``
+    while its cache is open. The kernel drops it when the process dies, so
+    a directory whose lock can be taken belongs to nobody, even if its PID
+    has since been reused by another process.
+
+    All bookkeeping happens on the worker's event loop, so no lock is
+    needed. Concurrent fetches of the same missing key share a single
+    download. Entries being materialized are pinned and never evicted under
+    the reader's feet.
+
+    Cached files are handed out through :func:`materialize`, so a hit costs
+    a reflink instead of a byte copy when the cache and the destination share
+    a filesystem that supports them (the default ``cache_dir`` lives inside
+    ``exec_dir`` for that reason). Hardlinks are only used with ``link=True``,
+    for destinations no container ever sees.
+    """
+
+    directory: str
+    max_size: int
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    _entries: collections.OrderedDict[str, int]
+    _pending: dict[str, asyncio.Event]
+    _pins: dict[str, int]
+    _lock_fd: int | None
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        self.directory = os.path.join(directory, str(os.getpid()))
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Cached file name -> size in bytes, least recently used first.
+        self._entries = collections.OrderedDict()
+        self._pending = {}
+        self._pins = {}
+        self._lock_fd = None
+
+    def open(self) -> None:
+        """Lock and empty the cache directory, dropping stale ones. Idempotent.
+
+        The directory is always emptied: whatever it holds was left by a
+        crashed process with the same PID, and is not in the index.
+        """
+        if self._lock_fd is None:
+            self._lock_fd = lock_pid_directory(self.directory)
+        remove_unlocked_siblings(self.directory)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+        self._entries.clear()
+        self.size = 0
+
+    def close(self) -> None:
+        """Remove every cached file and release the directory."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self._entries.clear()
+        self.size = 0
+        if self._lock_fd is not None:
+            unlock_pid_directory(self.directory, self._lock_fd)
+            self._lock_fd = None
+
+    def stats(self) -> dict[str, int]:
+        """Return the counters used to size the cache."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "size": self.size,
+            "max_size": self.max_size,
+        }
+
+    async def fetch_many(
+        self,
+        items: list[tuple[str, str]],
+        fill: Callable[[list[tuple[str, str]]], Awaitable[None]],
+        link: bool = False,
+    ) -> None:
+        """Materialize every ``(key, destination)`` of ``items``.
+
+        All the keys that miss are downloaded by one ``fill(misses)`` call
+        with their ``(key, path)`` pairs, so the caller can hand them to the
+        storage provider as a single batch. ``fill`` is awaited even when
+        nothing misses; a failed ``fill`` caches nothing and propagates.
+        ``link`` is passed to :func:`materialize`. Keys another commit is already
+        downloading are waited for afterwards (and, should that download
+        fail, filled again with one more call per key).
+        """
+        names: dict[str, str] = {}
+        misses: list[tuple[str, str]] = []
+        waiting: list[str] = []
+        pinned: list[str] = []
+        for key, _ in items:
+            if key in names:
+                continue
+            name = _entry_name(key)
+            names[key] = name
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                self._pin(name)
+                pinned.append(name)
+                self.hits += 1
+            elif name in self._pending:
+                waiting.append(key)
+            else:
+                self.misses += 1
+                misses.append((key, name))
+        try:
+            await self._fill(misses, fill)
+            pinned.extend(name for _, name in misses)
+            for key in waiting:
+
+                async def fill_one(path: str, key: str = key) -> None:
+                    await fill([(key, path)])
+
+                pinned.append(await self._acquire(key, fill_one))
+
+            def materialize_all() -> None:
+                for key, destination in items:
+                    source = os.path.join(self.directory, names[key])
+                    materialize(source, destination, link)
+
+            await asyncio.to_thread(materialize_all)
+        finally:
+            for name in pinned:
+                self._release(name)
+
+    async def _acquire(self, key: str, fill: Callable[[str], Awaitable[None]]) -> str:
+        """Return the pinned file name of ``key``, downloading it if needed."""
+        name = _entry_name(key)
+        while True:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                self._pin(name)
+                self.hits += 1
+                return name
+            pending = self._pending.get(name)
+            if pending is None:
+                break
+            # Another commit is downloading this entry: wait for it and look
+            # again (on failure, this caller retries the download itself).
+            _ = await pending.wait()
+
+        self.misses += 1
+
+        async def fill_one(misses: list[tuple[str, str]]) -> None:
+            await fill(misses[0][1])
+
+        await self._fill([(key, name)], fill_one)
+        return name
+
+    async def _fill(
+        self,
+        misses: list[tuple[str, str]],
+        fill: Callable[[list[tuple[str, str]]], Awaitable[None]],
+    ) -> None:
+        """Download the ``(key, name)`` entries of ``misses`` and pin them.
+
+        The entries are marked pending before the first suspension point, so
+        callers must not await between checking ``_pending`` and calling this.
+        """
+        events = [asyncio.Event() for _ in misses]
+        for (_, name), event in zip(misses, events, strict=True):
+            self._pending[name] = event
+        paths = [os.path.join(self.directory, name) for _, name in misses]
+
+        def seal_all() -> list[int]:
+            return [_seal(f"{path}.tmp", path) for path in paths]
+
+        def remove_all() -> None:
+            # Sealing may have failed halfway: drop the entries it already
+            # moved into place along with the downloads it never reached.
+            for path in paths:
+                _remove(f"{path}.tmp")
+                _remove(path)
+
+        try:
+            await fill(
+                [
+                    (key, f"{path}.tmp")
+                    for (key, _), path in zip(misses, paths, strict=True)
+                ]
+            )
+            sizes = await asyncio.to_thread(seal_all)
+        except BaseException:
+            await asyncio.to_thread(remove_all)
+            raise
+        finally:
+            for (_, name), event in zip(misses, events, strict=True):
+                del self._pending[name]
+                event.set()
+        for (_, name), size in zip(misses, sizes, strict=True):
+            self._entries[name] = size
+            self.size += size
+            self._pin(name)
+        self._evict()
+
+    def _pin(self, name: str) -> None:
+        self._pins[name] = self._pins.get(name, 0) + 1
+
+    def _release(self, name: str) -> None:
+        count = self._pins[name] - 1
+        if count == 0:
+            del self._pins[name]
+        else:
+            self._pins[name] = count
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently used, unpinned entries until within budget."""
+        for name in list(self._entries):
+            if self.size <= self.max_size:
+                break
+            if name in self._pins:
+                continue
+            self.size -= self._entries.pop(name)
+            self.evictions += 1
+            _remove(os.path.join(self.directory, name))
+
+
+def _entry_name(key: str) -> str:
+    return hashlib.sha256(key.encode("utf8")).hexdigest()
+
+
+def materialize(source: str, destination: str, link: bool = False) -> None:
+    """Place a read-only copy of the cached ``source`` at ``destination``.
+
+    Tries, cheapest first:
+
+    * a reflink (copy-on-write clone): no data is copied and the clone is an
+      independent inode, so nothing written to it can reach the cache;
+    * with ``link``, a hardlink: no data is copied but the inode is the
+      cache's own. Only for paths no container can see: containers run as
+      root, so the read-only mode would not keep a submitted program from
+      overwriting the cached file for every later commit;
+    * a byte copy, when the two paths are on different filesystems or clones
+      are not supported.
+
+    An existing ``destination`` is replaced.
+    """
+    _remove(destination)
+    if _reflink(source, destination):
+        return
+    if link:
+        try:
+            os.link(source, destination)
+            return
+        except OSError:
+            pass
+    _ = shutil.copyfile(source, destination)
+    os.chmod(destination, CACHED_FILE_PERMISSIONS)
+
+
+def _reflink(source: str, destination: str) -> bool:
+    """Clone ``source`` into a new ``destination``; False if unsupported."""
+    src_fd = os.open(source, os.O_RDONLY)
+    try:
+        dst_fd = os.open(
+            destination, os.O_WRONLY | os.O_CREAT | os.O_EXCL, CACHED_FILE_PERMISSIONS
+        )
+        try:
+            _ = fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return True
+        except OSError as e:
+            if e.errno not in _REFLINK_UNSUPPORTED:
+                raise
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    _remove(destination)
+    return False
+
+
+# Errors of a ``FICLONE`` that only mean "clone not possible here".
+_REFLINK_UNSUPPORTED = (
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.EBADF,
+    errno.EPERM,
+)
+
+
+def _seal(tmp_path: str, path: str) -> int:
+    """Make a freshly downloaded file read-only and move it into place."""
+    os.chmod(tmp_path, CACHED_FILE_PERMISSIONS)
+    os.replace(tmp_path, path)
+    return os.stat(path).st_size
+
+
+def _remove(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class ExerciseCache:
+    """Per-worker cache of the compilation files of each exercise.
+
+    Maps a ``real_exercise_id`` to its list of ``(file name, version)``
+    pairs, where the version identifies the file's content (e.g. its S3
+    ETag) and becomes part of its `FileCache` key. Entries expire after
+    ``ttl`` seconds: only then are the file list and the versions loaded
+    again, so a burst of submissions to one exercise costs one database
+    query, one revalidation per file and (at most) one download per file.
+
+    Like `FileCache`, concurrent lookups of the same missing exercise share
+    a single load.
+    """
+
+    ttl: float
+    hits: int
+    misses: int
+    _entries: dict[int, tuple[float, list[tuple[str, str]]]]
+    _pending: dict[int, asyncio.Event]
+    _generation: int
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Exercise id -> (expiry time, versioned file list).
+        self._entries = {}
+        self._pending = {}
+        self._generation = 0
+
+    def stats(self) -> dict[str, int]:
+        """Return the counters used to tune the TTL."""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    async def get(
+        self,
+        exercise_id: int,
+        load: Callable[[], Awaitable[list[tuple[str, str | None]]]],
+    ) -> list[tuple[str, str]]:
+        """Return the versioned file list of an exercise.
+
+        On a miss (or an expired entry), ``load()`` is awaited for the file
+        names and their versions. Files whose version is unknown (`None`) get
+        a version unique to this load, so they are downloaded again once the
+        entry expires.
+        """
+        while True:
+            entry = self._entries.get(exercise_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            pending = self._pending.get(exercise_id)
+            if pending is None:
+                break
+            _ = await pending.wait()
+
+        self.misses += 1
+        event = asyncio.Event()
+        self._pending[exercise_id] = event
+        try:
+            files = await load()
+        finally:
+            del self._pending[exercise_id]
+            event.set()
+        self._generation += 1
+        versioned = [
+            (fname, version if version is not None else f"load-{self._generation}")
+            for fname, version in files
+        ]
+        now = time.monotonic()
+        for stale_id in [
+            k for k, (expiry, _) in self._entries.items() if expiry <= now
+        ]:
+            del self._entries[stale_id]
+        self._entries[exercise_id] = (now + self.ttl, versioned)
+        return versioned
+
+
+class ExerciseCasesCache:
+    """Per-worker cache of the test cases of each exercise.
+
+    Maps a ``real_exercise_id`` to its test cases and the version they were
+    loaded at. Every lookup asks ``probe()`` for the exercise's current
+    version (a cheap query that changes whenever a teacher edits the test
+    cases) and only calls ``load()`` when it differs, so popular exercises
+    skip the full test case queries. A `None` version is never cached.
+
+    Callers get deep copies: the engine mutates its test cases while
+    evaluating a commit (e.g. defaults ``abs_error``). At most ``max_entries``
+    exercises are kept, the least recently used are evicted first, and
+    concurrent loads of the same exercise are shared.
+    """
+
+    max_entries: int
+    hits: int
+    misses: int
+    _entries: collections.OrderedDict[int, tuple[object, list[TestCase]]]
+    _pending: dict[int, asyncio.Event]
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Exercise id -> (version, test cases), least recently used first.
+        self._entries = collections.OrderedDict()
+        self._pending = {}
+
+    def stats(self) -> dict[str, int]:
+        """Return the counters used to tune the size."""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    async def get(
+        self,
+        exercise_id: int,
+        probe: Callable[[], Awaitable[object]],
+        load: Callable[[], Awaitable[list[TestCase]]],
+    ) -> list[TestCase]:
+        """Return (copies of) the current test cases of an exercise."""
+        version = await probe()
+        while True:
+            entry = self._entries.get(exercise_id)
+            if version is not None and entry is not None and entry[0] == version:
+                self.hits += 1
+                self._entries.move_to_end(exercise_id)
+                return copy.deepcopy(entry[1])
+            pending = self._pending.get(exercise_id)
+            if pending is None:
+                break
+            _ = await pending.wait()
+
+        self.misses += 1
+        event = asyncio.Event()
+        self._pending[exercise_id] = event
+        try:
+            test_cases = await load()
+        finally:
+            del self._pending[exercise_id]
+            event.set()
+        if version is not None:
+            # Cases changed between the probe and the load are stored under
+            # the older version: the next probe just loads them again.
+            self._entries[exercise_id] = (version, copy.deepcopy(test_cases))
+            self._entries.move_to_end(exercise_id)
+            while len(self._entries) > self.max_entries:
+                _ = self._entries.popitem(last=False)
+        return test_cases
+
+
+def from_config(cfg: Config) -> FileCache | None:
+    """Build a test case cache from ``cfg``, or `None` when it is disabled.
+
+    The cache lives under ``cache_dir`` (default ``<exec_dir>/cache``) and
+    holds at most ``test_case_cache_size`` bytes; a size of 0 disables it.
+    """
+    max_size = int(str(cfg.get("test_case_cache_size", DEFAULT_TEST_CASE_CACHE_SIZE)))
+    if max_size <= 0:
+        return None
+    directory = cfg.get("cache_dir")
+    if directory is None:
+        directory = os.path.join(cast(str, cfg.exec_dir), "cache")
+    return FileCache(str(directory), max_size)
+
+
+def exercise_cache_from_config(cfg: Config) -> ExerciseCache | None:
+    """Build an exercise cache from ``cfg``, or `None` when it is disabled.
+
+    Entries live for ``exercise_cache_ttl`` seconds; a TTL of 0 disables it.
+    """
+    ttl = float(str(cfg.get("exercise_cache_ttl", DEFAULT_EXERCISE_CACHE_TTL)))
+    if ttl <= 0:
+        return None
+    return ExerciseCache(ttl)
+
+
+def exercise_cases_cache_from_config(cfg: Config) -> ExerciseCasesCache | None:
+    """Build an exercise test cases cache from ``cfg``, or `None` when disabled.
+
+    It holds the test cases of at most ``exercise_cases_cache_size``
+    exercises; a size of 0 disables it.
+    """
+    max_entries = int(
+        str(cfg.get("exercise_cases_cache_size", DEFAULT_EXERCISE_CASES_CACHE_SIZE))
+    )
+    if max_entries <= 0:
+        return None
+    return ExerciseCasesCache(max_entries)
+
+
+# The caches of the current worker process (see `open_caches`).
+_file_cache: FileCache | None = None
+_exercise_cache: ExerciseCache | None = None
+_exercise_cases_cache: ExerciseCasesCache | None = None
+
+
+def open_caches(cfg: Config) -> None:
+    """Create, open and register the worker's caches (those enabled by ``cfg``).
+
+    Called once per worker process from its event loop. The engine reaches
+    the registered caches through `get_file_cache`, `get_exercise_cache` and
+    `get_exercise_cases_cache`, the same way it reaches the registered
+    configuration.
+    """
+    global _file_cache, _exercise_cache, _exercise_cases_cache
+    close_caches()
+    file_cache = from_config(cfg)
+    if file_cache is not None:
+        file_cache.open()
+    _file_cache = file_cache
+    _exercise_cache = exercise_cache_from_config(cfg)
+    _exercise_cases_cache = exercise_cases_cache_from_config(cfg)
+
+
+def get_file_cache() -> FileCache | None:
+    """Return the registered worker file cache, or `None` if there is none."""
+    return _file_cache
+
+
+def get_exercise_cache() -> ExerciseCache | None:
+    """Return the registered worker exercise cache, or `None` if there is none."""
+    return _exercise_cache
+
+
+def get_exercise_cases_cache() -> ExerciseCasesCache | None:
+    """Return the registered worker test cases cache, or `None` if there is none."""
+    return _exercise_cases_cache
+
+
+def close_caches() -> None:
+    """Close and unregister the worker caches, if any."""
+    global _file_cache, _exercise_cache, _exercise_cases_cache
+    file_cache, _file_cache = _file_cache, None
+    _exercise_cache = None
+    _exercise_cases_cache = None
+    if file_cache is not None:
+        file_cache.close()
@@ -25,13 +25,118 @@ DEFAULT_NUM_WORKERS = 2
 # practical ceiling is the Docker host capacity, not the CPU count.
 DEFAULT_CONCURRENCY_PER_WORKER = 4
 
-# How long (seconds) the poller suppresses re-enqueueing a commit it already
-# put on the task queue. The poller re-fetches every commit that is still
-# ``STATUS_IN_QUEUE`` on each cycle; this window keeps a commit waiting for a
-# free worker from being put on the queue again and again (worker-side
-# claiming already makes such duplicates harmless, so this only saves queue
-# capacity and claim round trips).
-DEFAULT_COMMIT_ENQUEUE_SUPPRESSION = 60
+# Postgres channel the poller listens on to pick up new commits as soon as
+# they are queued (see config/rcc/commit_notify.sql). Polling continues as a
+# safety net; an empty channel disables listening.
+DEFAULT_NOTIFY_CHANNEL = "runcodes_commits"
+
+# Seconds the poller waits between two polls while it is listening on the
+# notify channel. The notifications wake it for new commits, so this only
+# bounds how late a missed notification is noticed; without a listening
+# connection it polls every ``min_sleep_time``..``max_sleep_time`` seconds.
+DEFAULT_NOTIFY_POLL_INTERVAL = 60.0
+
+# Most queued commits read from the database at once: the poller claims at
+# most this many per cycle, instead of reading the backlog in full (it is
+# thousands of rows during exam peaks).
+DEFAULT_QUEUE_PAGE_SIZE = 100
+
+# Seconds after which a commit left in progress is put back in the queue (see
+# `rcc.provider.data.DataProvider.release_stale_claims`). A crashed or killed
+# engine, or a worker that died while running a commit, cannot release its
+# claims. The default is the longest a commit may wait for its image (see
+# `rcc.images.WAIT_TIMEOUT`, 15 minutes) plus five minutes for the run itself,
+# whose compilation and execution are bounded by timeouts of seconds, so
+# commits other engines sharing the database (or the previous one, during a
+# rolling deploy) are running are left alone. 0 releases all of them when the
+# poller starts, for a single engine per database, and a negative value
+# disables the recovery.
+DEFAULT_STALE_CLAIM_AGE = 20 * 60
+
+# Seconds between two releases of stale claims by a running poller (after the
+# one it makes before its first claim).
+STALE_CLAIM_SWEEP_INTERVAL = 60.0
+
+# Seconds between the batched writes of in-progress commit states (see
+# `rcc.provider.data.Postgres.update_commit`). A commit goes through four of
+# them before its final state, which is always written right away; 0 writes
+# every state immediately.
+DEFAULT_STATUS_FLUSH_INTERVAL = 0.5
+
+# Runs of a statement on a pooled connection before psycopg prepares it on
+# the server. The data provider issues a small fixed set of statements, so
+# they are prepared right away; a negative value disables preparing (needed
+# behind a connection pooler in transaction mode).
+DEFAULT_PREPARE_THRESHOLD = 0
+
+# Upper bound for the number of concurrent object store downloads a single
+# commit runs in the prefetch phase. The actual bound mirrors
+# ``concurrency_per_worker`` (the number of commits a worker processes at
+# once), capped here so a single commit with many exercise/test-case files
+# cannot open an unbounded number of connections.
+PREFETCH_MAX_CONCURRENT_DOWNLOADS = 8
+
+# Byte budget of each worker's on-disk cache of test case inputs and expected
+# outputs (see `rcc.cache.FileCache`). Hundreds of students submit against
+# the same exercise within minutes, so a few hundred megabytes keep the hot
+# exercises off the object store. 0 disables the cache.
+DEFAULT_TEST_CASE_CACHE_SIZE = 512 * 1024 * 1024
+
+# How long (seconds) a worker trusts its cached list of an exercise's
+# compilation files and their versions (see `rcc.cache.ExerciseCache`)
+# before asking the database and the object store again. 0 disables it.
+DEFAULT_EXERCISE_CACHE_TTL = 60
+
+# Number of exercises whose test cases a worker keeps in memory (see
+# `rcc.cache.ExerciseCasesCache`). Each commit then only probes the
+# database for changes instead of reading every test case. 0 disables it.
+DEFAULT_EXERCISE_CASES_CACHE_SIZE = 256
+
+# Warm containers each worker keeps started for a language, by language name
+# (see `rcc.containers.ContainerPool`). A commit in one of these languages
+# takes an idle container instead of paying for creating and starting one;
+# every container still runs a single commit. Languages left out (and a size
+# of 0) always get a fresh container. Opt-in: the idle containers take memory
+# on the docker host and their images must provide /bin/sh.
+DEFAULT_CONTAINER_POOL: dict[str, int] = {}
+
+# Seconds between two pulls of the language images by the main process (see
+# `rcc.images.ImagePuller`). They are always pulled at startup; later pulls
+# pick up new image versions. 0 pulls them at startup only.
+DEFAULT_IMAGE_REFRESH_INTERVAL = 3600
+
+# Bytes of a commit's output zip built in memory before spilling to a
+# temporary file in its work directory (see `rcc.engine.prepare_output_file`).
+# Most outputs are a few kilobytes and are uploaded without touching the disk.
+DEFAULT_OUTPUT_SPOOL_SIZE = 16 * 1024 * 1024
+
+# How `rcc.engine.prepare_output_file` compresses each output file. Files up
+# to DEFAULT_OUTPUT_STORE_MAX_SIZE bytes, and files whose extension marks
+# them as already compressed, are stored as is: deflating them costs CPU for
+# little or no gain. Everything else is deflated at a fast level.
+DEFAULT_OUTPUT_STORE_MAX_SIZE = 4096
+DEFAULT_OUTPUT_COMPRESS_LEVEL = 1
+DEFAULT_OUTPUT_STORED_EXTENSIONS = (
+    ".7z",
+    ".bz2",
+    ".gif",
+    ".gz",
+    ".jpeg",
+    ".jpg",
+    ".pdf",
+    ".png",
+    ".xz",
+    ".zip",
+)
+
+# Result evaluation (see `rcc.engine.process_test_results_batch`): each commit
+# evaluates up to DEFAULT_EVALUATION_THREADS test cases at once, and
+# comparisons of outputs of at least DEFAULT_EVALUATION_PROCESS_MIN_SIZE bytes
+# run in a pool of DEFAULT_EVALUATION_PROCESSES processes per worker, off the
+# worker's GIL. 0 processes compares everything in the threads.
+DEFAULT_EVALUATION_THREADS = 4
+DEFAULT_EVALUATION_PROCESSES = 2
+DEFAULT_EVALUATION_PROCESS_MIN_SIZE = 1024 * 1024
 
 
 class ConfigError(ValueError):
@@ -49,6 +154,27 @@ def _env_int(name: str, default: int) -> int:
         raise ConfigError(f"{name} must be an integer, got {raw!r}") from None
 
 
+def _env_sizes(name: str, default: dict[str, int]) -> dict[str, int]:
+    """Read a ``key=size,...`` env var, raising `ConfigError` when malformed."""
+    raw = os.environ.get(name)
+    if raw is None:
+        return dict(default)
+    sizes: dict[str, int] = {}
+    for item in raw.split(","):
+        if item.strip() == "":
+            continue
+        key, sep, value = item.rpartition("=")
+        try:
+            if not sep or key.strip() == "":
+                raise ValueError(item)
+            sizes[key.strip()] = int(value)
+        except ValueError:
+            raise ConfigError(
+                f"{name} must be a list of name=size pairs, got {raw!r}"
+            ) from None
+    return sizes
+
+
 __config__: dict[str, Config] = {}
 
 
@@ -107,6 +233,15 @@ class Config:
         return repr(self.__config__)
 
 
+def _parse_int(value: object, key: str, env_var: str) -> int:
+    try:
+        return int(str(value))
+    except TypeError, ValueError:
+        raise ConfigError(
+            f"{key} ({env_var}) must be an integer, got {value!r}"
+        ) from None
+
+
 def parallelism_values(cfg: Config) -> tuple[int, int]:
     """Return ``(num_workers, concurrency_per_worker)`` from ``cfg``.
 
@@ -115,15 +250,6 @@ def parallelism_values(cfg: Config) -> tuple[int, int]:
     behave identically. Raises `ConfigError` when a value cannot be parsed
     as an integer.
     """
-
-    def _parse_int(value: object, key: str, env_var: str) -> int:
-        try:
-            return int(str(value))
-        except TypeError, ValueError:
-            raise ConfigError(
-                f"{key} ({env_var}) must be an integer, got {value!r}"
-            ) from None
-
     return (
         _parse_int(
             cfg.get("num_workers", DEFAULT_NUM_WORKERS),
@@ -154,13 +280,28 @@ def queue_maxsize(cfg: Config) -> int:
     return 2 * total_slots(cfg)
 
 
+def queue_page_size(cfg: Config) -> int:
+    """Most queued commits claimed per poller cycle and read per queue page.
+
+    Read from ``db.queue_page_size``, falling back to
+    `DEFAULT_QUEUE_PAGE_SIZE`. Raises `ConfigError` when it cannot be parsed
+    as an integer.
+    """
+    db = cast(dict[str, object], cfg.get("db", {}))
+    return _parse_int(
+        db.get("queue_page_size", DEFAULT_QUEUE_PAGE_SIZE),
+        "db.queue_page_size",
+        "RUNCODES_DB_QUEUE_PAGE_SIZE",
+    )
+
+
 def validate(cfg: Config) -> None:
     """Validate the parallelism-related values of ``cfg``.
 
     Raises `ConfigError` with a human-readable message when a value is
     missing, unparseable, or nonsensical: ``num_workers >= 1``,
-    ``concurrency >= 1``, and a bounded task queue at least as large as the
-    total number of in-flight commit slots.
+    ``concurrency >= 1``, ``queue_page_size >= 1``, and a bounded task queue
+    at least as large as the total number of in-flight commit slots.
     """
     num_workers, concurrency = parallelism_values(cfg)
     if num_workers < 1:
@@ -171,6 +312,12 @@ def validate(cfg: Config) -> None:
         raise ConfigError(
             f"concurrency_per_worker (RUNCODES_COMPILER_CONCURRENCY) must be >= 1, got {concurrency}"
         )
+    page_size = queue_page_size(cfg)
+    if page_size < 1:
+        # A page of zero commits would make the poller spin without claiming.
+        raise ConfigError(
+            f"db.queue_page_size (RUNCODES_DB_QUEUE_PAGE_SIZE) must be >= 1, got {page_size}"
+        )
     total = total_slots(cfg)
     qsize = queue_maxsize(cfg)
     if qsize < total:
@@ -189,6 +336,30 @@ class EnvConfig(Config):
             "password": os.environ.get("RUNCODES_DB_PASSWORD", "asdasd33"),
             "pool_min_size": int(os.environ.get("RUNCODES_DB_POOL_MIN_SIZE", "1")),
             "pool_timeout": float(os.environ.get("RUNCODES_DB_POOL_TIMEOUT", "30")),
+            "notify_channel": os.environ.get(
+                "RUNCODES_DB_NOTIFY_CHANNEL", DEFAULT_NOTIFY_CHANNEL
+            ),
+            "notify_poll_interval": float(
+                os.environ.get(
+                    "RUNCODES_DB_NOTIFY_POLL_INTERVAL",
+                    str(DEFAULT_NOTIFY_POLL_INTERVAL),
+                )
+            ),
+            "queue_page_size": _env_int(
+                "RUNCODES_DB_QUEUE_PAGE_SIZE", DEFAULT_QUEUE_PAGE_SIZE
+            ),
+            "stale_claim_age": _env_int(
+                "RUNCODES_DB_STALE_CLAIM_AGE", DEFAULT_STALE_CLAIM_AGE
+            ),
+            "status_flush_interval": float(
+                os.environ.get(
+                    "RUNCODES_DB_STATUS_FLUSH_INTERVAL",
+                    str(DEFAULT_STATUS_FLUSH_INTERVAL),
+                )
+            ),
+            "prepare_threshold": _env_int(
+                "RUNCODES_DB_PREPARE_THRESHOLD", DEFAULT_PREPARE_THRESHOLD
+            ),
         }
         # ``pool_max_size`` is deliberately *omitted* when the env var is
         # unset: the Postgres provider derives the maximum from the
@@ -198,25 +369,45 @@ class EnvConfig(Config):
         pool_max_env = os.environ.get("RUNCODES_DB_POOL_MAX_SIZE")
         if pool_max_env is not None:
             db_config["pool_max_size"] = int(pool_max_env)
+        s3_config: dict[str, object] = {
+            "region": os.environ.get("RUNCODES_S3_REGION", "sa-east-1"),
+            "endpoint": os.environ.get("RUNCODES_S3_ENDPOINT", "http://seaweed:8333"),
+            "access_key": os.environ.get("RUNCODES_S3_CREDENTIALS_KEY", "test_key"),
+            "secret_key": os.environ.get(
+                "RUNCODES_S3_CREDENTIALS_SECRET", "test_secret"
+            ),
+            "commits_bucket": f"{os.environ.get('RUNCODES_S3_BUCKET_PREFIX', 'runcodes')}-commits",
+            "outputfiles_bucket": f"{os.environ.get('RUNCODES_S3_BUCKET_PREFIX', 'runcodes')}-outputfiles",
+            "files_bucket": f"{os.environ.get('RUNCODES_S3_BUCKET_PREFIX', 'runcodes')}-files",
+            "cases_bucket": f"{os.environ.get('RUNCODES_S3_BUCKET_PREFIX', 'runcodes')}-cases",
+            "compilation_files_dir": "compilationfiles",
+        }
+        # Same as ``pool_max_size``: when unset, the S3 provider sizes its
+        # connection pool from the per-process concurrency.
+        s3_pool_env = os.environ.get("RUNCODES_S3_MAX_POOL_CONNECTIONS")
+        if s3_pool_env is not None:
+            s3_config["max_pool_connections"] = _env_int(
+                "RUNCODES_S3_MAX_POOL_CONNECTIONS", 0
+            )
+        local_storage_dir = os.environ.get(
+            "RUNCODES_COMPILER_LOCAL_STORAGE_DIR", "/srv/runcodes"
+        )
         env_configs: dict[str, object] = {
             "provider": {
                 "data": "postgres",
-                "storage": "s3",
+                # "s3" (boto3, in worker threads), "s3_async" (aiobotocore, on
+                # the event loop) or "local" (directories on this host)
+                "storage": os.environ.get("RUNCODES_COMPILER_STORAGE_PROVIDER", "s3"),
             },
             "db": db_config,
-            "s3": {
-                "region": os.environ.get("RUNCODES_S3_REGION", "sa-east-1"),
-                "endpoint": os.environ.get(
-                    "RUNCODES_S3_ENDPOINT", "http://seaweed:8333"
-                ),
-                "access_key": os.environ.get("RUNCODES_S3_CREDENTIALS_KEY", "test_key"),
-                "secret_key": os.environ.get(
-                    "RUNCODES_S3_CREDENTIALS_SECRET", "test_secret"
-                ),
-                "commits_bucket": f"{os.environ.get('RUNCODES_S3_BUCKET_PREFIX', 'runcodes')}-commits",
-                "outputfiles_bucket": f"{os.environ.get('RUNCODES_S3_BUCKET_PREFIX', 'runcodes')}-outputfiles",
-                "files_bucket": f"{os.environ.get('RUNCODES_S3_BUCKET_PREFIX', 'runcodes')}-files",
-                "cases_bucket": f"{os.environ.get('RUNCODES_S3_BUCKET_PREFIX', 'runcodes')}-cases",
+            "s3": s3_config,
+            # Directories used by the "local" storage provider, laid out
+            # like the S3 buckets.
+            "local": {
+                "commits_dir": os.path.join(local_storage_dir, "commits"),
+                "outputfiles_dir": os.path.join(local_storage_dir, "outputfiles"),
+                "files_dir": os.path.join(local_storage_dir, "files"),
+                "cases_dir": os.path.join(local_storage_dir, "cases"),
                 "compilation_files_dir": "compilationfiles",
             },
             "lock_file": "compiler.lock",
@@ -227,14 +418,6 @@ class EnvConfig(Config):
             "concurrency_per_worker": _env_int(
                 "RUNCODES_COMPILER_CONCURRENCY", DEFAULT_CONCURRENCY_PER_WORKER
             ),
-            # Seconds the poller waits before re-enqueueing a commit it
-            # already put on the task queue.
-            "commit_enqueue_suppression": float(
-                os.environ.get(
-                    "RUNCODES_COMPILER_ENQUEUE_SUPPRESSION",
-                    str(DEFAULT_COMMIT_ENQUEUE_SUPPRESSION),
-                )
-            ),
             "min_sleep_time": 1,
             "max_sleep_time": 15,
             "exec_dir": os.environ.get("RUNCODES_COMPILER_EXEC_DIR", "/tmp"),
@@ -242,9 +425,65 @@ class EnvConfig(Config):
                 "RUNCODES_COMPILER_EXEC_DIR_REMOTE",
                 os.environ.get("RUNCODES_COMPILER_EXEC_DIR", "/tmp"),
             ),
+            # Local cache of test case files, shared by the commits of a
+            # worker. Kept inside the exec dir by default so cached files
+            # live on the same filesystem as the commit work directories.
+            "cache_dir": os.environ.get(
+                "RUNCODES_COMPILER_CACHE_DIR",
+                os.path.join(
+                    os.environ.get("RUNCODES_COMPILER_EXEC_DIR", "/tmp"), "cache"
+                ),
+            ),
+            "test_case_cache_size": _env_int(
+                "RUNCODES_COMPILER_TEST_CASE_CACHE_SIZE", DEFAULT_TEST_CASE_CACHE_SIZE
+            ),
+            "exercise_cache_ttl": float(
+                os.environ.get(
+                    "RUNCODES_COMPILER_EXERCISE_CACHE_TTL",
+                    str(DEFAULT_EXERCISE_CACHE_TTL),
+                )
+            ),
+            "exercise_cases_cache_size": _env_int(
+                "RUNCODES_COMPILER_EXERCISE_CASES_CACHE_SIZE",
+                DEFAULT_EXERCISE_CASES_CACHE_SIZE,
+            ),
+            "container_pool": _env_sizes(
+                "RUNCODES_COMPILER_CONTAINER_POOL", DEFAULT_CONTAINER_POOL
+            ),
+            "image_refresh_interval": float(
+                os.environ.get(
+                    "RUNCODES_COMPILER_IMAGE_REFRESH_INTERVAL",
+                    str(DEFAULT_IMAGE_REFRESH_INTERVAL),
+                )
+            ),
             "src_dir": "src",
             "output_files_dir": "outputfiles",
             "max_output_file_size": 1048576,
+            "output_spool_size": _env_int(
+                "RUNCODES_COMPILER_OUTPUT_SPOOL_SIZE", DEFAULT_OUTPUT_SPOOL_SIZE
+            ),
+            "output_store_max_size": _env_int(
+                "RUNCODES_COMPILER_OUTPUT_STORE_MAX_SIZE",
+                DEFAULT_OUTPUT_STORE_MAX_SIZE,
+            ),
+            "output_compress_level": _env_int(
+                "RUNCODES_COMPILER_OUTPUT_COMPRESS_LEVEL",
+                DEFAULT_OUTPUT_COMPRESS_LEVEL,
+            ),
+            "output_stored_extensions": os.environ.get(
+                "RUNCODES_COMPILER_OUTPUT_STORED_EXTENSIONS",
+                ",".join(DEFAULT_OUTPUT_STORED_EXTENSIONS),
+            ).split(","),
+            "evaluation_threads": _env_int(
+                "RUNCODES_COMPILER_EVALUATION_THREADS", DEFAULT_EVALUATION_THREADS
+            ),
+            "evaluation_processes": _env_int(
+                "RUNCODES_COMPILER_EVALUATION_PROCESSES", DEFAULT_EVALUATION_PROCESSES
+            ),
+            "evaluation_process_min_size": _env_int(
+                "RUNCODES_COMPILER_EVALUATION_PROCESS_MIN_SIZE",
+                DEFAULT_EVALUATION_PROCESS_MIN_SIZE,
+            ),
             "compilation_error_file": "compilation.err",
             "compilation_output_file": "compilation.out",
             "compilation_timeout": float(
@@ -260,6 +499,13 @@ class EnvConfig(Config):
             "log": None,
             "cleanup_on_error": False,
         }
+        # Languages whose images are pre-pulled: every known language unless
+        # a (comma-separated) subset is configured.
+        images_env = os.environ.get("RUNCODES_COMPILER_IMAGES")
+        if images_env is not None:
+            env_configs["images"] = [
+                name.strip() for name in images_env.split(",") if name.strip()
+            ]
         super().__init__(env_configs)
 
 
@@ -0,0 +1,489 @@
+"""
+Per-worker docker client and pool of warm containers for the most used
+language images.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import shutil
+import threading
+import uuid
+from typing import cast
+
+import docker
+import docker.errors
+from docker.models.containers import Container
+
+from .config import (
+    DEFAULT_CONCURRENCY_PER_WORKER,
+    DEFAULT_CONTAINER_POOL,
+    DEFAULT_LOGGER,
+    Config,
+    ConfigError,
+)
+from .languages import KNOWN_LANGUAGES
+from .logs import attachable_from_env
+from .util import lock_pid_directory, remove_unlocked_siblings, unlock_pid_directory
+
+# FIFO in the work directory of a warm container: a line written to it lets
+# the container run.
+START_FILE = ".rcc-start"
+
+# Entrypoint of a warm container: blocks reading a line from START_FILE in the
+# mounted work directory, then runs the image's own entrypoint and command
+# (the arguments). The images start compiling as soon as they run, so this is
+# what lets a container be started before the commit it runs is known. It
+# only needs a shell: ``read`` is a builtin. If the worker goes away first,
+# the read ends without a line and the container exits.
+WAIT_ENTRYPOINT = [
+    "/bin/sh",
+    "-c",
+    f'read -r _ < /root/{START_FILE} || exit 1; rm -f /root/{START_FILE}; exec "$@"',
+    "rcc-wait",
+]
+
+# Work directories of the warm containers, inside the exec dir (so commit
+# files are moved in with a rename).
+POOL_DIR = "warm"
+
+# Permissions of the work directories (the same as the commit directories).
+WORK_DIR_PERMISSIONS = 0o777
+
+# Label holding the work directory of a warm container. Containers are always
+# removed before their work directory, so one whose directory is gone was left
+# behind by a worker that died: `ContainerPool.open` removes it.
+WORK_DIR_LABEL = "rcc.warm-work-dir"
+
+# Seconds before a warm container is started again after a failed start,
+# doubled on every further failure up to MAX_REFILL_BACKOFF.
+REFILL_BACKOFF = 1.0
+MAX_REFILL_BACKOFF = 60.0
+
+# Connections the worker's docker client keeps per in-flight commit: its
+# calls (create, attach, start, wait, kill, remove) are made one after
+# another. Log streams read a socket of their own once attached (see
+# rcc.logs), except when the docker API is behind TLS or SSH: a reader thread
+# then follows them with docker-py, holding one more connection for the
+# container's lifetime.
+CONNECTIONS_PER_COMMIT = 1
+CONNECTIONS_PER_LOG_READER = 1
+
+
+class WarmContainer:
+    """A started container waiting for its commit in its own work directory.
+
+    The worker holds START_FILE open (for reading and writing, so opening it
+    never blocks) until the commit is finished: a line written before the
+    container reaches its ``read`` stays buffered in the FIFO.
+    """
+
+    image: str
+    container: Container
+    work_dir: str
+    _start_fd: int | None
+
+    def __init__(
+        self, image: str, container: Container, work_dir: str, start_fd: int
+    ) -> None:
+        self.image = image
+        self.container = container
+        self.work_dir = work_dir
+        self._start_fd = start_fd
+
+    def start(self, base_dir: str) -> None:
+        """Move the commit files from ``base_dir`` in and let the container run.
+
+        The container's mount cannot change once it runs, so the files are
+        moved into the directory it already mounts; `finish` moves them back.
+        """
+        if self._start_fd is None:
+            raise RuntimeError("The warm container was already released")
+        for name in os.listdir(base_dir):
+            os.rename(os.path.join(base_dir, name), os.path.join(self.work_dir, name))
+        _ = os.write(self._start_fd, b"\n")
+
+    def finish(self, base_dir: str) -> None:
+        """Move the commit files (and its outputs) back to ``base_dir``."""
+        self.release()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(os.path.join(self.work_dir, START_FILE))
+        for name in os.listdir(self.work_dir):
+            os.rename(os.path.join(self.work_dir, name), os.path.join(base_dir, name))
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def release(self) -> None:
+        """Close the worker's end of START_FILE."""
+        fd, self._start_fd = self._start_fd, None
+        if fd is not None:
+            os.close(fd)
+
+
+class ContainerPool:
+    """Pool of warm containers, by image.
+
+    One pool is owned by each worker process. Containers are created and
+    started in the background, each with a fresh work directory mounted as
+    ``/root`` and waiting on `WAIT_ENTRYPOINT`. A commit takes an idle
+    container with `acquire` and runs it once: the engine removes it
+    afterwards like any other container, and the pool starts a replacement
+    right away, so isolation between commits is unchanged.
+
+    Work directories live in ``<exec_dir>/warm/<pid>``, locked while the
+    pool is open (see `rcc.util.lock_pid_directory`). :meth:`open` removes
+    the directories nobody holds locked and the containers left without a
+    work directory. All bookkeeping happens on the worker's event loop;
+    docker calls run in threads.
+    """
+
+    sizes: dict[str, int]
+    directory: str
+    remote_directory: str
+    hits: int
+    misses: int
+    failures: int
+    _closed: bool
+    _idle: dict[str, list[WarmContainer]]
+    _creating: dict[str, int]
+    _backoff: dict[str, float]
+    _retry_at: dict[str, float]
+    _refills: set[asyncio.Task[None]]
+    _lock_fd: int | None
+
+    def __init__(
+        self, sizes: dict[str, int], exec_dir: str, exec_dir_remote: str
+    ) -> None:
+        self.sizes = {image: size for image, size in sizes.items() if size > 0}
+        self.directory = os.path.join(exec_dir, POOL_DIR, str(os.getpid()))
+        self.remote_directory = os.path.join(
+            exec_dir_remote, POOL_DIR, str(os.getpid())
+        )
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self._closed = False
+        self._idle = {image: [] for image in self.sizes}
+        self._creating = dict.fromkeys(self.sizes, 0)
+        # Delay after the last failed start, and the loop time to retry at.
+        self._backoff = dict.fromkeys(self.sizes, 0.0)
+        self._retry_at = dict.fromkeys(self.sizes, 0.0)
+        self._refills = set()
+        self._lock_fd = None
+
+    def open(self) -> None:
+        """Lock the pool directory, drop leftovers and start filling the pool.
+
+        Must be called from the worker's event loop. The containers left
+        behind are removed in the background.
+        """
+        if self._lock_fd is None:
+            self._lock_fd = lock_pid_directory(self.directory)
+        remove_unlocked_siblings(self.directory)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+        sweep = asyncio.create_task(asyncio.to_thread(self._sweep))
+        self._refills.add(sweep)
+        sweep.add_done_callback(self._refills.discard)
+        for image in self.sizes:
+            self._refill(image)
+
+    async def close(self) -> None:
+        """Stop filling the pool and remove the idle containers."""
+        # The containers being created are waited for (not cancelled, which
+        # would leave them running): they are removed with the idle ones.
+        self._closed = True
+        while self._refills:
+            _ = await asyncio.gather(*self._refills, return_exceptions=True)
+        idle = [warm for containers in self._idle.values() for warm in containers]
+        for containers in self._idle.values():
+            containers.clear()
+        _ = await asyncio.gather(
+            *(asyncio.to_thread(self._discard, warm) for warm in idle),
+            return_exceptions=True,
+        )
+        shutil.rmtree(self.directory, ignore_errors=True)
+        if self._lock_fd is not None:
+            unlock_pid_directory(self.directory, self._lock_fd)
+            self._lock_fd = None
+
+    def stats(self) -> dict[str, int]:
+        """Return the counters used to size the pool."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures,
+            "idle": sum(len(containers) for containers in self._idle.values()),
+        }
+
+    async def acquire(self, image: str) -> WarmContainer | None:
+        """Take a warm container of ``image``, or `None` if none is idle.
+
+        The caller owns the container: it runs it once, removes it and
+        calls `WarmContainer.finish`. A replacement is started right away;
+        so is a missing container on a miss, once the backoff after a failed
+        start is over.
+        """
+        if image not in self.sizes:
+            return None
+        idle = self._idle[image]
+        while idle:
+            warm = idle.pop()
+            self._refill(image)
+            if await asyncio.to_thread(self._running, warm):
+                self.hits += 1
+                return warm
+            # It stopped while waiting (e.g. the docker daemon restarted).
+            await asyncio.to_thread(self._discard, warm)
+        self.misses += 1
+        self._refill(image)
+        return None
+
+    def _refill(self, image: str) -> None:
+        """Start a container of ``image`` in the background if one is missing."""
+        if self._closed:
+            return
+        if asyncio.get_running_loop().time() < self._retry_at[image]:
+            return
+        if len(self._idle[image]) + self._creating[image] >= self.sizes[image]:
+            return
+        self._creating[image] += 1
+        task = asyncio.create_task(self._add(image))
+        self._refills.add(task)
+        task.add_done_callback(self._refills.discard)
+
+    async def _add(self, image: str) -> None:
+        try:
+            warm = await asyncio.to_thread(self._create, image)
+        except Exception:
+            # Commits of this image start their own containers meanwhile;
+            # the first miss after the backoff tries again.
+            self.failures += 1
+            backoff = min(
+                max(2 * self._backoff[image], REFILL_BACKOFF), MAX_REFILL_BACKOFF
+            )
+            self._backoff[image] = backoff
+            self._retry_at[image] = asyncio.get_running_loop().time() + backoff
+            logger = logging.getLogger(DEFAULT_LOGGER)
+            logger.warning(f"Could not start a warm {image} container", exc_info=True)
+            return
+        finally:
+            self._creating[image] -= 1
+        self._backoff[image] = 0.0
+        self._retry_at[image] = 0.0
+        self._idle[image].append(warm)
+        # Refill until the pool is full.
+        self._refill(image)
+
+    def _create(self, image: str) -> WarmContainer:
+        client = docker_client()
+        image_id, command = _pinned_image(client, image)
+        name = uuid.uuid4().hex
+        work_dir = os.path.join(self.directory, name)
+        os.makedirs(work_dir, WORK_DIR_PERMISSIONS)
+        start_file = os.path.join(work_dir, START_FILE)
+        try:
+            os.mkfifo(start_file, 0o600)
+            start_fd = os.open(start_file, os.O_RDWR)
+        except BaseException:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+        try:
+            container = client.containers.run(
+                image_id,
+                command=command,
+                entrypoint=WAIT_ENTRYPOINT,
+                detach=True,
+                remove=False,
+                labels={WORK_DIR_LABEL: work_dir},
+                volumes={
+                    os.path.join(self.remote_directory, name): {
+                        "bind": "/root",
+                        "mode": "rw",
+                    }
+                },
+            )
+        except BaseException:
+            os.close(start_fd)
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+        return WarmContainer(image, container, work_dir, start_fd)
+
+    def _sweep(self) -> None:
+        """Remove the warm containers of this host whose work directory is gone.
+
+        Blocking.
+        """
+        root = os.path.dirname(self.directory)
+        logger = logging.getLogger(DEFAULT_LOGGER)
+        try:
+            containers = docker_client().containers.list(
+                all=True, filters={"label": WORK_DIR_LABEL}
+            )
+        except Exception:
+            logger.warning("Could not list leftover warm containers", exc_info=True)
+            return
+        for container in containers:
+            labels = cast(dict[str, str], container.labels)
+            work_dir = labels.get(WORK_DIR_LABEL, "")
+            # Only the pools under this exec dir: others may be on another
+            # host sharing the daemon.
+            if os.path.dirname(os.path.dirname(work_dir)) != root:
+                continue
+            if os.path.isdir(work_dir):
+                continue
+            try:
+                container.remove(force=True)
+            except docker.errors.APIError:
+                logger.warning(
+                    "Could not remove a leftover warm container", exc_info=True
+                )
+
+    @staticmethod
+    def _running(warm: WarmContainer) -> bool:
+        try:
+            warm.container.reload()
+        except docker.errors.APIError:
+            return False
+        return warm.container.status == "running"
+
+    @staticmethod
+    def _discard(warm: WarmContainer) -> None:
+        try:
+            warm.container.remove(force=True)
+        except docker.errors.APIError:
+            logger = logging.getLogger(DEFAULT_LOGGER)
+            logger.warning("Could not remove a warm container", exc_info=True)
+        warm.release()
+        shutil.rmtree(warm.work_dir, ignore_errors=True)
+
+
+def _pinned_image(client: docker.DockerClient, image: str) -> tuple[str, list[str]]:
+    """The id of the local ``image`` and the entrypoint and command it runs.
+
+    Containers are started from the id, so they never pull: an image that is
+    not present yet (see `rcc.images.ImagePuller`) raises `ImageNotFound`.
+    """
+    pulled = client.images.get(image)
+    image_cfg = cast(dict[str, list[str] | None], pulled.attrs.get("Config") or {})
+    command = (image_cfg.get("Entrypoint") or []) + (image_cfg.get("Cmd") or [])
+    if not command:
+        raise RuntimeError(f"Image {image} defines no command to run")
+    return pulled.id or image, command
+
+
+# The worker's docker client (see open_docker_client) and its pool size.
+_client: docker.DockerClient | None = None
+_client_pool_size: int | None = None
+_client_lock = threading.Lock()
+
+
+def open_docker_client(cfg: Config) -> None:
+    """Register the worker's docker client, shared by all in-flight commits.
+
+    The client is only created on first use (see `docker_client`), so a
+    docker daemon that is down when the worker starts fails the commits that
+    need it, not the worker. Its connection pool is sized for the commits
+    and the warm containers the worker runs at once.
+    """
+    global _client_pool_size
+    if _client_pool_size is not None:
+        raise RuntimeError("The docker client is already open")
+    concurrency = int(
+        str(cfg.get("concurrency_per_worker", DEFAULT_CONCURRENCY_PER_WORKER))
+    )
+    per_commit = CONNECTIONS_PER_COMMIT
+    if not attachable_from_env():
+        per_commit += CONNECTIONS_PER_LOG_READER
+    _client_pool_size = max(1, concurrency) * per_commit + sum(
+        max(0, size) for size in pool_sizes(cfg).values()
+    )
+
+
+def docker_client() -> docker.DockerClient:
+    """Return the worker's docker client, creating it on first use.
+
+    Blocking (the first call negotiates the API version with the daemon):
+    call it from a thread. The client is safe to share between threads: each
+    request takes a connection from its pool. Outside a worker (no
+    `open_docker_client`), a new client is created on every call.
+    """
+    global _client
+    if _client_pool_size is None:
+        return docker.from_env()
+    with _client_lock:
+        if _client is None:
+            _client = docker.from_env(max_pool_size=_client_pool_size)
+        return _client
+
+
+def close_docker_client() -> None:
+    """Close the worker's docker client (if created) and unregister it."""
+    global _client, _client_pool_size
+    with _client_lock:
+        client, _client = _client, None
+        _client_pool_size = None
+    if client is not None:
+        client.close()
+
+
+def pool_sizes(cfg: Config) -> dict[str, int]:
+    """Warm containers to keep per image, from ``cfg.container_pool``.
+
+    The configuration names languages; raises `ConfigError` for an unknown
+    language or a size that is not an integer.
+    """
+    configured = cast(
+        dict[str, object], cfg.get("container_pool", DEFAULT_CONTAINER_POOL)
+    )
+    images = {language.name: language.image for language in KNOWN_LANGUAGES}
+    sizes: dict[str, int] = {}
+    for name, size in configured.items():
+        if name not in images:
+            raise ConfigError(f"container_pool: unknown language {name!r}")
+        try:
+            sizes[images[name]] = int(str(size))
+        except ValueError:
+            raise ConfigError(
+                f"container_pool: size of {name} must be an integer, got {size!r}"
+            ) from None
+    return sizes
+
+
+def from_config(cfg: Config) -> ContainerPool | None:
+    """Create a worker's warm container pool, or `None` when it is disabled."""
+    sizes = pool_sizes(cfg)
+    if not any(size > 0 for size in sizes.values()):
+        return None
+    return ContainerPool(sizes, str(cfg.exec_dir), str(cfg.exec_dir_remote))
+
+
+# This worker's warm container pool (see open_container_pool).
+_pool: ContainerPool | None = None
+
+
+def open_container_pool(cfg: Config) -> None:
+    """Create, open and register the worker's container pool (if enabled).
+
+    Called once per worker process from its event loop.
+    """
+    global _pool
+    if _pool is not None:
+        raise RuntimeError("The container pool is already open")
+    pool = from_config(cfg)
+    if pool is not None:
+        pool.open()
+    _pool = pool
+
+
+def get_container_pool() -> ContainerPool | None:
+    """Return the registered worker container pool, or `None` if there is none."""
+    return _pool
+
+
+async def close_container_pool() -> None:
+    """Remove the idle containers and unregister the worker pool, if any."""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
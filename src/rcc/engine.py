@@ -1,4 +1,5 @@
 import asyncio
+import concurrent.futures
 import configparser
 import datetime
 import filecmp
@@ -9,25 +10,58 @@ import os
 import queue
 import shutil
 import sys
+import tempfile
 import threading
 import zipfile
-from collections.abc import Iterable
-from typing import TYPE_CHECKING, cast
+from collections.abc import Callable, Iterable
+from typing import IO, TYPE_CHECKING, cast
 
-import docker
+import docker.errors
 import requests
-
+from docker.models.containers import Container
+
+from .cache import (
+    close_caches,
+    get_exercise_cache,
+    get_exercise_cases_cache,
+    get_file_cache,
+    open_caches,
+)
 from .cmp import number_cmp, text_cmp, text_cmp2
 from .config import (
     DEFAULT_CONCURRENCY_PER_WORKER,
     DEFAULT_CONFIG,
+    DEFAULT_EVALUATION_PROCESS_MIN_SIZE,
+    DEFAULT_EVALUATION_PROCESSES,
+    DEFAULT_EVALUATION_THREADS,
     DEFAULT_LOGGER,
+    DEFAULT_OUTPUT_COMPRESS_LEVEL,
+    DEFAULT_OUTPUT_SPOOL_SIZE,
+    DEFAULT_OUTPUT_STORE_MAX_SIZE,
+    DEFAULT_OUTPUT_STORED_EXTENSIONS,
+    PREFETCH_MAX_CONCURRENT_DOWNLOADS,
     Config,
     from_dict,
     get_config,
 )
+from .containers import (
+    close_container_pool,
+    close_docker_client,
+    docker_client,
+    get_container_pool,
+    open_container_pool,
+    open_docker_client,
+)
+from .images import close_image_pins, get_image_pins, open_image_pins
 from .languages import language_from_extension
-from .model import Commit, TestCase, TestCaseResult
+from .logs import (
+    END,
+    LogStream,
+    close_log_streams,
+    get_log_streams,
+    open_log_streams,
+)
+from .model import Commit, PackedCommit, TestCase, TestCaseResult
 from .provider import storage
 from .util import (
     UninterruptibleContext,
@@ -39,10 +73,18 @@ from .util import (
 
 if TYPE_CHECKING:
     from .provider.data import DataProvider
-    from .provider.storage import StorageProvider
+    from .provider.storage import AsyncStorageProvider, StorageProvider
 
 DEFAULT_MKDIR_PERMISSIONS = 0o777
 
+# This worker's process pool for large output comparisons (see
+# open_compare_pool).
+_compare_pool: concurrent.futures.ProcessPoolExecutor | None = None
+
+# The expected outputs are never mounted in a container: only the worker
+# itself needs to read them.
+EXPECTED_OUTPUTS_DIR_PERMISSIONS = 0o700
+
 # How long a worker's pull loop waits on an empty task queue before checking
 # whether a non-retryable failure in an in-flight commit must stop the worker.
 QUEUE_GET_POLL_TIMEOUT = 1.0
@@ -52,11 +94,14 @@ QUEUE_GET_POLL_TIMEOUT = 1.0
 # it never blocks process exit.
 CONTAINER_LOG_READER_JOIN_TIMEOUT = 5.0
 
-# Upper bound for the number of concurrent S3 downloads in the prefetch phase.
-# The actual bound mirrors ``concurrency_per_worker`` (the number of commits a
-# worker processes at once), capped here so a single commit with many
-# exercise/test-case files cannot open an unbounded number of connections.
-PREFETCH_MAX_CONCURRENT_DOWNLOADS = 8
+# Log line with which a container reports that a test case finished running,
+# followed by the test case id. Its output files are complete: the engine
+# evaluates it while the following test cases run.
+CASE_DONE_MESSAGE = "case.done"
+
+# Read size when copying output files into the commit's output zip: bounds
+# the memory used per file regardless of how much the program wrote.
+OUTPUT_COPY_BUFFER_SIZE = 64 * 1024
 
 
 def _get_config() -> Config:
@@ -67,6 +112,19 @@ def _get_config() -> Config:
     return cfg
 
 
+def max_concurrent_downloads(cfg: Config) -> int:
+    """Bound for the parallel object store downloads of a single commit.
+
+    Mirrors the per-worker commit concurrency so a worker never opens more
+    simultaneous downloads than it has in-flight commits, capped at a sane
+    small maximum (and never zero, which would deadlock every download).
+    """
+    concurrency = int(
+        str(cfg.get("concurrency_per_worker", DEFAULT_CONCURRENCY_PER_WORKER))
+    )
+    return max(1, min(concurrency, PREFETCH_MAX_CONCURRENT_DOWNLOADS))
+
+
 def set_extension(commit: Commit) -> None:
     if commit.fname is None:
         raise ValueError("Commit has no filename; cannot deduce its extension")
@@ -74,18 +132,6 @@ def set_extension(commit: Commit) -> None:
     commit.extension = standardize_extension(extension[1:])
 
 
-def _raise_first_error(results: Iterable[BaseException | None]) -> None:
-    """Re-raise the first exception in a ``gather(return_exceptions=True)`` list.
-
-    Used after each concurrent download batch: every in-flight download has
-    finished by the time this is called, so the caller's cleanup (which may
-    delete ``base_dir``) can never race a worker thread still writing into it.
-    """
-    for result in results:
-        if isinstance(result, BaseException):
-            raise result
-
-
 def _mark_task_done(task: asyncio.Task[None]) -> None:
     """Retrieve a finished task's outcome (suppress 'never retrieved' warnings).
 
@@ -110,8 +156,74 @@ async def _await_task(task: asyncio.Task[None]) -> Exception | None:
     return None
 
 
+def test_case_cache_key(test_case: TestCase, name: str) -> str | None:
+    """Key of a test case file (``in`` or ``out``) in the worker's cache.
+
+    The key embeds ``last_update``, so editing a test case makes its old
+    entries unreachable (they age out of the LRU). Test cases without a
+    ``last_update`` cannot be told apart across edits and are never cached.
+    """
+    if test_case.last_update is None:
+        return None
+    return f"cases/{test_case.id}/{test_case.last_update.isoformat()}/{name}"
+
+
+async def fetch_objects(
+    storage_provider: StorageProvider | AsyncStorageProvider,
+    objects: list[tuple[str, str, str, str | None]],
+    max_concurrency: int,
+    link: bool = False,
+) -> None:
+    """Download every ``(bucket, key, destination, cache_key)`` of ``objects``.
+
+    The objects are handed to the storage provider's ``fetch_many`` as one
+    batch, bounded by ``max_concurrency``. Objects with a ``cache_key`` go
+    through the worker's cache: hits never reach the provider and misses join
+    the batch. Objects without one (or when the worker has no cache) are
+    downloaded straight into ``destination``. ``link`` lets cached files be
+    hardlinked (see `rcc.cache.materialize`): only for destinations outside
+    the directory mounted in the container.
+    """
+    provider = storage.to_async(storage_provider)
+    file_cache = get_file_cache()
+    uncached = [
+        (bucket, key, destination)
+        for bucket, key, destination, cache_key in objects
+        if file_cache is None or cache_key is None
+    ]
+    cached = {
+        cache_key: (bucket, key)
+        for bucket, key, _, cache_key in objects
+        if cache_key is not None
+    }
+    if file_cache is None or not cached:
+        await provider.fetch_many(uncached, max_concurrency)
+        return
+
+    async def fill(misses: list[tuple[str, str]]) -> None:
+        # The first call carries the uncached objects along; later ones only
+        # retry entries whose concurrent download failed elsewhere.
+        nonlocal uncached
+        batch = [(*cached[cache_key], path) for cache_key, path in misses]
+        batch.extend(uncached)
+        uncached = []
+        await provider.fetch_many(batch, max_concurrency)
+
+    await file_cache.fetch_many(
+        [
+            (cache_key, destination)
+            for _, _, destination, cache_key in objects
+            if cache_key is not None
+        ],
+        fill,
+        link,
+    )
+
+
 async def download_commit_file(
-    storage_provider: StorageProvider, commit: Commit, base_dir: str
+    storage_provider: StorageProvider | AsyncStorageProvider,
+    commit: Commit,
+    base_dir: str,
 ) -> None:
     """Download the commit source file into ``<base_dir>/<cfg.src_dir>``.
 
@@ -124,23 +236,22 @@ async def download_commit_file(
     src_dir = os.path.join(base_dir, str(cfg.src_dir))
     os.makedirs(src_dir, DEFAULT_MKDIR_PERMISSIONS)
     destination = os.path.join(src_dir, os.path.basename(commit.fname))
-    # boto3 download runs in a worker thread
-    await asyncio.to_thread(storage_provider.fetch_commit_file, commit, destination)
+    await storage.to_async(storage_provider).fetch_commit_file(commit, destination)
 
 
 async def copy_source_files(
     data_provider: DataProvider,
-    storage_provider: StorageProvider,
+    storage_provider: StorageProvider | AsyncStorageProvider,
     commit: Commit,
     base_dir: str,
-    semaphore: asyncio.Semaphore,
+    max_concurrency: int,
 ) -> None:
     """Copy the exercise's extra source files into ``<base_dir>/<cfg.src_dir>``.
 
     The commit file itself was already downloaded concurrently with the
     prefetch queries (see :func:`download_commit_file`); zip handling happens
-    here. Exercise-file downloads are independent of each other and run
-    concurrently, bounded by ``semaphore``.
+    here. The exercise files are fetched as one batch of up to
+    ``max_concurrency`` parallel downloads.
     """
     fname = commit.fname
     if fname is None:
@@ -162,56 +273,149 @@ async def copy_source_files(
     commit.is_compilable = is_compilable(extension)
 
     # Copy files uploaded with exercise
-    fnames = await data_provider.fetch_exercise_files(commit)
-
-    async def copy_exercise_file(fname: str) -> None:
+    files = await fetch_exercise_files(
+        data_provider, storage_provider, commit, max_concurrency
+    )
+    objects: list[tuple[str, str, str, str | None]] = []
+    for fname, version in files:
         source = os.path.join(str(commit.real_exercise_id), fname)
         file_destination = os.path.join(src_dir, os.path.basename(fname))
-        async with semaphore:
-            await asyncio.to_thread(
-                storage_provider.fetch_exercise_file, source, file_destination
-            )
+        key = None
+        if version is not None:
+            key = f"exercises/{commit.real_exercise_id}/{fname}/{version}"
+        objects.append((storage.BUCKET_FILES, source, file_destination, key))
+    await fetch_objects(storage_provider, objects, max_concurrency)
+
+
+async def fetch_exercise_files(
+    data_provider: DataProvider,
+    storage_provider: StorageProvider | AsyncStorageProvider,
+    commit: Commit,
+    max_concurrency: int,
+) -> list[tuple[str, str | None]]:
+    """Return the exercise's compilation files with their versions.
+
+    Goes through the worker's exercise cache: the file list comes from the
+    database and every file's version from the storage provider (a HEAD
+    request, up to ``max_concurrency`` at once) only when the exercise's entry is
+    missing or expired. Without an exercise cache the versions are `None`
+    and the files are never cached.
+    """
+    exercise_cache = get_exercise_cache()
+    if exercise_cache is None:
+        return [
+            (fname, None) for fname in await data_provider.fetch_exercise_files(commit)
+        ]
+
+    provider = storage.to_async(storage_provider)
+    semaphore = asyncio.Semaphore(max_concurrency)
 
-    results = await asyncio.gather(
-        *(copy_exercise_file(fname) for fname in fnames), return_exceptions=True
+    async def load() -> list[tuple[str, str | None]]:
+        fnames = await data_provider.fetch_exercise_files(commit)
+
+        async def fetch_version(fname: str) -> str | None:
+            source = os.path.join(str(commit.real_exercise_id), fname)
+            async with semaphore:
+                return await provider.fetch_exercise_file_version(source)
+
+        versions = await asyncio.gather(*(fetch_version(f) for f in fnames))
+        return list(zip(fnames, versions))
+
+    return list(await exercise_cache.get(commit.real_exercise_id, load))
+
+
+async def fetch_test_cases(
+    data_provider: DataProvider, commit: Commit
+) -> list[TestCase]:
+    """Return the commit's test cases.
+
+    Goes through the worker's exercise test cases cache, which only reads
+    them again when the database reports a new version; without it they are
+    always read.
+    """
+    exercise_cases_cache = get_exercise_cases_cache()
+    if exercise_cases_cache is None:
+        return await data_provider.fetch_test_cases(commit)
+    return await exercise_cases_cache.get(
+        commit.real_exercise_id,
+        lambda: data_provider.fetch_test_cases_version(commit),
+        lambda: data_provider.fetch_test_cases(commit),
     )
-    _raise_first_error(results)
 
 
 async def copy_test_case_files(
-    storage_provider: StorageProvider,
+    storage_provider: StorageProvider | AsyncStorageProvider,
     test_cases: list[TestCase],
     base_dir: str,
-    semaphore: asyncio.Semaphore,
+    max_concurrency: int,
 ) -> None:
-    """Download every test case's input and additional files concurrently.
+    """Download every test case's input and additional files.
 
-    Each test case's downloads are independent of the others', so one task per
-    test case runs in parallel, bounded by ``semaphore``. Directory creation
-    stays per test case, right before that case's additional files are
-    downloaded.
+    The inputs (through the worker's cache) and the additional files of all
+    test cases are fetched as one batch of up to ``max_concurrency`` parallel
+    downloads, after creating every test case's directory.
     """
-
-    async def copy_one(test_case: TestCase) -> None:
-        # Copy test case input file (boto3 call in a worker thread)
-        dest = os.path.join(base_dir, f"{test_case.id}.in")
-        async with semaphore:
-            await asyncio.to_thread(
-                storage_provider.fetch_test_case_input_file, test_case, dest
+    objects: list[tuple[str, str, str, str | None]] = []
+    for test_case in test_cases:
+        objects.append(
+            (
+                storage.BUCKET_CASES,
+                storage.test_case_key(test_case, "in"),
+                os.path.join(base_dir, f"{test_case.id}.in"),
+                test_case_cache_key(test_case, "in"),
             )
-
-        # Copy additional files uploaded to this test case
+        )
+        # Additional files uploaded to this test case
         test_case_dir = os.path.join(base_dir, f"test_{test_case.id}")
         os.makedirs(test_case_dir, DEFAULT_MKDIR_PERMISSIONS)
-        async with semaphore:
-            await asyncio.to_thread(
-                storage_provider.fetch_test_case_files, test_case, test_case_dir
+        objects.extend(
+            (
+                storage.BUCKET_CASES,
+                storage.test_case_key(test_case, f"files/{fname}"),
+                os.path.join(test_case_dir, fname),
+                None,
             )
+            for fname in test_case.files
+        )
+    await fetch_objects(storage_provider, objects, max_concurrency)
+
+
+def expected_outputs_dir(base_dir: str) -> str:
+    """Directory of a commit's expected outputs while its container runs.
 
-    results = await asyncio.gather(
-        *(copy_one(test_case) for test_case in test_cases), return_exceptions=True
+    A sibling of ``base_dir``: only ``base_dir`` is mounted in the container,
+    so the submitted program can never read the expected outputs.
+    """
+    return f"{base_dir}.expected"
+
+
+async def copy_expected_outputs(
+    storage_provider: StorageProvider | AsyncStorageProvider,
+    test_cases: list[TestCase],
+    expected_dir: str,
+    max_concurrency: int,
+) -> None:
+    """Download every test case's expected output into ``expected_dir``.
+
+    Fetched as one batch of up to ``max_concurrency`` parallel downloads,
+    through the worker's cache. The directory is never mounted in a
+    container, so cached files may be hardlinked into it.
+    """
+    os.makedirs(expected_dir, EXPECTED_OUTPUTS_DIR_PERMISSIONS, exist_ok=True)
+    await fetch_objects(
+        storage_provider,
+        [
+            (
+                storage.BUCKET_CASES,
+                storage.test_case_key(test_case, "out"),
+                os.path.join(expected_dir, f"{test_case.id}.out"),
+                test_case_cache_key(test_case, "out"),
+            )
+            for test_case in test_cases
+        ],
+        max_concurrency,
+        link=True,
     )
-    _raise_first_error(results)
 
 
 def create_container_cfg_file(
@@ -255,12 +459,55 @@ def diff(
     raise ValueError(f"Unknown test case output type: {output_type}")
 
 
+def open_compare_pool(cfg: Config) -> None:
+    """Create this worker's process pool for large output comparisons.
+
+    Its processes start on demand, so a worker that never compares large
+    outputs never pays for them. Without processes configured, every
+    comparison runs in the evaluating thread.
+    """
+    global _compare_pool
+    if _compare_pool is not None:
+        raise RuntimeError("The compare pool is already open")
+    processes = int(str(cfg.get("evaluation_processes", DEFAULT_EVALUATION_PROCESSES)))
+    if processes > 0:
+        _compare_pool = concurrent.futures.ProcessPoolExecutor(processes)
+
+
+def close_compare_pool() -> None:
+    """Shut this worker's compare pool down (no-op when it is not open)."""
+    global _compare_pool
+    if _compare_pool is not None:
+        _compare_pool.shutdown(cancel_futures=True)
+        _compare_pool = None
+
+
+def compare_outputs(
+    user_fname: str, test_fname: str, output_type: int, abs_error: float | None
+) -> int:
+    """Run :func:`diff`, in the worker's compare pool for large outputs.
+
+    Comparing multi-megabyte outputs is CPU-bound Python: in a thread it would
+    hold the GIL against the rest of the worker.
+    """
+    cfg = _get_config()
+    min_size = int(
+        str(cfg.get("evaluation_process_min_size", DEFAULT_EVALUATION_PROCESS_MIN_SIZE))
+    )
+    pool = _compare_pool
+    if pool is None or os.stat(user_fname).st_size < min_size:
+        return diff(user_fname, test_fname, output_type, abs_error)
+    return pool.submit(diff, user_fname, test_fname, output_type, abs_error).result()
+
+
 def process_test_results(
-    storage_provider: StorageProvider,
-    commit: Commit,
-    test_case: TestCase,
-    base_dir: str,
+    commit: Commit, test_case: TestCase, base_dir: str, expected_dir: str
 ) -> TestCaseResult:
+    """Evaluate one test case's output (sync, runs in a worker thread).
+
+    The expected output was already downloaded into ``expected_dir`` (see
+    :func:`copy_expected_outputs`).
+    """
     logger = logging.getLogger(DEFAULT_LOGGER)
     user_out_fname = os.path.join(base_dir, f"{test_case.id}.output")
     user_err_fname = os.path.join(base_dir, f"{test_case.id}.error")
@@ -272,15 +519,14 @@ def process_test_results(
     if len(run_info["info"]["signal"]) != 0 or user_err_stat.st_size != 0:
         test_status = TestCaseResult.STATUS_INCORRECT
     else:
-        test_out_fname = os.path.join(base_dir, f"{test_case.id}.out")
-        storage_provider.fetch_test_case_output_file(test_case, test_out_fname)
+        test_out_fname = os.path.join(expected_dir, f"{test_case.id}.out")
         if (
             test_case.output_type == TestCase.IO_TYPE_NUMERIC
             and test_case.abs_error is None
         ):
             logger.debug(f"[{commit.id}] ({test_case.id}) Error margin is not set")
             test_case.abs_error = 0.0
-        test_status = diff(
+        test_status = compare_outputs(
             user_out_fname, test_out_fname, test_case.output_type, test_case.abs_error
         )
     return TestCaseResult(
@@ -295,6 +541,9 @@ def process_test_results(
 class ContainerLogReader:
     """Bridge between docker-py's blocking log generator and asyncio.
 
+    Only used when the worker cannot follow logs on its event loop (see
+    `rcc.logs.LogStreams`), e.g. for a docker API behind TLS.
+
     ``container.logs(stream=True)`` returns a blocking generator: iterating it
     on the event loop would stall the whole worker for the container's
     lifetime. Instead, a daemon reader thread consumes the generator and
@@ -316,8 +565,8 @@ class ContainerLogReader:
     the previous synchronous ``next(outputs)`` reads.
     """
 
-    # Sentinel pushed once the log stream ends.
-    END: object = object()
+    # Sentinel pushed once the log stream ends (the same as `LogStream`'s).
+    END: object = END
 
     _generator: Iterable[bytes | str]
     _loop: asyncio.AbstractEventLoop
@@ -379,22 +628,50 @@ class ContainerLogReader:
 
 
 async def expect_message(
-    log_reader: ContainerLogReader, expected: str, timeout: float
+    log_reader: ContainerLogReader | LogStream, expected: str, timeout: float
 ) -> None:
     """Wait for the next line of the container's log stream to be ``expected``.
 
-    Reads decoded, stripped lines from the :class:`ContainerLogReader` queue.
+    Reads decoded, stripped lines from the :class:`ContainerLogReader` or
+    `rcc.logs.LogStream` queue.
     Raises ``TimeoutError`` when nothing arrives within ``timeout`` seconds,
     ``RuntimeError`` when the stream ends early, and ``RuntimeError`` when the
     stream delivers an unexpected line.
     """
     message = await asyncio.wait_for(log_reader.get(), timeout)
-    if message is ContainerLogReader.END:
+    if message is END:
         raise RuntimeError(f"Container log stream ended before receiving `{expected}`")
     if message != expected:
         raise RuntimeError(f"Expected `{expected}`, got `{message}`")
 
 
+async def expect_run_done(
+    log_reader: ContainerLogReader | LogStream,
+    timeout: float,
+    case_done: Callable[[int], None] | None = None,
+) -> None:
+    """Wait for ``run.done``, reporting the test cases done on the way.
+
+    Each ``case.done <id>`` line before it is handed to ``case_done`` (and
+    skipped without one). Raises like :func:`expect_message`; ``timeout``
+    bounds the whole wait.
+    """
+    async with asyncio.timeout(timeout):
+        while True:
+            message = await log_reader.get()
+            if message is END:
+                raise RuntimeError(
+                    "Container log stream ended before receiving `run.done`"
+                )
+            if message == "run.done":
+                return
+            name, _, case_id = str(message).partition(" ")
+            if name != CASE_DONE_MESSAGE or not case_id.isdigit():
+                raise RuntimeError(f"Expected `run.done`, got `{message}`")
+            if case_done is not None:
+                case_done(int(case_id))
+
+
 def _read_compilation_error_file(fname: str) -> str:
     """Read the compiler's error output file, tolerating undecodable bytes.
 
@@ -411,44 +688,142 @@ async def run(
     test_cases: list[TestCase],
     base_dir: str,
     remote_dir: str,
+    evaluator: CaseEvaluator | None = None,
 ) -> None:
     """Run the submitted code in a container, streaming its log messages.
 
-    Every blocking docker SDK call (client creation, container start, the log
-    stream, ``wait``/``kill``/``remove``) is offloaded to a worker thread so
-    the event loop stays free to process other commits while the container
-    runs. Container logs are pumped into the loop by a dedicated reader thread
-    (see :class:`ContainerLogReader`) and awaited via :func:`expect_message`.
-
-    A fresh docker client is created per commit: each concurrent task gets its
-    own client, which also sidesteps docker-py thread-safety questions.
+    Every blocking docker SDK call (client creation, container creation and
+    start, ``wait``/``kill``/``remove``) is offloaded to a worker thread so the
+    event loop stays free to process other commits while the container runs.
+    Container logs are attached to before the container runs and followed by
+    the event loop itself (see `rcc.logs`), or by a dedicated reader thread
+    when the docker API gives no plain attach socket (see
+    :class:`ContainerLogReader`), and awaited via :func:`expect_message`.
+
+    When the worker's container pool (see `rcc.containers`) has an idle
+    container of the language's image, the commit files are moved into its
+    work directory and it runs them; otherwise a container is created for the
+    commit. Either way the container runs this commit only. All docker calls
+    go through the worker's shared client (see
+    `rcc.containers.docker_client`), so they reuse its pooled connections.
+
+    Test cases the container reports done are handed to ``evaluator``, whose
+    evaluations finish before this returns (the outputs of a warm container
+    are moved afterwards).
     """
-    logger = logging.getLogger(DEFAULT_LOGGER)
-    cfg = _get_config()
-
-    client = await asyncio.to_thread(docker.from_env)
-    volumes: dict[str, dict[str, str]] = {
-        remote_dir: {"bind": "/root", "mode": "rw"},
-    }
     language = commit.language
     if language is None:
         raise RuntimeError("Commit has no language; cannot start its container")
-    container = await asyncio.to_thread(
-        client.containers.run,
-        language.image,
-        detach=True,
-        remove=False,
-        volumes=volumes,
-    )
+    pool = get_container_pool()
+    warm = await pool.acquire(language.image) if pool is not None else None
+    if warm is not None:
+        container = warm.container
+        # The container sees the commit files in its own work directory.
+        work_dir = warm.work_dir
+    else:
+        # Create from the pulled image's id, so docker never pulls here; an
+        # image that is still missing is pulled on the commit's time.
+        pins = get_image_pins()
+        image = await pins.resolve(language.image) if pins is not None else None
+        volumes: dict[str, dict[str, str]] = {
+            remote_dir: {"bind": "/root", "mode": "rw"},
+        }
+        container = await asyncio.to_thread(
+            _create_container, image or language.image, volumes
+        )
+        work_dir = base_dir
 
-    log_reader = ContainerLogReader(
-        cast(
-            Iterable[bytes],
-            await asyncio.to_thread(container.logs, stream=True),
-        ),
-        asyncio.get_running_loop(),
-    )
-    log_reader.start()
+    log_stream: LogStream | None = None
+    try:
+        # Attached before the container writes anything, so the stream holds
+        # its whole output (see `rcc.logs`).
+        log_stream = await _attach_log_stream(container)
+        if warm is not None:
+            await asyncio.to_thread(warm.start, base_dir)
+        else:
+            await asyncio.to_thread(container.start)
+    except BaseException:
+        if log_stream is not None:
+            log_stream.stop()
+        await asyncio.to_thread(container.remove, force=True)
+        if warm is not None:
+            await asyncio.to_thread(warm.finish, base_dir)
+        raise
+
+    try:
+        await _run_container(
+            data_provider,
+            commit,
+            test_cases,
+            container,
+            work_dir,
+            log_stream,
+            evaluator,
+        )
+    finally:
+        if evaluator is not None:
+            # They read the outputs where the container wrote them.
+            await evaluator.wait()
+        if warm is not None:
+            # Hand the files (and the outputs) back to the commit.
+            await asyncio.to_thread(warm.finish, base_dir)
+
+
+def _create_container(image: str, volumes: dict[str, dict[str, str]]) -> Container:
+    """Create (without starting) a container of ``image``.
+
+    Blocking. Like ``containers.run``, a missing image is pulled first.
+    """
+    client = docker_client()
+    try:
+        return client.containers.create(image, volumes=volumes)
+    except docker.errors.ImageNotFound:
+        _ = client.images.pull(image)
+        return client.containers.create(image, volumes=volumes)
+
+
+async def _attach_log_stream(container: Container) -> LogStream | None:
+    """Attach the worker's log streams to a container that has not run yet.
+
+    `None` when the worker has no log streams (see `rcc.logs.LogStreams`):
+    the container's log is then read with docker-py once it started.
+    """
+    streams = get_log_streams()
+    if streams is None or container.id is None or not container.client:
+        return None
+    tty = bool(cast(dict[str, object], container.attrs.get("Config", {})).get("Tty"))
+    return await streams.follow(container.client.api, container.id, tty)
+
+
+async def _run_container(
+    data_provider: DataProvider,
+    commit: Commit,
+    test_cases: list[TestCase],
+    container: Container,
+    work_dir: str,
+    log_stream: LogStream | None,
+    evaluator: CaseEvaluator | None = None,
+) -> None:
+    """Follow a started container of `run` through compilation and execution.
+
+    Its log is read from ``log_stream`` (followed by the event loop, with no
+    thread of its own), or with docker-py in a reader thread without one.
+    """
+    logger = logging.getLogger(DEFAULT_LOGGER)
+    cfg = _get_config()
+
+    log_reader: ContainerLogReader | LogStream
+    if log_stream is not None:
+        log_reader = log_stream
+    else:
+        log_reader = ContainerLogReader(
+            cast(
+                Iterable[bytes],
+                await asyncio.to_thread(container.logs, stream=True),
+            ),
+            asyncio.get_running_loop(),
+        )
+        log_reader.start()
 
     try:
         if commit.is_compilable:
@@ -468,7 +843,7 @@ async def run(
                     log_reader, "compilation.done", cast(float, cfg.compilation_timeout)
                 )
 
-                err_fname = os.path.join(base_dir, str(cfg.compilation_error_file))
+                err_fname = os.path.join(work_dir, str(cfg.compilation_error_file))
                 compiled_error = await asyncio.to_thread(
                     _read_compilation_error_file, err_fname
                 )
@@ -502,8 +877,14 @@ async def run(
                 commit.status = Commit.STATUS_RUNNING
                 await data_provider.update_commit(commit)
 
-                # Test cases execution done
-                await expect_message(log_reader, "run.done", timeout)
+                # Test cases execution done (evaluating each one reported)
+                await expect_run_done(
+                    log_reader,
+                    timeout,
+                    None
+                    if evaluator is None
+                    else lambda case_id: evaluator.case_done(case_id, work_dir),
+                )
             except TimeoutError:
                 logger.warning("Execution timed out", exc_info=True)
                 raise RuntimeError("Execution timed out")
@@ -526,7 +907,7 @@ async def run(
 
 async def run_tests(
     data_provider: DataProvider,
-    storage_provider: StorageProvider,
+    storage_provider: StorageProvider | AsyncStorageProvider,
     commit: Commit,
     test_cases: list[TestCase],
     base_dir: str,
@@ -535,62 +916,221 @@ async def run_tests(
     """Run the submitted code in a container and collect the test results.
 
     Runs on the caller's event loop so commit status updates can be pushed to
-    the (async) data provider.
+    the (async) data provider. The expected outputs do not depend on the run:
+    they are downloaded while the container runs, into a directory next to
+    (never inside) the one mounted in the container, and removed afterwards.
+    Test cases are evaluated as the container reports them done (see
+    `CaseEvaluator`), overlapping comparison with the execution of the next
+    ones.
     """
-    await run(data_provider, commit, test_cases, base_dir, remote_dir)
-
-    if commit.status == Commit.STATUS_ERROR:
-        return []
-    # `process_test_results` is synchronous and downloads the expected output
-    # of every test case from S3: run the whole batch in a worker thread so
-    # the boto3 calls do not block the event loop.
-    return await asyncio.to_thread(
-        process_test_results_batch, storage_provider, commit, test_cases, base_dir
+    expected_dir = expected_outputs_dir(base_dir)
+    download_task = asyncio.create_task(
+        copy_expected_outputs(
+            storage_provider,
+            test_cases,
+            expected_dir,
+            max_concurrent_downloads(_get_config()),
+        )
     )
+    download_task.add_done_callback(_mark_task_done)
+    evaluator = CaseEvaluator(commit, test_cases, expected_dir, download_task)
+    try:
+        await run(data_provider, commit, test_cases, base_dir, remote_dir, evaluator)
+        if commit.status == Commit.STATUS_ERROR:
+            return []
+        await download_task
+        return await evaluator.results(base_dir)
+    finally:
+        # Let the downloads finish before removing their directory, so the
+        # removal never races a worker thread still writing into it.
+        _ = await _await_task(download_task)
+        await asyncio.to_thread(cleanup_tests, expected_dir)
 
 
 def process_test_results_batch(
-    storage_provider: StorageProvider,
-    commit: Commit,
-    test_cases: list[TestCase],
-    base_dir: str,
+    commit: Commit, test_cases: list[TestCase], base_dir: str, expected_dir: str
 ) -> list[TestCaseResult]:
     """Run :func:`process_test_results` for every test case (sync helper).
 
-    Called through ``asyncio.to_thread``: the per-case S3 downloads inside
-    :func:`process_test_results` are blocking calls.
+    Called through ``asyncio.to_thread``. Test cases are independent, so up
+    to ``cfg.evaluation_threads`` of them are evaluated at once; the results
+    keep the order of ``test_cases``.
     """
-    return [
-        process_test_results(storage_provider, commit, test_case, base_dir)
-        for test_case in test_cases
-    ]
+    cfg = _get_config()
+    threads = int(str(cfg.get("evaluation_threads", DEFAULT_EVALUATION_THREADS)))
+    threads = max(1, min(threads, len(test_cases)))
+    if threads == 1:
+        return [
+            process_test_results(commit, test_case, base_dir, expected_dir)
+            for test_case in test_cases
+        ]
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        futures = [
+            executor.submit(
+                process_test_results, commit, test_case, base_dir, expected_dir
+            )
+            for test_case in test_cases
+        ]
+    # Every evaluation finished when the executor shut down.
+    return [future.result() for future in futures]
+
 
+class CaseEvaluator:
+    """Evaluates a commit's test cases as its container reports them done.
 
-def prepare_output_file(commit: Commit, base_dir: str) -> str:
+    A container may log ``case.done <id>`` once a test case's output files
+    are complete: the case is evaluated right away, in a thread (up to
+    ``cfg.evaluation_threads`` at once) and once its expected output is
+    downloaded, while the following cases still run. Cases without a marker
+    (e.g. from images that do not send them) are evaluated by `results`.
+    """
+
+    commit: Commit
+    test_cases: list[TestCase]
+    expected_dir: str
+    _cases: dict[int, TestCase]
+    _expected: asyncio.Task[None]
+    _slots: asyncio.Semaphore
+    _evaluations: dict[int, asyncio.Task[TestCaseResult]]
+
+    def __init__(
+        self,
+        commit: Commit,
+        test_cases: list[TestCase],
+        expected_dir: str,
+        expected: asyncio.Task[None],
+    ) -> None:
+        self.commit = commit
+        self.test_cases = test_cases
+        self.expected_dir = expected_dir
+        self._cases = {test_case.id: test_case for test_case in test_cases}
+        self._expected = expected
+        cfg = _get_config()
+        threads = int(str(cfg.get("evaluation_threads", DEFAULT_EVALUATION_THREADS)))
+        self._slots = asyncio.Semaphore(max(1, threads))
+        self._evaluations = {}
+
+    def case_done(self, case_id: int, work_dir: str) -> None:
+        """Start evaluating test case ``case_id``, whose outputs are in ``work_dir``."""
+        test_case = self._cases.get(case_id)
+        if test_case is None or case_id in self._evaluations:
+            logger = logging.getLogger(DEFAULT_LOGGER)
+            logger.warning(f"[{self.commit.id}] Unexpected test case {case_id} done")
+            return
+        self._evaluations[case_id] = asyncio.create_task(
+            self._evaluate(test_case, work_dir)
+        )
+
+    async def wait(self) -> None:
+        """Wait for the started evaluations to finish (successfully or not)."""
+        _ = await asyncio.gather(*self._evaluations.values(), return_exceptions=True)
+
+    async def results(self, base_dir: str) -> list[TestCaseResult]:
+        """Return the results of every test case, in order.
+
+        Cases that were not reported done are evaluated now, from their
+        outputs in ``base_dir``. Raises the error of a failed evaluation.
+        """
+        await self.wait()
+        remaining = [c for c in self.test_cases if c.id not in self._evaluations]
+        evaluated: dict[int, TestCaseResult] = {}
+        if remaining:
+            # `process_test_results` is synchronous (it reads and compares
+            # output files): run the batch in a worker thread so it does not
+            # block the event loop.
+            batch = await asyncio.to_thread(
+                process_test_results_batch,
+                self.commit,
+                remaining,
+                base_dir,
+                self.expected_dir,
+            )
+            evaluated = {c.id: r for c, r in zip(remaining, batch, strict=True)}
+        return [
+            evaluated[c.id] if c.id in evaluated else self._evaluations[c.id].result()
+            for c in self.test_cases
+        ]
+
+    async def _evaluate(self, test_case: TestCase, work_dir: str) -> TestCaseResult:
+        # Shielded: the downloads are shared by all of the commit's cases.
+        await asyncio.shield(self._expected)
+        async with self._slots:
+            return await asyncio.to_thread(
+                process_test_results,
+                self.commit,
+                test_case,
+                work_dir,
+                self.expected_dir,
+            )
+
+
+def prepare_output_file(commit: Commit, base_dir: str) -> IO[bytes]:
+    """Zip the commit's output files, returning the archive rewound.
+
+    The archive is built in memory up to ``cfg.output_spool_size`` bytes and
+    only spills to a temporary file in ``base_dir`` beyond that, so it can be
+    handed to the storage provider without writing ``<commit id>.zip``. The
+    caller closes it.
+
+    Program output (``.output``/``.error`` files) is cut to
+    ``cfg.max_output_file_size`` bytes as it is copied; the files themselves
+    are never modified.
+    """
     cfg = _get_config()
+    max_output_file_size = cast(int, cfg.max_output_file_size)
+    store_max_size = int(
+        str(cfg.get("output_store_max_size", DEFAULT_OUTPUT_STORE_MAX_SIZE))
+    )
+    compress_level = int(
+        str(cfg.get("output_compress_level", DEFAULT_OUTPUT_COMPRESS_LEVEL))
+    )
+    stored_extensions = tuple(
+        cast(
+            Iterable[str],
+            cfg.get("output_stored_extensions", DEFAULT_OUTPUT_STORED_EXTENSIONS),
+        )
+    )
 
     def should_truncate(fname: str) -> bool:
         return fname.endswith((".output", ".error"))
 
-    def truncate(fname: str) -> None:
-        with open(fname, "a") as f:
-            size = f.seek(0, 2)
-            if size > cast(int, cfg.max_output_file_size):
-                _ = f.seek(0, 0)
-                _ = f.truncate(cast(int, cfg.max_output_file_size))
+    def write(output_file: zipfile.ZipFile, fs_fname: str, ar_fname: str) -> None:
+        zinfo = zipfile.ZipInfo.from_file(fs_fname, ar_fname)
+        size = zinfo.file_size
+        if should_truncate(fs_fname):
+            size = min(size, max_output_file_size)
+        if size <= store_max_size or fs_fname.lower().endswith(stored_extensions):
+            zinfo.compress_type = zipfile.ZIP_STORED
+        else:
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            zinfo.compress_level = compress_level
+        zinfo.file_size = size
+        with open(fs_fname, "rb") as src, output_file.open(zinfo, "w") as dst:
+            while size > 0:
+                chunk = src.read(min(size, OUTPUT_COPY_BUFFER_SIZE))
+                if not chunk:
+                    break
+                _ = dst.write(chunk)
+                size -= len(chunk)
 
     output_dir = os.path.join(base_dir, str(cfg.output_files_dir))
-    output_fname = os.path.join(base_dir, f"{commit.id}.zip")
-    with zipfile.ZipFile(output_fname, "w") as output_file:
-        for dir_path, _, fnames in os.walk(output_dir):
-            for fname in fnames:
-                fs_fname = os.path.join(dir_path, fname)
-                if should_truncate(fs_fname):
-                    truncate(fs_fname)
-                ar_dirname = os.path.dirname(fs_fname).replace(output_dir, ".")
-                ar_fname = os.path.join(ar_dirname, fname)
-                output_file.write(fs_fname, ar_fname)
-    return output_fname
+    spool_size = int(str(cfg.get("output_spool_size", DEFAULT_OUTPUT_SPOOL_SIZE)))
+    output = tempfile.SpooledTemporaryFile(  # noqa: SIM115 (returned open)
+        max_size=spool_size, prefix=f"{commit.id}.", suffix=".zip", dir=base_dir
+    )
+    try:
+        with zipfile.ZipFile(output, "w") as output_file:
+            for dir_path, _, fnames in os.walk(output_dir):
+                for fname in fnames:
+                    fs_fname = os.path.join(dir_path, fname)
+                    ar_dirname = os.path.dirname(fs_fname).replace(output_dir, ".")
+                    ar_fname = os.path.join(ar_dirname, fname)
+                    write(output_file, fs_fname, ar_fname)
+        _ = output.seek(0)
+    except BaseException:
+        output.close()
+        raise
+    return output
 
 
 def compute_score(
@@ -636,8 +1176,8 @@ async def process_commit(
     The prefetch phase overlaps its independent IO so the (much slower)
     container phase starts as soon as possible: fetching the test cases,
     deleting stale results and downloading the commit source file all start
-    together, and the per-exercise/per-test-case S3 downloads run
-    concurrently behind a semaphore.
+    together, and the exercise and test case files are each fetched as one
+    batch of parallel downloads.
     """
     if cfg is None:
         cfg = get_config(DEFAULT_CONFIG)
@@ -648,6 +1188,12 @@ async def process_commit(
         f"[{commit.id}] user_email={commit.user_email}, exercise_id={commit.exercise_id}, commit_time={commit.commit_time}"
     )
 
+    # Prefer the worker's shared provider (see process_commits); commits
+    # processed outside a worker create (and close) their own.
+    storage_provider = storage.get_shared()
+    if storage_provider is not None:
+        await _process_commit(data_provider, storage_provider, commit, cfg)
+        return
     try:
         storage_provider = storage.from_config(cfg)
     except Exception:
@@ -655,20 +1201,23 @@ async def process_commit(
         commit.status = Commit.STATUS_INTERNAL_ERROR
         await data_provider.update_commit(commit)
         return
+    try:
+        await _process_commit(data_provider, storage_provider, commit, cfg)
+    finally:
+        await storage.to_async(storage_provider).close()
+
 
+async def _process_commit(
+    data_provider: DataProvider,
+    storage_provider: StorageProvider | AsyncStorageProvider,
+    commit: Commit,
+    cfg: Config,
+) -> None:
+    logger = logging.getLogger(DEFAULT_LOGGER)
     base_dir = os.path.join(cast(str, cfg.exec_dir), f"commit_{commit.id}")
     remote_dir = os.path.join(cast(str, cfg.exec_dir_remote), f"commit_{commit.id}")
 
-    # Bound for the prefetch S3 downloads: mirror the per-worker commit
-    # concurrency so a worker never opens more simultaneous downloads than it
-    # has in-flight commits, capped at a sane small maximum (and never zero,
-    # which would deadlock every download).
-    concurrency = int(
-        str(cfg.get("concurrency_per_worker", DEFAULT_CONCURRENCY_PER_WORKER))
-    )
-    download_semaphore = asyncio.Semaphore(
-        max(1, min(concurrency, PREFETCH_MAX_CONCURRENT_DOWNLOADS))
-    )
+    max_downloads = max_concurrent_downloads(cfg)
 
     # Remove leftovers from a previous attempt and create the work directory
     # BEFORE any prefetch download starts, so this cleanup can never delete a
@@ -695,10 +1244,8 @@ async def process_commit(
     #
     # Ordering guarantees:
     #   * the DB pair is awaited first and commit.reset()/STATUS_PROCESSING is
-    #     written as soon as it completes: the poller re-enqueues every commit
-    #     it still sees as STATUS_IN_QUEUE, so a slow download would otherwise
-    #     leave the commit queued for the whole download time and several
-    #     workers would process copies of it (colliding on the same base_dir);
+    #     recorded as soon as it completes (the provider writes in-progress
+    #     states behind, so this costs no round trip of its own);
     #   * delete_commit_test_results still finishes before the
     #     STATUS_PROCESSING update: a crash between the two must not leave a
     #     commit marked PROCESSING with stale results;
@@ -717,7 +1264,7 @@ async def process_commit(
     download_task.add_done_callback(_mark_task_done)
 
     test_cases, delete_error = await asyncio.gather(
-        data_provider.fetch_test_cases(commit),
+        fetch_test_cases(data_provider, commit),
         data_provider.delete_commit_test_results(commit),
         return_exceptions=True,
     )
@@ -772,10 +1319,10 @@ async def process_commit(
             raise commit_file_error
         create_container_cfg_file(commit, test_cases, base_dir)
         await copy_source_files(
-            data_provider, storage_provider, commit, base_dir, download_semaphore
+            data_provider, storage_provider, commit, base_dir, max_downloads
         )
         await copy_test_case_files(
-            storage_provider, test_cases, base_dir, download_semaphore
+            storage_provider, test_cases, base_dir, max_downloads
         )
     except Exception:
         logger.exception(f"[{commit.id}] Failed to prepare runs")
@@ -805,11 +1352,10 @@ async def process_commit(
         await data_provider.update_commit(commit)
         await data_provider.store_commit_test_results(commit, test_results)
         if len(test_results) > 0:
-            output_fname = prepare_output_file(commit, base_dir)
-            # boto3 upload runs in a worker thread
-            await asyncio.to_thread(
-                storage_provider.store_commit_output, commit, output_fname
-            )
+            with prepare_output_file(commit, base_dir) as output:
+                await storage.to_async(storage_provider).store_commit_output(
+                    commit, output
+                )
         cleanup_tests(base_dir)
     except Exception:
         logger.exception(
@@ -825,7 +1371,7 @@ async def process_commit(
 
 async def process_commits(
     data_provider: DataProvider,
-    commit_queue: mp_queues.JoinableQueue[Commit | None],
+    commit_queue: mp_queues.JoinableQueue[PackedCommit | None],
     cfg: Config | None = None,
 ) -> None:
     """Worker main loop: pull commits from the queue and process them.
@@ -837,20 +1383,22 @@ async def process_commits(
     task is spawned and released in the task's ``finally`` block, so a failing
     commit can never leak a slot.
 
-    The poller may deliver the same commit more than once (it re-enqueues
-    every commit it still sees as STATUS_IN_QUEUE), so each pulled commit is
-    first claimed with an atomic conditional UPDATE in the provider: only the
-    worker whose claim wins actually processes it, duplicate copies are
-    skipped, and a claim is released back to IN_QUEUE after a retryable
-    failure.
+    The poller claims every commit before enqueueing it, so each one arrives
+    exactly once, packed (see `Commit.pack`) and rebuilt here; a claim is
+    released back to IN_QUEUE after a retryable failure.
+
+    A commit whose language image has not been pulled yet (see
+    `rcc.images`) gives its slot up and waits for the image instead of
+    failing; it takes a slot again before it is processed.
 
     ``queue.get`` runs in a thread with a bounded wait so the loop can notice
     failures of in-flight tasks. When the ``None`` stop hint arrives the loop
     stops pulling and drains every in-flight commit before exiting.
     Non-retryable exceptions stop the worker (after the in-flight commits
     finish); retryable ones are logged and skipped. The process database
-    connection pool is opened here (one pool per process) and closed when the
-    worker stops.
+    connection pool, storage provider and docker client are created here (one
+    of each per process, shared by all in-flight commits) and closed when
+    the worker stops.
     """
     # Set up logging for worker process
     logger = logging.getLogger(DEFAULT_LOGGER)
@@ -900,6 +1448,50 @@ async def process_commits(
         logger.exception("Failed to open database connection pool")
         raise
 
+    # The worker's test case and exercise caches, shared by all of its
+    # in-flight commits. A cache that cannot be created only costs
+    # performance: run without it.
+    if cfg is not None:
+        try:
+            open_caches(cfg)
+        except Exception:
+            logger.exception("Failed to open caches; running without them")
+        # One storage provider (and connection pool) for the whole worker, so
+        # commits reuse open connections. If it cannot be created, every
+        # commit tries again on its own and reports the error.
+        try:
+            _ = storage.open_shared(cfg)
+        except Exception:
+            logger.exception("Failed to create the shared storage provider")
+        try:
+            open_compare_pool(cfg)
+        except Exception:
+            logger.exception("Failed to create the compare pool; comparing in threads")
+        # One docker client (and connection pool) for the whole worker. If
+        # it cannot be registered, every commit creates its own.
+        try:
+            open_docker_client(cfg)
+        except Exception:
+            logger.exception("Failed to create the docker client")
+        try:
+            open_log_streams()
+        except Exception:
+            logger.exception(
+                "Failed to read the docker settings; following logs in threads"
+            )
+        try:
+            open_image_pins(cfg)
+        except Exception:
+            logger.exception(
+                "Failed to read the pre-pulled images; not waiting for them"
+            )
+        try:
+            open_container_pool(cfg)
+        except Exception:
+            logger.exception(
+                "Failed to create the container pool; starting every container"
+            )
+
     # Caps the number of commits processed concurrently by this worker.
     semaphore = asyncio.Semaphore(concurrency)
     # Registry of in-flight commit tasks: drained before the worker exits.
@@ -908,35 +1500,59 @@ async def process_commits(
     # spawning new work and exits after the in-flight commits are drained.
     fatal = asyncio.Event()
 
-    async def run_commit(commit: Commit) -> None:
+    # Commits waiting for their image without a slot: at most one per slot,
+    # so a worker never holds more than twice its concurrency in claimed
+    # commits while an image is missing.
+    image_waiters = asyncio.Semaphore(concurrency)
+
+    async def wait_for_image(commit: Commit) -> None:
+        """Wait until the commit's image is pulled, giving its slot up if it can.
+
+        Further commits keep their slot while ``concurrency`` others already
+        wait without one, so the worker stops pulling from the task queue.
+        """
+        pins = get_image_pins()
+        language = commit.language
+        if pins is None or language is None or language.image not in pins.images:
+            return
         try:
-            # Claim the commit atomically before processing it. The poller
-            # can enqueue the same commit more than once (a commit stays
-            # STATUS_IN_QUEUE until a worker takes it, e.g. while it waits in
-            # the bounded task queue), so several workers may pull copies of
-            # it. The claim is a conditional UPDATE (IN_QUEUE -> PROCESSING)
-            # in the provider, which is the only state shared across worker
-            # processes: only the worker whose update wins processes the
-            # commit; the losers drop their copies.
-            try:
-                claimed = await data_provider.claim_commit(commit)
-            except Exception as e:
-                # Could not claim (e.g. a database hiccup): leave the commit
-                # in the queue to be pulled again later.
-                logger.warning(f"Caught retryable exception: {e}", exc_info=True)
-                return
-            if not claimed:
-                logger.debug(f"Commit {commit.id} already taken; skipping")
+            if await pins.resolve(language.image) is not None:
                 return
+        except Exception:
+            # Docker is unreachable: the commit fails in run() as it would
+            # have without the wait.
+            logger.warning(f"[{commit.id}] Could not inspect image", exc_info=True)
+            return
+        logger.info(f"[{commit.id}] Waiting for image {language.image}")
+        if image_waiters.locked():
+            image = await pins.wait(language.image)
+        else:
+            async with image_waiters:
+                # The slot goes to commits that can run meanwhile.
+                semaphore.release()
+                try:
+                    image = await pins.wait(language.image)
+                finally:
+                    _ = await semaphore.acquire()
+        if image is None:
+            logger.warning(
+                f"[{commit.id}] Image {language.image} is still missing; running"
+            )
+
+    async def run_commit(commit: Commit) -> None:
+        try:
+            # The poller claimed the commit (IN_QUEUE -> PROCESSING) before
+            # putting it on the task queue, so this worker holds it.
             try:
+                await wait_for_image(commit)
                 await process_commit(data_provider, commit, cfg)
             except non_retryable_exceptions as e:
                 logger.warning(f"Caught non-retryable exception: {e}")
                 fatal.set()
             except Exception as e:
                 logger.warning(f"Caught retryable exception: {e}", exc_info=True)
-                # We still hold the claim: give the commit back to the queue
-                # so the poller can retry it.
+                # We hold the claim: give the commit back to the queue so the
+                # poller can claim it again.
                 try:
                     await data_provider.release_commit(commit)
                 except Exception:
@@ -956,7 +1572,7 @@ async def process_commits(
                 try:
                     # Bounded wait: lets the loop observe `fatal` (set by an
                     # in-flight task) instead of blocking on an empty queue.
-                    commit = await asyncio.to_thread(
+                    packed = await asyncio.to_thread(
                         commit_queue.get, True, QUEUE_GET_POLL_TIMEOUT
                     )
                 except queue.Empty:
@@ -969,10 +1585,11 @@ async def process_commits(
                     continue
 
                 try:
-                    if commit is None:
+                    if packed is None:
                         # Stop hint: mark the empty task as done (finally
                         # block) and drain the in-flight commits.
                         break
+                    commit = Commit.unpack(packed)
                     _ = await semaphore.acquire()
                     try:
                         task = asyncio.create_task(run_commit(commit))
@@ -994,6 +1611,25 @@ async def process_commits(
             if in_flight:
                 _ = await asyncio.gather(*in_flight)
     finally:
+        file_cache = get_file_cache()
+        if file_cache is not None:
+            logger.info(f"Test case cache stats: {file_cache.stats()}")
+        exercise_cache = get_exercise_cache()
+        if exercise_cache is not None:
+            logger.info(f"Exercise cache stats: {exercise_cache.stats()}")
+        exercise_cases_cache = get_exercise_cases_cache()
+        if exercise_cases_cache is not None:
+            logger.info(f"Test cases cache stats: {exercise_cases_cache.stats()}")
+        container_pool = get_container_pool()
+        if container_pool is not None:
+            logger.info(f"Container pool stats: {container_pool.stats()}")
+        close_caches()
+        await close_container_pool()
+        close_image_pins()
+        await close_log_streams()
+        await asyncio.to_thread(close_docker_client)
+        await asyncio.to_thread(close_compare_pool)
+        await storage.close_shared()
         await data_provider.close()
 
     logger.debug("Worker stopped")
@@ -1001,7 +1637,7 @@ async def process_commits(
 
 def run_worker(
     data_provider: DataProvider,
-    commit_queue: mp_queues.JoinableQueue[Commit | None],
+    commit_queue: mp_queues.JoinableQueue[PackedCommit | None],
     cfg: Config | None = None,
 ) -> None:
     """Sync entry point for the worker ``multiprocessing.Process`` target.
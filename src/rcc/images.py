@@ -0,0 +1,208 @@
+"""
+Pre-pulling of the language images and pinning of the pulled images.
+"""
+
+import asyncio
+import logging
+import time
+from collections.abc import Iterable
+from typing import cast
+
+import docker
+import docker.errors
+
+from .config import DEFAULT_IMAGE_REFRESH_INTERVAL, DEFAULT_LOGGER, Config, ConfigError
+from .containers import docker_client
+from .languages import KNOWN_LANGUAGES
+
+# Images pulled at once: a fresh host gets its first images (in
+# KNOWN_LANGUAGES order, the most used first) without waiting for all of them.
+PULL_CONCURRENCY = 2
+
+# Seconds before a failed pull is tried again, doubled on every further
+# failure of the image up to MAX_PULL_RETRY_BACKOFF. Independent of the
+# refresh interval: commits may be waiting for the image.
+PULL_RETRY_BACKOFF = 10.0
+MAX_PULL_RETRY_BACKOFF = 300.0
+
+# Seconds a worker trusts a resolved image id before inspecting the tag
+# again (to pick up an image refreshed by the puller).
+PIN_TTL = 60.0
+
+# Seconds between two checks of an image a commit is waiting for, and the
+# longest a commit waits before running anyway (and pulling the image itself).
+WAIT_INTERVAL = 5.0
+WAIT_TIMEOUT = 15 * 60.0
+
+
+class ImagePuller:
+    """Pulls the language images in the background (in the main process).
+
+    Every image is pulled once at startup and again every
+    ``refresh_interval`` seconds, so a new ``latest`` is picked up without
+    ever pulling while a commit waits. A failed pull is retried after a
+    short backoff (see `PULL_RETRY_BACKOFF`) instead. Workers find the
+    pulled images through `ImagePins`.
+    """
+
+    images: list[str]
+    refresh_interval: float
+
+    def __init__(self, images: list[str], refresh_interval: float) -> None:
+        self.images = images
+        self.refresh_interval = refresh_interval
+
+    async def run(self) -> None:
+        """Pull every image, then refresh them forever (or once when 0).
+
+        The pulls share one docker client, created before the first pull and
+        closed when this returns or is cancelled.
+        """
+        client = await self._connect()
+        try:
+            await self._keep_pulled(client)
+        finally:
+            await asyncio.to_thread(client.close)
+
+    async def _connect(self) -> docker.DockerClient:
+        """Create the docker client, retrying while the daemon is unreachable."""
+        logger = logging.getLogger(DEFAULT_LOGGER)
+        backoff = 0.0
+        while True:
+            try:
+                return await asyncio.to_thread(docker.from_env)
+            except Exception:
+                logger.warning("Could not connect to docker", exc_info=True)
+            backoff = min(max(2 * backoff, PULL_RETRY_BACKOFF), MAX_PULL_RETRY_BACKOFF)
+            await asyncio.sleep(backoff)
+
+    async def _keep_pulled(self, client: docker.DockerClient) -> None:
+        slots = asyncio.Semaphore(PULL_CONCURRENCY)
+
+        async def keep_pulled(image: str) -> None:
+            backoff = 0.0
+            while True:
+                async with slots:
+                    pulled = await asyncio.to_thread(self._pull, client, image)
+                if not pulled:
+                    backoff = min(
+                        max(2 * backoff, PULL_RETRY_BACKOFF), MAX_PULL_RETRY_BACKOFF
+                    )
+                    await asyncio.sleep(backoff)
+                    continue
+                if self.refresh_interval <= 0:
+                    return
+                backoff = 0.0
+                await asyncio.sleep(self.refresh_interval)
+
+        _ = await asyncio.gather(*(keep_pulled(image) for image in self.images))
+
+    def _pull(self, client: docker.DockerClient, image: str) -> bool:
+        """Pull ``image`` with ``client``; return whether it was pulled."""
+        logger = logging.getLogger(DEFAULT_LOGGER)
+        try:
+            pulled = client.images.pull(image)
+        except Exception:
+            # Commits of this language wait for a retry (or pull the image
+            # themselves after WAIT_TIMEOUT).
+            logger.warning(f"Could not pull image {image}", exc_info=True)
+            return False
+        digests = cast(list[str], pulled.attrs.get("RepoDigests") or [])
+        logger.info(f"Pulled image {image}: {', '.join(digests) or pulled.id}")
+        return True
+
+
+class ImagePins:
+    """A worker's view of the pulled images: tag -> local image id.
+
+    Containers are started from the id, which never pulls (a tag that is not
+    present locally would be pulled by docker on the commit's time). Ids are
+    cached for `PIN_TTL` seconds; an image that is not present yet is looked
+    up again on every call. ``images`` are the images the puller pulls: only
+    those are worth waiting for.
+    """
+
+    images: frozenset[str]
+    _pins: dict[str, tuple[str, float]]
+
+    def __init__(self, images: Iterable[str]) -> None:
+        self.images = frozenset(images)
+        self._pins = {}
+
+    async def resolve(self, image: str) -> str | None:
+        """Return the id of the local ``image``, or `None` if it is missing."""
+        pin = self._pins.get(image)
+        if pin is not None and pin[1] > time.monotonic():
+            return pin[0]
+        image_id = await asyncio.to_thread(self._inspect, image)
+        if image_id is None:
+            _ = self._pins.pop(image, None)
+        else:
+            self._pins[image] = (image_id, time.monotonic() + PIN_TTL)
+        return image_id
+
+    async def wait(self, image: str, timeout: float = WAIT_TIMEOUT) -> str | None:
+        """Wait until ``image`` is present; `None` when ``timeout`` expired."""
+        deadline = time.monotonic() + timeout
+        while (image_id := await self.resolve(image)) is None:
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(WAIT_INTERVAL)
+        return image_id
+
+    def _inspect(self, image: str) -> str | None:
+        try:
+            return docker_client().images.get(image).id
+        except docker.errors.ImageNotFound:
+            return None
+
+
+def images_from_config(cfg: Config) -> list[str]:
+    """Images to pre-pull, from the language names in ``cfg.images``.
+
+    Defaults to every known language; raises `ConfigError` for an unknown
+    language.
+    """
+    images = {language.name: language.image for language in KNOWN_LANGUAGES}
+    names = cast(list[str], cfg.get("images", list(images)))
+    for name in names:
+        if name not in images:
+            raise ConfigError(f"images: unknown language {name!r}")
+    return list(dict.fromkeys(images[name] for name in names))
+
+
+def puller_from_config(cfg: Config) -> ImagePuller | None:
+    """Create the image puller, or `None` when no image is configured."""
+    images = images_from_config(cfg)
+    if not images:
+        return None
+    interval = float(
+        str(cfg.get("image_refresh_interval", DEFAULT_IMAGE_REFRESH_INTERVAL))
+    )
+    return ImagePuller(images, interval)
+
+
+# This worker's image pins (see open_image_pins).
+_pins: ImagePins | None = None
+
+
+def open_image_pins(cfg: Config) -> None:
+    """Create and register the worker's image pins.
+
+    Only when images are pre-pulled: otherwise commits would wait for images
+    nothing pulls.
+    """
+    global _pins
+    images = images_from_config(cfg)
+    _pins = ImagePins(images) if images else None
+
+
+def get_image_pins() -> ImagePins | None:
+    """Return the registered worker image pins, or `None` if there are none."""
+    return _pins
+
+
+def close_image_pins() -> None:
+    """Unregister the worker image pins, if any."""
+    global _pins
+    _pins = None
@@ -0,0 +1,280 @@
+"""
+Container log streams followed on the worker's event loop.
+
+docker-py only offers blocking log generators, which take a thread per
+followed container. Here every stream attaches to its container with
+docker-py's ``attach_socket`` and then reads the attached socket with asyncio
+streams, so a worker follows the logs of all of its containers from its event
+loop and its thread count does not grow with its concurrency.
+
+Streams attach with ``stream=1`` only (no replay of the log written so far)
+and before their container starts (or, for a warm container, before it is let
+run), so they receive its whole output exactly once. That also means the
+daemon sends nothing but the response head before the attach returns: no log
+frame can be left behind in the buffers of docker-py's HTTP response.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import struct
+from collections.abc import AsyncIterator
+from typing import cast
+
+import docker
+import docker.constants
+import docker.utils
+import docker.utils.socket
+import requests
+
+from .config import DEFAULT_LOGGER
+
+# Pushed once a log stream ends (the container stopped, the connection
+# closed or the read failed).
+END: object = object()
+
+# Parameters of the attach request: new stdout and stderr output only.
+ATTACH_PARAMS = {"stdout": 1, "stderr": 1, "stream": 1}
+
+# Size of the reads of a log stream.
+CHUNK_SIZE = 64 * 1024
+
+# Longest log line: longer ones are split. The engine only expects short
+# protocol lines (``compilation.start``, ``case.done <id>``, ...).
+MAX_LINE_SIZE = 64 * 1024
+
+# Header of each frame of a multiplexed (non-tty) stream, as docker-py reads
+# it (see ``docker.utils.socket.next_frame_header``): the stream type, three
+# padding bytes and the big-endian payload size.
+FRAME_HEADER = struct.Struct(">BxxxL")
+
+
+class LogStream:
+    """The followed log of one container.
+
+    A task on the event loop reads the attached socket and queues its
+    decoded, stripped lines as they arrive, then `END`. Stdout and stderr
+    lines are split separately, in arrival order. The log of a container
+    without a ``tty`` is multiplexed. Has the interface of
+    ``rcc.engine.ContainerLogReader``.
+    """
+
+    container_id: str
+    tty: bool
+    _queue: asyncio.Queue[object]
+    _task: asyncio.Task[None] | None
+
+    def __init__(self, container_id: str, tty: bool = False) -> None:
+        self.container_id = container_id
+        self.tty = tty
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    @property
+    def task(self) -> asyncio.Task[None] | None:
+        """The task reading the stream, once started."""
+        return self._task
+
+    def start(self, sock: socket.socket) -> None:
+        """Start reading the attached ``sock``, which the stream then owns.
+
+        Must be called from the event loop.
+        """
+        self._task = asyncio.create_task(self._follow(sock))
+
+    def stop(self) -> None:
+        """Stop following the log and close its connection."""
+        if self._task is not None:
+            _ = self._task.cancel()
+
+    async def get(self) -> object:
+        """Return the next decoded log line, or `END` when the stream ended."""
+        return await self._queue.get()
+
+    async def _follow(self, sock: socket.socket) -> None:
+        writer: asyncio.StreamWriter | None = None
+        try:
+            reader, writer = await asyncio.open_connection(sock=sock)
+            frames = _raw(reader) if self.tty else _demux(reader)
+            async for line in _lines(frames):
+                self._queue.put_nowait(line.decode("utf8", errors="replace").strip())
+        except Exception as e:  # noqa: BLE001
+            # Treat the stream as ended, like a dropped docker-py stream: the
+            # commit then fails on the missing lines.
+            logger = logging.getLogger(DEFAULT_LOGGER)
+            logger.warning(
+                "Log stream of container %s failed: %r", self.container_id, e
+            )
+        finally:
+            if writer is not None:
+                writer.close()
+            else:
+                sock.close()
+            self._queue.put_nowait(END)
+
+
+class LogStreams:
+    """A worker's log streams, all followed from its event loop.
+
+    Streams are stopped by their commits; `close` stops the ones left over
+    (e.g. when the worker stops).
+    """
+
+    _live: set[LogStream]
+
+    def __init__(self) -> None:
+        self._live = set()
+
+    async def follow(
+        self, api: docker.APIClient, container_id: str, tty: bool = False
+    ) -> LogStream:
+        """Attach to a container and start following its log.
+
+        Call it before the container writes anything (see the module
+        docstring). Raises `docker.errors.APIError` when the attach fails.
+        """
+        sock = await asyncio.to_thread(_attach, api, container_id)
+        stream = LogStream(container_id, tty)
+        stream.start(sock)
+        self._live.add(stream)
+        if stream.task is not None:
+            stream.task.add_done_callback(lambda _: self._live.discard(stream))
+        return stream
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    async def close(self) -> None:
+        """Stop every stream and wait for them to end."""
+        live, self._live = list(self._live), set()
+        for stream in live:
+            stream.stop()
+        _ = await asyncio.gather(
+            *(stream.task for stream in live if stream.task is not None),
+            return_exceptions=True,
+        )
+
+
+def attachable_from_env() -> bool:
+    """Whether the docker API from the environment gives plain attach sockets.
+
+    Those are the unix socket and TCP without TLS, as docker-py reads the
+    environment. Logs from an API behind TLS, SSH or a named pipe are followed
+    with docker-py in threads.
+    """
+    kwargs = docker.utils.kwargs_from_env()
+    if kwargs.get("tls"):
+        return False
+    base_url = docker.utils.parse_host(
+        kwargs.get("base_url"), docker.constants.IS_WINDOWS_PLATFORM
+    )
+    return str(base_url).startswith(("http+unix://", "http://"))
+
+
+def _attach(api: docker.APIClient, container_id: str) -> socket.socket:
+    """Attach to a container and return the attached socket (blocking).
+
+    The returned socket is a duplicate owned by the caller: docker-py's
+    response (and the connection it took from the client's pool) is closed
+    here, without ending the stream.
+    """
+    # The stubs leave attach_socket's return type unknown: it is the
+    # response's socket (a SocketIO for these transports).
+    attached = cast(
+        socket.SocketIO,
+        api.attach_socket(  # pyright: ignore[reportUnknownMemberType]
+            container_id, ATTACH_PARAMS
+        ),
+    )
+    try:
+        return socket.socket(fileno=os.dup(attached.fileno()))
+    finally:
+        # docker-py keeps its response on the socket it returns.
+        response = cast(requests.Response | None, getattr(attached, "_response", None))
+        if response is not None:
+            response.close()
+        attached.close()
+
+
+async def _raw(reader: asyncio.StreamReader) -> AsyncIterator[tuple[int, bytes]]:
+    """Yield a raw stream's data as stdout data."""
+    while chunk := await reader.read(CHUNK_SIZE):
+        yield docker.utils.socket.STDOUT, chunk
+
+
+async def _demux(reader: asyncio.StreamReader) -> AsyncIterator[tuple[int, bytes]]:
+    """Yield ``(stream, data)`` pieces of each frame of a multiplexed stream.
+
+    Payloads are yielded as they arrive, so a frame's announced size never
+    has to fit in memory. Raises `ValueError` for a malformed or truncated
+    frame.
+    """
+    while True:
+        try:
+            header = await reader.readexactly(FRAME_HEADER.size)
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise ValueError("Truncated log frame header") from None
+            return
+        stream, remaining = cast(tuple[int, int], FRAME_HEADER.unpack(header))
+        if stream not in (docker.utils.socket.STDOUT, docker.utils.socket.STDERR):
+            raise ValueError(f"Malformed log frame header: {header!r}")
+        while remaining > 0:
+            data = await reader.read(min(remaining, CHUNK_SIZE))
+            if not data:
+                raise ValueError("Truncated log frame")
+            remaining -= len(data)
+            yield stream, data
+
+
+async def _lines(frames: AsyncIterator[tuple[int, bytes]]) -> AsyncIterator[bytes]:
+    """Yield the lines of each stream; a last unterminated line ends with it.
+
+    Lines longer than `MAX_LINE_SIZE` are split.
+    """
+    pending: dict[int, bytearray] = {}
+    async for stream, data in frames:
+        buffer = pending.setdefault(stream, bytearray())
+        buffer += data
+        *lines, rest = buffer.split(b"\n")
+        for line in lines:
+            for start in range(0, max(len(line), 1), MAX_LINE_SIZE):
+                yield bytes(line[start : start + MAX_LINE_SIZE])
+        while len(rest) >= MAX_LINE_SIZE:
+            yield bytes(rest[:MAX_LINE_SIZE])
+            del rest[:MAX_LINE_SIZE]
+        pending[stream] = rest
+    for rest in pending.values():
+        if rest:
+            yield bytes(rest)
+
+
+# This worker's log streams (see open_log_streams).
+_streams: LogStreams | None = None
+
+
+def open_log_streams() -> None:
+    """Create and register the worker's log streams.
+
+    Nothing is registered when the docker API gives no plain attach sockets
+    (see `attachable_from_env`): commits then follow their logs with
+    docker-py.
+    """
+    global _streams
+    if _streams is not None:
+        raise RuntimeError("The log streams are already open")
+    _streams = LogStreams() if attachable_from_env() else None
+
+
+def get_log_streams() -> LogStreams | None:
+    """Return the registered worker log streams, or `None` if there are none."""
+    return _streams
+
+
+async def close_log_streams() -> None:
+    """Stop the worker's remaining log streams and unregister them, if any."""
+    global _streams
+    streams, _streams = _streams, None
+    if streams is not None:
+        await streams.close()
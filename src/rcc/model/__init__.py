@@ -1,3 +1,4 @@
 from .commit import Commit as Commit
+from .commit import PackedCommit as PackedCommit
 from .test_case import TestCase as TestCase
 from .test_case import TestCaseResult as TestCaseResult
@@ -1,11 +1,52 @@
 import datetime
-from typing import TYPE_CHECKING, override
+from typing import NamedTuple, cast, override
 
-if TYPE_CHECKING:
-    from ..languages import Language
+from ..languages import Language, language_from_extension
+
+
+class PackedCommit(NamedTuple):
+    """A claimed commit as sent over the task queue (see `Commit.pack`).
+
+    Only the fields the worker reads: the ones `Commit.reset` clears are
+    left out, and so is whatever it never uses.
+    """
+
+    id: int
+    user_email: str
+    exercise_id: int
+    real_exercise_id: int
+    commit_time: datetime.datetime
+    aws_key: str
+    offering_id: int
+    real_offering_id: int
+    course_id: int
+    fname: str | None
+
+
+# Fields `Commit.reset` clears.
+RESET_FIELDS = frozenset(
+    {
+        "score",
+        "corrects",
+        "is_compiled",
+        "compiled_message",
+        "compilation_started_time",
+        "compilation_finished_time",
+        "compiled_signal",
+        "compiled_error",
+        "status",
+    }
+)
 
 
 class Commit:
+    """A submission, as read from the queue.
+
+    Attribute assignments made after construction that change a value are
+    tracked (see :meth:`dirty_fields`), so data providers can write back only
+    what changed.
+    """
+
     STATUS_IN_QUEUE: int = 0
     STATUS_COMPILING: int = 1
     STATUS_COMPILED: int = 2
@@ -44,6 +85,8 @@ class Commit:
     is_compilable: bool
     # Free-form metadata attached by some tests.
     test_cases: object
+    # Names of the attributes changed since construction or mark_clean().
+    _dirty: set[str]
 
     def __init__(
         self,
@@ -96,6 +139,85 @@ class Commit:
         self.extension = None
         self.is_compilable = False
         self.test_cases = None
+        self._dirty = set()
+
+    @override
+    def __setattr__(self, name: str, value: object) -> None:
+        # Tracking starts once __init__ created the set; an assignment of an
+        # equal value is not a change.
+        dirty = cast(set[str] | None, self.__dict__.get("_dirty"))
+        if (
+            dirty is not None
+            and not name.startswith("_")
+            and (name not in self.__dict__ or self.__dict__[name] != value)
+        ):
+            dirty.add(name)
+        super().__setattr__(name, value)
+
+    def dirty_fields(self) -> frozenset[str]:
+        """Names of the attributes changed since the last `mark_clean`."""
+        return frozenset(self._dirty)
+
+    def mark_clean(self) -> None:
+        """Forget the tracked changes (after they were written)."""
+        self._dirty.clear()
+
+    def pack(self) -> PackedCommit:
+        """The fields of the commit the worker reads, for the task queue.
+
+        Pickles to a fraction of the size of the object (no attribute names,
+        no `Language`, no compiler messages), so the poller sends this
+        instead and the worker rebuilds the commit with :meth:`unpack`.
+        """
+        return PackedCommit(
+            id=self.id,
+            user_email=self.user_email,
+            exercise_id=self.exercise_id,
+            real_exercise_id=self.real_exercise_id,
+            commit_time=self.commit_time,
+            aws_key=self.aws_key,
+            offering_id=self.offering_id,
+            real_offering_id=self.real_offering_id,
+            course_id=self.course_id,
+            fname=self.fname,
+        )
+
+    @classmethod
+    def unpack(cls, data: PackedCommit) -> Commit:
+        """Rebuild a commit sent by :meth:`pack`, with its language.
+
+        The fields left out get the values :meth:`reset` gives them and are
+        marked changed, so the worker's first write clears them in the
+        database; the hash and ip are empty and never written.
+        """
+        commit = cls(
+            commit_id=data.id,
+            user_email=data.user_email,
+            exercise_id=data.exercise_id,
+            real_exercise_id=data.real_exercise_id,
+            status=Commit.STATUS_PROCESSING,
+            commit_hash="",
+            corrects=0,
+            score=0.0,
+            is_compiled=False,
+            compiled_message="",
+            commit_time=data.commit_time,
+            compilation_started_time=None,
+            compilation_finished_time=None,
+            compiled_signal="",
+            compiled_error="",
+            user_ip=None,
+            aws_key=data.aws_key,
+            offering_id=data.offering_id,
+            real_offering_id=data.real_offering_id,
+            course_id=data.course_id,
+            fname=data.fname,
+        )
+        if commit.fname is not None:
+            commit.language = language_from_extension(commit.fname)
+        commit.mark_clean()
+        commit._dirty.update(RESET_FIELDS)
+        return commit
 
     def reset(self) -> None:
         self.score = 0.0
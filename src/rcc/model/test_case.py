@@ -1,3 +1,4 @@
+import datetime
 from typing import override
 
 
@@ -18,7 +19,7 @@ class TestCase:
     show_user_output: bool
     file_size: int
     abs_error: float | None
-    last_update: object
+    last_update: datetime.datetime | None
     files: list[str]
 
     def __init__(
@@ -35,7 +36,7 @@ class TestCase:
         show_user_output: bool,
         file_size: int,
         abs_error: float | None,
-        last_update: object,
+        last_update: datetime.datetime | None,
         files: list[str] | None = None,
     ) -> None:
         self.id = test_case_id
@@ -1,5 +1,12 @@
+import asyncio
 from typing import TYPE_CHECKING
 
+from ...config import (
+    DEFAULT_NOTIFY_POLL_INTERVAL,
+    DEFAULT_QUEUE_PAGE_SIZE,
+    DEFAULT_STALE_CLAIM_AGE,
+)
+
 if TYPE_CHECKING:
     from ...model import Commit, TestCase, TestCaseResult
 
@@ -11,6 +18,13 @@ class DataProvider:
     connection pool that must be opened before use (and closed on shutdown).
     """
 
+    # Most queued commits the poller claims at once (see `claim_batch`).
+    queue_page_size: int = DEFAULT_QUEUE_PAGE_SIZE
+    # Age in seconds of the claims `release_stale_claims` returns to the queue.
+    stale_claim_age: int = DEFAULT_STALE_CLAIM_AGE
+    # Seconds the poller waits for commits while `listening`.
+    notify_poll_interval: float = DEFAULT_NOTIFY_POLL_INTERVAL
+
     async def open(self) -> None:
         """Open any process-local resources (e.g. a connection pool)."""
 
@@ -20,6 +34,21 @@ class DataProvider:
     async def fetch_commits_in_queue(self) -> list[Commit]:
         raise NotImplementedError()
 
+    async def wait_for_commits(self, timeout: float) -> bool:
+        """Wait up to ``timeout`` seconds for commits to enter the queue.
+
+        Return ``True`` when woken by a notification that new commits may be
+        queued, ``False`` when the timeout expired. Providers without
+        notifications just sleep, so the caller falls back to polling.
+        """
+        await asyncio.sleep(timeout)
+        return False
+
+    @property
+    def listening(self) -> bool:
+        """Whether `wait_for_commits` is woken by notifications right now."""
+        return False
+
     async def update_commit(self, _commit: Commit) -> None:
         raise NotImplementedError()
 
@@ -37,6 +66,15 @@ class DataProvider:
     async def fetch_test_cases(self, _commit: Commit) -> list[TestCase]:
         raise NotImplementedError()
 
+    async def fetch_test_cases_version(self, _commit: Commit) -> object:
+        """Return a value that changes whenever the commit's test cases do.
+
+        Lets a cache of `fetch_test_cases` results skip the full query while
+        the version is unchanged. The default `None` means unknown: the test
+        cases are then always fetched.
+        """
+        return None
+
     async def claim_commit(self, _commit: Commit) -> bool:
         """Atomically take an ``STATUS_IN_QUEUE`` commit for processing.
 
@@ -47,9 +85,45 @@ class DataProvider:
         """
         return True
 
+    async def claim_batch(self, n: int) -> list[Commit]:
+        """Claim up to ``n`` ``STATUS_IN_QUEUE`` commits for processing.
+
+        Return the claimed commits, oldest first; every one of them is held
+        by the caller until processed (or released with
+        :meth:`release_commit`). Providers with row locking claim in one
+        round trip; the default, for providers without it (such as test
+        doubles), reads :meth:`fetch_commits_in_queue` and claims its
+        commits one by one.
+        """
+        claimed: list[Commit] = []
+        queued = sorted(
+            await self.fetch_commits_in_queue(), key=lambda c: (c.commit_time, c.id)
+        )
+        for commit in queued:
+            if len(claimed) == n:
+                break
+            if await self.claim_commit(commit):
+                claimed.append(commit)
+        return claimed
+
     async def release_commit(self, _commit: Commit) -> None:
         """Return a claimed commit to the queue after a retryable failure.
 
-        Only the worker that holds the claim may call this. The default is a
-        no-op for providers without locking semantics.
+        Only the holder of the claim may call this: the poller for a commit it
+        could not enqueue, or the worker processing it, whether or not it got
+        to start the commit. The default is a no-op for providers without
+        locking semantics.
+        """
+
+    async def release_stale_claims(self) -> int:
+        """Return the commits left in progress by dead claimers to the queue.
+
+        Called by the poller before its first claim, then every
+        `rcc.config.STALE_CLAIM_SWEEP_INTERVAL` seconds: commits claimed by
+        an engine that crashed or was killed, or by a worker that died, stay
+        in progress otherwise. Only claims at least `stale_claim_age` seconds
+        old are released, none when it is negative. Return the number of
+        released commits; the default is a no-op for providers without
+        locking semantics.
         """
+        return 0
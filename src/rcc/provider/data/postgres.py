@@ -1,16 +1,112 @@
+import asyncio
 import base64
+import contextlib
 import datetime
+import functools
+import logging
 from typing import cast, override
 
 import psycopg
 import psycopg.conninfo
+from psycopg import sql
 from psycopg_pool import AsyncConnectionPool
 
-from ...config import DEFAULT_CONCURRENCY_PER_WORKER, Config
+from ...config import (
+    DEFAULT_CONCURRENCY_PER_WORKER,
+    DEFAULT_LOGGER,
+    DEFAULT_NOTIFY_CHANNEL,
+    DEFAULT_NOTIFY_POLL_INTERVAL,
+    DEFAULT_PREPARE_THRESHOLD,
+    DEFAULT_STALE_CLAIM_AGE,
+    DEFAULT_STATUS_FLUSH_INTERVAL,
+    Config,
+    queue_page_size,
+)
 from ...languages import language_from_extension
 from ...model import Commit, TestCase, TestCaseResult
 from .data_provider import DataProvider
 
+# Columns read by `Postgres.commit_from_row`: a commit (aliased ``com``)
+# joined with its exercise and offering through COMMIT_JOIN_TABLES and
+# COMMIT_JOIN.
+COMMIT_COLUMNS = (
+    "com.id"
+    "     , com.user_email"
+    "     , com.exercise_id"
+    "     , com.status"
+    "     , com.hash"
+    "     , com.corrects"
+    "     , com.score"
+    "     , com.compiled"
+    "     , com.compiled_message"
+    "     , com.commit_time"
+    "     , com.compilation_started"
+    "     , com.compilation_finished"
+    "     , com.compiled_signal"
+    "     , com.compiled_error"
+    "     , com.ip"
+    "     , com.aws_key"
+    "     , exe.offering_id"
+    "     , exe.ghost"
+    "     , exe.real_id AS real_exercise_id"
+    "     , off.course_id"
+    "     , CASE"
+    "       WHEN exe.ghost=FALSE THEN exe.offering_id"
+    "       ELSE (SELECT exe2.offering_id"
+    "             FROM exercises AS exe2"
+    "             WHERE exe2.id = exe.REAL_ID)"
+    "       END AS real_offering_id"
+)
+COMMIT_JOIN_TABLES = "exercises AS exe, offerings AS off"
+COMMIT_JOIN = "exe.offering_id = off.id AND com.exercise_id = exe.id"
+
+# Columns of `Commit` attributes the engine writes back; compiled_message
+# and compiled_error are stored base64-encoded.
+COMMIT_FIELD_COLUMNS = {
+    "user_email": "user_email",
+    "exercise_id": "exercise_id",
+    "status": "status",
+    "commit_hash": "hash",
+    "corrects": "corrects",
+    "score": "score",
+    "is_compiled": "compiled",
+    "compiled_message": "compiled_message",
+    "commit_time": "commit_time",
+    "compilation_started_time": "compilation_started",
+    "compilation_finished_time": "compilation_finished",
+    "compiled_signal": "compiled_signal",
+    "compiled_error": "compiled_error",
+}
+ENCODED_COMMIT_FIELDS = frozenset({"compiled_message", "compiled_error"})
+
+
+@functools.cache
+def update_commit_query(columns: tuple[str, ...], deferred: bool) -> sql.Composed:
+    """UPDATE of the given commit columns, built once per column set.
+
+    A deferred update (see `Postgres.update_commit`) only applies while the
+    row is still in progress, so a late batch never overwrites a final state.
+    """
+    assignments = sql.SQL(", ").join(
+        sql.SQL("{} = %s").format(sql.Identifier(column)) for column in columns
+    )
+    query = "UPDATE commits SET {} WHERE id = %s"
+    if deferred:
+        query += " AND status = ANY(%s)"
+    return sql.SQL(query).format(assignments)
+
+
+# States a commit passes through while a worker processes it. Writes of
+# these are coalesced; every other state is final for the worker.
+DEFERRABLE_STATUSES = frozenset(
+    {
+        Commit.STATUS_PROCESSING,
+        Commit.STATUS_COMPILING,
+        Commit.STATUS_COMPILED,
+        Commit.STATUS_RUNNING,
+    }
+)
+
 
 class Postgres(DataProvider):
     """PostgreSQL data provider backed by a shared async connection pool.
@@ -24,6 +120,10 @@ class Postgres(DataProvider):
     tasks and cannot be shared across processes, so the pool is opened after
     the multiprocessing workers have been spawned and is deliberately
     stripped when this object is pickled (see :meth:`__getstate__`).
+
+    :meth:`wait_for_commits` listens on ``db.notify_channel`` (see
+    ``config/rcc/commit_notify.sql``) through one extra connection, outside
+    the pool, opened by the first call.
     """
 
     _conninfo: str
@@ -31,6 +131,16 @@ class Postgres(DataProvider):
     _pool_max_size: int
     _pool_timeout: float
     _pool: AsyncConnectionPool[psycopg.AsyncConnection] | None
+    _notify_channel: str | None
+    _listener: psycopg.AsyncConnection | None
+    notify_poll_interval: float
+    queue_page_size: int
+    stale_claim_age: int
+    _status_flush_interval: float
+    _prepare_threshold: int | None
+    _pending: dict[int, dict[str, object]]
+    _flushing: dict[int, dict[str, object]]
+    _flusher: asyncio.Task[None] | None
 
     def __init__(self, cfg: Config) -> None:
         db = cast(dict[str, object], cfg.db)
@@ -60,6 +170,28 @@ class Postgres(DataProvider):
             self._pool_max_size = int(str(explicit_max_size))
         self._pool_timeout = float(str(db.get("pool_timeout", 30.0)))
         self._pool = None
+        # An empty channel disables notifications: the poller just polls.
+        self._notify_channel = str(db.get("notify_channel", DEFAULT_NOTIFY_CHANNEL))
+        if not self._notify_channel:
+            self._notify_channel = None
+        self._listener = None
+        self.notify_poll_interval = float(
+            str(db.get("notify_poll_interval", DEFAULT_NOTIFY_POLL_INTERVAL))
+        )
+        self.queue_page_size = queue_page_size(cfg)
+        self.stale_claim_age = int(
+            str(db.get("stale_claim_age", DEFAULT_STALE_CLAIM_AGE))
+        )
+        self._status_flush_interval = float(
+            str(db.get("status_flush_interval", DEFAULT_STATUS_FLUSH_INTERVAL))
+        )
+        threshold = int(str(db.get("prepare_threshold", DEFAULT_PREPARE_THRESHOLD)))
+        self._prepare_threshold = threshold if threshold >= 0 else None
+        # Changed columns written behind, by commit id (see update_commit).
+        self._pending = {}
+        # The batch `_flush` is writing, until its write returns.
+        self._flushing = {}
+        self._flusher = None
 
     @property
     def pool_min_size(self) -> int:
@@ -78,6 +210,10 @@ class Postgres(DataProvider):
         # by calling `open()` after the process has started.
         state: dict[str, object] = self.__dict__.copy()
         state["_pool"] = None
+        state["_listener"] = None
+        state["_pending"] = {}
+        state["_flushing"] = {}
+        state["_flusher"] = None
         return state
 
     @property
@@ -115,13 +251,26 @@ class Postgres(DataProvider):
 
     @override
     async def close(self) -> None:
-        """Close the connection pool, releasing every pooled connection."""
+        """Close the connection pool, releasing every pooled connection.
+
+        Commit states still pending are written first, including a batch
+        the cancelled background flush was writing.
+        """
+        flusher, self._flusher = self._flusher, None
+        if flusher is not None:
+            _ = flusher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await flusher
+        if self._pool is not None:
+            await self._flush()
         pool, self._pool = self._pool, None
         if pool is not None:
             await pool.close()
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            await listener.close()
 
-    @staticmethod
-    async def configure_connection(conn: psycopg.AsyncConnection) -> None:
+    async def configure_connection(self, conn: psycopg.AsyncConnection) -> None:
         # psycopg3 starts an implicit transaction on the first statement, and
         # `async with pool.connection()` commits it on clean exit and rolls
         # it back on error. Keep autocommit off so that this matches the
@@ -130,6 +279,11 @@ class Postgres(DataProvider):
         # NOTE: on async connections `autocommit` is a read-only property;
         # it must be toggled through the awaitable `set_autocommit()` method.
         await conn.set_autocommit(False)
+        # The provider runs a small fixed set of statements: prepare each on
+        # its first run on this connection (instead of psycopg's default of
+        # the fifth), so later runs skip parsing and planning. None disables
+        # preparing (e.g. behind a transaction-mode pgbouncer).
+        conn.prepare_threshold = self._prepare_threshold
 
     def _acquire(self) -> AsyncConnectionPool[psycopg.AsyncConnection]:
         if self._pool is None:
@@ -170,98 +324,209 @@ class Postgres(DataProvider):
         return c
 
     @override
-    async def fetch_commits_in_queue(self) -> list[Commit]:
+    async def claim_batch(self, n: int) -> list[Commit]:
+        """Claim up to ``n`` of the oldest queued commits in one round trip.
+
+        ``FOR UPDATE SKIP LOCKED`` passes over rows another transaction is
+        claiming, so concurrent claimers never block on nor share a commit;
+        the UPDATE flips the locked rows to PROCESSING, setting
+        ``compilation_started`` so a PROCESSING row is never observed without
+        a start time, and the outer SELECT hydrates them.
+        ``compilation_started`` is thus the claim time until the worker
+        picks the commit up from the task queue and sets it again.
+        """
         query = (
-            "SELECT com.id"
-            "     , com.user_email"
-            "     , com.exercise_id"
-            "     , com.status"
-            "     , com.hash"
-            "     , com.corrects"
-            "     , com.score"
-            "     , com.compiled"
-            "     , com.compiled_message"
-            "     , com.commit_time"
-            "     , com.compilation_started"
-            "     , com.compilation_finished"
-            "     , com.compiled_signal"
-            "     , com.compiled_error"
-            "     , com.ip"
-            "     , com.aws_key"
-            "     , exe.offering_id"
-            "     , exe.ghost"
-            "     , exe.real_id AS real_exercise_id"
-            "     , off.course_id"
-            "     , CASE"
-            "       WHEN exe.ghost=FALSE THEN exe.offering_id"
-            "       ELSE (SELECT exe2.offering_id"
-            "             FROM exercises AS exe2"
-            "             WHERE exe2.id = exe.REAL_ID)"
-            "       END AS real_offering_id"
-            " FROM commits AS com,"
-            "      exercises AS exe,"
-            "      offerings AS off"
-            " WHERE exe.offering_id = off.id"
-            "   AND com.exercise_id = exe.id"
-            "   AND status = %s"
-            " ORDER BY com.commit_time ASC"
+            "WITH claimed AS ("
+            "    SELECT com.id"
+            f"   FROM commits AS com, {COMMIT_JOIN_TABLES}"
+            f"   WHERE {COMMIT_JOIN}"
+            "      AND com.status = %s"
+            "    ORDER BY com.commit_time ASC, com.id ASC"
+            "    LIMIT %s"
+            "    FOR UPDATE OF com SKIP LOCKED"
+            "), updated AS ("
+            "    UPDATE commits AS com"
+            "    SET status = %s, compilation_started = %s"
+            "    FROM claimed"
+            "    WHERE com.id = claimed.id"
+            "    RETURNING com.*"
+            ")"
+            f" SELECT {COMMIT_COLUMNS}"
+            f" FROM updated AS com, {COMMIT_JOIN_TABLES}"
+            f" WHERE {COMMIT_JOIN}"
+            " ORDER BY com.commit_time ASC, com.id ASC"
         )
-
         async with self._acquire().connection() as conn, conn.cursor() as cursor:
-            _ = await cursor.execute(query, (Commit.STATUS_IN_QUEUE,))
-            commits: list[Commit] = []
-            async for row in cursor:
-                commits.append(Postgres.commit_from_row(row))
+            _ = await cursor.execute(
+                query,
+                (
+                    Commit.STATUS_IN_QUEUE,
+                    n,
+                    Commit.STATUS_PROCESSING,
+                    datetime.datetime.now(tz=datetime.UTC),
+                ),
+            )
+            return [Postgres._hydrate(row) async for row in cursor]
 
-        for commit in commits:
-            if commit.fname is not None:
-                commit.language = language_from_extension(commit.fname)
-        return commits
+    @staticmethod
+    def _hydrate(row: tuple[object, ...]) -> Commit:
+        """Build a `Commit` from a ``COMMIT_COLUMNS`` row, with its language."""
+        commit = Postgres.commit_from_row(row)
+        if commit.fname is not None:
+            commit.language = language_from_extension(commit.fname)
+        return commit
+
+    @override
+    async def wait_for_commits(self, timeout: float) -> bool:
+        """Wait for a notification on ``db.notify_channel``.
+
+        Notifications that arrived meanwhile are drained, so a burst of
+        submissions wakes the caller once. Should the listening connection
+        fail, it is dropped (and opened again by the next call) and this
+        sleeps out the timeout instead, degrading to plain polling.
+        """
+        if self._notify_channel is None:
+            return await super().wait_for_commits(timeout)
+        try:
+            listener = await self._listen(self._notify_channel)
+            notified = False
+            async for _ in listener.notifies(timeout=timeout, stop_after=1):
+                notified = True
+            if notified:
+                async for _ in listener.notifies(timeout=0):
+                    pass
+            return notified
+        except psycopg.Error:
+            logger = logging.getLogger(DEFAULT_LOGGER)
+            logger.warning("Commit notifications unavailable", exc_info=True)
+            listener, self._listener = self._listener, None
+            if listener is not None:
+                await listener.close()
+            await asyncio.sleep(timeout)
+            return False
+
+    @property
+    @override
+    def listening(self) -> bool:
+        """Whether the listening connection is open (after the first wait)."""
+        return self._listener is not None and not self._listener.closed
+
+    async def _listen(self, channel: str) -> psycopg.AsyncConnection:
+        """Return the listening connection, opening it if needed."""
+        if self._listener is None or self._listener.closed:
+            conn = await psycopg.AsyncConnection.connect(
+                self._conninfo, autocommit=True
+            )
+            try:
+                _ = await conn.execute(
+                    sql.SQL("LISTEN {}").format(sql.Identifier(channel))
+                )
+            except BaseException:
+                await conn.close()
+                raise
+            self._listener = conn
+        return self._listener
 
     @override
     async def update_commit(self, commit: Commit) -> None:
-        query = (
-            "UPDATE commits SET"
-            " user_email = %s,"
-            " exercise_id = %s,"
-            " status = %s,"
-            " hash = %s,"
-            " corrects = %s,"
-            " score = %s,"
-            " compiled = %s,"
-            " compiled_message = %s,"
-            " commit_time = %s,"
-            " compilation_started = %s,"
-            " compilation_finished = %s,"
-            " compiled_signal = %s,"
-            " compiled_error = %s"
-            " WHERE id = %s"
-        )
+        """Write the columns of a commit changed since its last write.
+
+        In-progress states (see ``DEFERRABLE_STATUSES``) are only recorded
+        and written behind by a background task every
+        ``db.status_flush_interval`` seconds, merged per commit and batched
+        across commits. Any other state is final and written right away,
+        together with the pending changes of the commit, and those of a
+        batch being flushed: that batch only updates rows still in
+        progress, so it may no longer apply once the final state is in.
+        """
+        changes = Postgres._commit_changes(commit)
+        if self._status_flush_interval > 0 and commit.status in DEFERRABLE_STATUSES:
+            if changes:
+                self._pending.setdefault(commit.id, {}).update(changes)
+                if self._flusher is None or self._flusher.done():
+                    self._flusher = asyncio.create_task(self._flush_periodically())
+            commit.mark_clean()
+            return
+        pending = self._flushing.get(commit.id, {}) | self._pending.pop(commit.id, {})
+        changes = pending | changes
+        if changes:
+            columns = tuple(sorted(changes))
+            data = (*(changes[column] for column in columns), commit.id)
+            try:
+                async with (
+                    self._acquire().connection() as conn,
+                    conn.cursor() as cursor,
+                ):
+                    _ = await cursor.execute(update_commit_query(columns, False), data)
+            except BaseException:
+                # Keep the recorded changes for the next write.
+                self._pending[commit.id] = pending | self._pending.get(commit.id, {})
+                raise
+        commit.mark_clean()
 
-        compiled_message = (commit.compiled_message or "").encode("utf8")
-        compiled_message = base64.b64encode(compiled_message).decode("utf8")
-
-        compiled_error = (commit.compiled_error or "").encode("utf8")
-        compiled_error = base64.b64encode(compiled_error).decode("utf8")
-
-        data = (
-            commit.user_email,
-            commit.exercise_id,
-            commit.status,
-            commit.commit_hash,
-            commit.corrects,
-            commit.score,
-            commit.is_compiled,
-            compiled_message,  # encoded
-            commit.commit_time,
-            commit.compilation_started_time,
-            commit.compilation_finished_time,
-            commit.compiled_signal,
-            compiled_error,  # encoded
-            commit.id,
-        )
-        async with self._acquire().connection() as conn, conn.cursor() as cursor:
-            _ = await cursor.execute(query, data)
+    @staticmethod
+    def _commit_changes(commit: Commit) -> dict[str, object]:
+        """Changed columns of a commit, with their (encoded) values."""
+        changes: dict[str, object] = {}
+        for field in commit.dirty_fields() & COMMIT_FIELD_COLUMNS.keys():
+            value = cast(object, getattr(commit, field))
+            if field in ENCODED_COMMIT_FIELDS:
+                value = base64.b64encode(str(value or "").encode("utf8")).decode("utf8")
+            changes[COMMIT_FIELD_COLUMNS[field]] = value
+        return changes
+
+    async def _flush_periodically(self) -> None:
+        """Flush the pending writes every tick until none are left."""
+        while True:
+            await asyncio.sleep(self._status_flush_interval)
+            await self._flush()
+            if not self._pending:
+                return
+
+    async def _flush(self) -> None:
+        """Write the pending in-progress states in one batch.
+
+        Each row is only updated while it is still in progress: a final
+        state (or a release back to the queue) written since the state was
+        recorded wins. The changes of a failed write are kept for the next
+        tick, under any change recorded meanwhile; so are those of a
+        cancelled write, for :meth:`close` to flush.
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._flushing = pending
+        in_progress = sorted(DEFERRABLE_STATUSES)
+        # One statement per set of changed columns.
+        batches: dict[tuple[str, ...], list[tuple[object, ...]]] = {}
+        for commit_id, changes in pending.items():
+            columns = tuple(sorted(changes))
+            batches.setdefault(columns, []).append(
+                (*(changes[column] for column in columns), commit_id, in_progress)
+            )
+        try:
+            async with (
+                self._acquire().connection() as conn,
+                conn.pipeline(),
+                conn.cursor() as cursor,
+            ):
+                # Pipelined: every batch goes out in the same round trip.
+                for columns, rows in batches.items():
+                    await cursor.executemany(update_commit_query(columns, True), rows)
+        except Exception:
+            logger = logging.getLogger(DEFAULT_LOGGER)
+            logger.warning("Could not write commit states", exc_info=True)
+            self._restore(pending)
+        except BaseException:
+            self._restore(pending)
+            raise
+        finally:
+            self._flushing = {}
+
+    def _restore(self, pending: dict[int, dict[str, object]]) -> None:
+        """Record unwritten changes again, under any recorded meanwhile."""
+        for commit_id, changes in pending.items():
+            self._pending[commit_id] = changes | self._pending.get(commit_id, {})
 
     @override
     async def store_commit_test_results(
@@ -279,23 +544,28 @@ class Postgres(DataProvider):
             "                                 , error)"
             " VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"
         )
+        rows = [
+            (
+                commit.id,
+                test_case_result.test_case_id,
+                test_case_result.cpu_time,
+                test_case_result.mem_used,  # unused
+                test_case_result.output,  # unused
+                test_case_result.output_type,  # unused
+                test_case_result.status,
+                test_case_result.status_message,
+                test_case_result.error,  # unused
+            )
+            for test_case_result in test_results
+        ]
+        if not rows:
+            return
         # All rows for a commit are written inside a single transaction: the
         # `async with pool.connection()` block commits on clean exit and rolls
-        # everything back if any insert fails.
+        # everything back if any insert fails. executemany() sends the
+        # inserts in pipeline mode, so they cost one round trip, not one each.
         async with self._acquire().connection() as conn, conn.cursor() as cursor:
-            for test_case_result in test_results:
-                data = (
-                    commit.id,
-                    test_case_result.test_case_id,
-                    test_case_result.cpu_time,
-                    test_case_result.mem_used,  # unused
-                    test_case_result.output,  # unused
-                    test_case_result.output_type,  # unused
-                    test_case_result.status,
-                    test_case_result.status_message,
-                    test_case_result.error,
-                )  # unused
-                _ = await cursor.execute(query, data)
+            await cursor.executemany(query, rows)
 
     @override
     async def delete_commit_test_results(self, commit: Commit) -> None:
@@ -304,54 +574,59 @@ class Postgres(DataProvider):
             _ = await cursor.execute(query, (commit.id,))
 
     @override
-    async def claim_commit(self, commit: Commit) -> bool:
-        """Atomically mark an ``STATUS_IN_QUEUE`` commit as PROCESSING.
-
-        The poller can enqueue the same commit more than once (a commit
-        stays IN_QUEUE until a worker takes it, e.g. while it waits in the
-        bounded task queue), so several workers may pull copies of it. The
-        conditional UPDATE makes the claim exclusive: exactly one worker
-        flips the status and gets ``True``; every other copy's update
-        matches zero rows and gets ``False``. ``compilation_started``
-        is set here so a PROCESSING row is never observed without a start
-        time (the worker later refreshes it with the same meaning).
+    async def release_commit(self, commit: Commit) -> None:
+        """Return a claimed commit to the queue (in progress -> IN_QUEUE).
+
+        Called by the holder of the claim after a retryable failure: the
+        poller for a commit it claimed but never enqueued (still in the
+        claim's PROCESSING state), or the worker, which may already have
+        written a later in-progress state. The status guard keeps a stale
+        release from clobbering a final status written in the meantime; the
+        start time is cleared so the row is restored to the same state as a
+        fresh queue entry. A state of the commit still pending is dropped.
         """
+        _ = self._pending.pop(commit.id, None)
         query = (
             "UPDATE commits"
-            " SET status = %s, compilation_started = %s"
-            " WHERE id = %s AND status = %s"
+            " SET status = %s, compilation_started = NULL"
+            " WHERE id = %s AND status = ANY(%s)"
         )
         async with self._acquire().connection() as conn, conn.cursor() as cursor:
             _ = await cursor.execute(
                 query,
-                (
-                    Commit.STATUS_PROCESSING,
-                    datetime.datetime.now(tz=datetime.UTC),
-                    commit.id,
-                    Commit.STATUS_IN_QUEUE,
-                ),
+                (Commit.STATUS_IN_QUEUE, commit.id, sorted(DEFERRABLE_STATUSES)),
             )
-            return cursor.rowcount == 1
 
     @override
-    async def release_commit(self, commit: Commit) -> None:
-        """Return a claimed commit to the queue (PROCESSING -> IN_QUEUE).
+    async def release_stale_claims(self) -> int:
+        """Put every in-progress commit claimed long enough ago back in queue.
 
-        Only called by the worker that holds the claim, after a retryable
-        failure. The status guard keeps a stale release from clobbering a
-        final status written in the meantime; the start time is cleared so
-        the row is restored to the same state as a fresh queue entry.
+        A claim's age is its ``compilation_started`` time, which the worker
+        refreshes when it picks the commit up, so a commit another engine is
+        still processing only looks stale once it has run for
+        `stale_claim_age` seconds.
         """
+        if self.stale_claim_age < 0:
+            return 0
+        claimed_before = datetime.datetime.now(tz=datetime.UTC) - datetime.timedelta(
+            seconds=self.stale_claim_age
+        )
         query = (
             "UPDATE commits"
             " SET status = %s, compilation_started = NULL"
-            " WHERE id = %s AND status = %s"
+            " WHERE status = ANY(%s)"
+            "   AND (compilation_started IS NULL OR compilation_started <= %s)"
         )
         async with self._acquire().connection() as conn, conn.cursor() as cursor:
             _ = await cursor.execute(
                 query,
-                (Commit.STATUS_IN_QUEUE, commit.id, Commit.STATUS_PROCESSING),
+                (
+                    Commit.STATUS_IN_QUEUE,
+                    sorted(DEFERRABLE_STATUSES),
+                    claimed_before,
+                ),
             )
+            return cursor.rowcount
 
     @override
     async def fetch_exercise_files(self, commit: Commit) -> list[str]:
@@ -375,10 +650,31 @@ class Postgres(DataProvider):
             cast(bool, row[9]),
             cast(int, row[10]),
             cast(float | None, row[11]),
-            row[12],
+            cast(datetime.datetime | None, row[12]),
         )
         return t
 
+    @override
+    async def fetch_test_cases_version(self, commit: Commit) -> object:
+        # Editing a test case (or its files) bumps its last_update; adding or
+        # removing one changes the counts.
+        query = (
+            "SELECT count(*)"
+            "     , max(cas.last_update)"
+            "     , (SELECT count(*)"
+            "        FROM exercise_case_files AS fil, exercise_cases AS cas2"
+            "        WHERE fil.exercise_case_id = cas2.id"
+            "          AND cas2.exercise_id = %s)"
+            " FROM exercise_cases AS cas"
+            " WHERE cas.exercise_id = %s"
+        )
+        async with self._acquire().connection() as conn, conn.cursor() as cursor:
+            _ = await cursor.execute(
+                query, (commit.real_exercise_id, commit.real_exercise_id)
+            )
+            row = await cursor.fetchone()
+        return None if row is None else tuple(row)
+
     @override
     async def fetch_test_cases(self, commit: Commit) -> list[TestCase]:
         query = (
@@ -399,33 +695,30 @@ class Postgres(DataProvider):
             " WHERE exercise_id = %s"
             " ORDER BY id"
         )
-        # One batched query for every test case's files instead of one query
-        # per test case. psycopg3 adapts the list of ids to a Postgres array
-        # for ``= ANY(%s)``. Rows are attributed to their case by
-        # ``exercise_case_id``.
+        # The files of every test case of the exercise in one query, selected
+        # by exercise rather than by the ids of the first query, so both are
+        # sent together in pipeline mode: one round trip for the pair.
         files_query = (
-            "SELECT exercise_case_id, path"
-            " FROM exercise_case_files"
-            " WHERE exercise_case_id = ANY(%s)"
+            "SELECT fil.exercise_case_id, fil.path"
+            " FROM exercise_case_files AS fil, exercise_cases AS cas"
+            " WHERE fil.exercise_case_id = cas.id"
+            "   AND cas.exercise_id = %s"
         )
-        async with self._acquire().connection() as conn, conn.cursor() as cursor:
-            # Fetch test case metadata
-            _ = await cursor.execute(query, (commit.real_exercise_id,))
-            test_cases: list[TestCase] = []
-            async for row in cursor:
-                test_cases.append(Postgres.test_case_from_row(row))
-            # Fetch the list of files of every test case in a single round
-            # trip (skipped when the exercise has no test cases: an empty
-            # array would be a pointless round trip).
-            if test_cases:
-                _ = await cursor.execute(
-                    files_query, ([test_case.id for test_case in test_cases],)
+        params = (commit.real_exercise_id,)
+        async with self._acquire().connection() as conn:
+            async with conn.pipeline():
+                cases_cursor = await conn.execute(query, params)
+                files_cursor = await conn.execute(files_query, params)
+            test_cases = [
+                Postgres.test_case_from_row(row)
+                for row in await cases_cursor.fetchall()
+            ]
+            # Rows are attributed to their case by ``exercise_case_id``.
+            files_by_case: dict[object, list[str]] = {}
+            for row in await files_cursor.fetchall():
+                files_by_case.setdefault(cast(object, row[0]), []).append(
+                    cast(str, row[1])
                 )
-                files_by_case: dict[object, list[str]] = {}
-                async for row in cursor:
-                    files_by_case.setdefault(cast(object, row[0]), []).append(
-                        cast(str, row[1])
-                    )
-                for test_case in test_cases:
-                    test_case.files = files_by_case.get(test_case.id, [])
+            for test_case in test_cases:
+                test_case.files = files_by_case.get(test_case.id, [])
             return test_cases
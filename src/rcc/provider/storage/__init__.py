@@ -1,14 +1,59 @@
 from typing import cast
 
 from ...config import Config
+from .local import Local as Local
 from .s3 import S3 as S3
+from .s3_async import AsyncS3 as AsyncS3
+from .storage_provider import BUCKET_CASES as BUCKET_CASES
+from .storage_provider import BUCKET_COMMITS as BUCKET_COMMITS
+from .storage_provider import BUCKET_FILES as BUCKET_FILES
+from .storage_provider import AsyncStorageProvider as AsyncStorageProvider
 from .storage_provider import StorageProvider as StorageProvider
+from .storage_provider import test_case_key as test_case_key
+from .storage_provider import to_async as to_async
 
 
-def from_config(cfg: Config) -> StorageProvider:
+def from_config(cfg: Config) -> StorageProvider | AsyncStorageProvider:
     provider_cfg = cast(dict[str, object], cfg.provider)
     name = str(provider_cfg["storage"]).lower()
     if name == "s3":
         return S3(cfg)
+    elif name == "s3_async":
+        return AsyncS3(cfg)
+    elif name == "local":
+        return Local(cfg)
     else:
         raise ValueError("Unknown provider '{}'".format(provider_cfg["storage"]))
+
+
+# The worker process's storage provider, shared by all of its in-flight
+# commits. Creating a provider resolves credentials and endpoints and starts a
+# new connection pool, so a worker creates it once (see `open_shared`) instead
+# of once per commit.
+_shared: StorageProvider | AsyncStorageProvider | None = None
+
+
+def open_shared(cfg: Config) -> StorageProvider | AsyncStorageProvider:
+    """Create this process's shared storage provider from ``cfg``.
+
+    Call it from the worker's event loop: asynchronous providers bind their
+    connections to it.
+    """
+    global _shared
+    if _shared is not None:
+        raise RuntimeError("A shared storage provider is already open")
+    _shared = from_config(cfg)
+    return _shared
+
+
+def get_shared() -> StorageProvider | AsyncStorageProvider | None:
+    """Return this process's shared storage provider, if one is open."""
+    return _shared
+
+
+async def close_shared() -> None:
+    """Close and forget this process's shared storage provider."""
+    global _shared
+    if _shared is not None:
+        provider, _shared = _shared, None
+        await to_async(provider).close()
@@ -0,0 +1,107 @@
+import contextlib
+import os
+import shutil
+import tempfile
+from typing import IO, cast, override
+
+from ...config import Config
+from ...model import Commit, TestCase
+from .storage_provider import (
+    BUCKET_CASES,
+    BUCKET_COMMITS,
+    BUCKET_FILES,
+    StorageProvider,
+    test_case_key,
+)
+
+# Permissions of stored output files (mkstemp creates them owner-only).
+OUTPUT_FILE_PERMISSIONS = 0o644
+
+
+class Local(StorageProvider):
+    """
+    Storage provider for files kept in local directories.
+
+    Every S3 bucket maps to a directory laid out like the bucket (object keys
+    are relative paths). Meant for single-host deployments and for
+    benchmarking the engine without the network.
+
+    Files are copied with `shutil.copyfile`, which on Linux copies in the
+    kernel with ``copy_file_range`` (a reflink on filesystems that support
+    it) and falls back to ``sendfile``, so no data passes through user space.
+    """
+
+    commits_dir: str
+    outputfiles_dir: str
+    files_dir: str
+    cases_dir: str
+    compilation_files_dir: str
+
+    def __init__(self, cfg: Config) -> None:
+        localcfg = cast(dict[str, object], cfg.local)
+        self.commits_dir = str(localcfg["commits_dir"])
+        self.outputfiles_dir = str(localcfg["outputfiles_dir"])
+        self.files_dir = str(localcfg["files_dir"])
+        self.compilation_files_dir = str(localcfg["compilation_files_dir"])
+        self.cases_dir = str(localcfg["cases_dir"])
+
+    @override
+    def fetch_commit_file(self, commit: Commit, destination: str) -> None:
+        self.fetch_object(BUCKET_COMMITS, commit.aws_key, destination)
+
+    @override
+    def fetch_exercise_file(self, source: str, destination: str) -> None:
+        self.fetch_object(BUCKET_FILES, source, destination)
+
+    @override
+    def fetch_exercise_file_version(self, source: str) -> str | None:
+        # Rewriting a file changes its modification time (and usually size).
+        st = os.stat(self.locate(BUCKET_FILES, source))
+        return f"{st.st_mtime_ns}-{st.st_size}"
+
+    @override
+    def fetch_test_case_input_file(self, test_case: TestCase, destination: str) -> None:
+        self.fetch_object(BUCKET_CASES, test_case_key(test_case, "in"), destination)
+
+    @override
+    def fetch_test_case_output_file(
+        self, test_case: TestCase, destination: str
+    ) -> None:
+        self.fetch_object(BUCKET_CASES, test_case_key(test_case, "out"), destination)
+
+    @override
+    def fetch_test_case_files(self, test_case: TestCase, destination: str) -> None:
+        for fname in test_case.files:
+            key = test_case_key(test_case, f"files/{fname}")
+            self.fetch_object(BUCKET_CASES, key, os.path.join(destination, fname))
+
+    @override
+    def fetch_object(self, bucket: str, key: str, destination: str) -> None:
+        _ = shutil.copyfile(self.locate(bucket, key), destination)
+
+    def locate(self, bucket: str, key: str) -> str:
+        """Return the path of a BUCKET_* object."""
+        if bucket == BUCKET_COMMITS:
+            return os.path.join(self.commits_dir, key)
+        elif bucket == BUCKET_FILES:
+            return os.path.join(self.files_dir, self.compilation_files_dir, key)
+        elif bucket == BUCKET_CASES:
+            return os.path.join(self.cases_dir, key)
+        raise ValueError(f"Unknown bucket '{bucket}'")
+
+    @override
+    def store_commit_output(self, commit: Commit, output: IO[bytes]) -> None:
+        # Write next to the final name, then rename over it: readers see
+        # either the previous file or the complete new one, never a partial
+        # write.
+        key = f"{commit.id}.zip"
+        fd, tmp_fname = tempfile.mkstemp(prefix=f".{key}.", dir=self.outputfiles_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                shutil.copyfileobj(output, tmp_file)
+            os.chmod(tmp_fname, OUTPUT_FILE_PERMISSIONS)
+            os.replace(tmp_fname, os.path.join(self.outputfiles_dir, key))
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_fname)
+            raise
@@ -1,90 +1,167 @@
 import os
-from typing import TYPE_CHECKING, cast, override
+from typing import IO, TYPE_CHECKING, cast, override
 
 import boto3
 import boto3.session
 from botocore.config import Config as BotoConfig
 
-from ...config import Config
+from ...config import (
+    DEFAULT_CONCURRENCY_PER_WORKER,
+    PREFETCH_MAX_CONCURRENT_DOWNLOADS,
+    Config,
+)
 from ...model import Commit, TestCase
-from .storage_provider import StorageProvider
+from .storage_provider import (
+    BUCKET_CASES,
+    BUCKET_COMMITS,
+    BUCKET_FILES,
+    StorageProvider,
+    test_case_key,
+)
 
 if TYPE_CHECKING:
-    from mypy_boto3_s3.service_resource import Bucket
+    from mypy_boto3_s3.client import S3Client
+
+
+def max_pool_connections(cfg: Config) -> int:
+    """Return the size of a worker's S3 connection pool.
+
+    Every in-flight commit of a worker may run up to
+    PREFETCH_MAX_CONCURRENT_DOWNLOADS downloads at once. When
+    ``s3.max_pool_connections`` is not configured explicitly the pool is sized
+    for that worst case, so concurrent downloads never wait for (or discard)
+    a connection. An explicit value always wins.
+    """
+    s3cfg = cast(dict[str, object], cfg.s3)
+    explicit_max_pool = s3cfg.get("max_pool_connections")
+    if explicit_max_pool is not None:
+        return int(str(explicit_max_pool))
+    concurrency = int(
+        str(cfg.get("concurrency_per_worker", DEFAULT_CONCURRENCY_PER_WORKER))
+    )
+    return max(1, concurrency) * PREFETCH_MAX_CONCURRENT_DOWNLOADS
 
 
 class S3(StorageProvider):
     """
     Storage provider for accessing files in S3 buckets.
+
+    Holds a single low-level client (and thus a single HTTP connection pool)
+    for its whole lifetime. Unlike boto3 resources, clients are thread-safe,
+    so one instance is shared by every in-flight commit of a worker, including
+    the downloads running concurrently in worker threads.
     """
 
-    commits_bucket: Bucket
-    outputfiles_bucket: Bucket
-    files_bucket: Bucket
-    cases_bucket: Bucket
+    client: S3Client
+    commits_bucket: str
+    outputfiles_bucket: str
+    files_bucket: str
+    cases_bucket: str
     compilation_files_dir: str
+    _max_pool_connections: int
 
     def __init__(self, cfg: Config) -> None:
         s3cfg = cast(dict[str, object], cfg.s3)
+        self.commits_bucket = str(s3cfg["commits_bucket"])
+        self.outputfiles_bucket = str(s3cfg["outputfiles_bucket"])
+        self.files_bucket = str(s3cfg["files_bucket"])
+        self.compilation_files_dir = str(s3cfg["compilation_files_dir"])
+        self.cases_bucket = str(s3cfg["cases_bucket"])
+        self._max_pool_connections = max_pool_connections(cfg)
         s = boto3.session.Session(
             aws_access_key_id=str(s3cfg["access_key"]),
             aws_secret_access_key=str(s3cfg["secret_key"]),
             region_name=str(s3cfg["region"]),
         )
-        # The boto3-stubs Session.resource overload set is only partially
+        # The boto3-stubs Session.client overload set is only partially
         # typed here (only the s3 extra is installed), so the member access
         # itself reports as partially unknown even though the "s3" overload
-        # resolves to S3ServiceResource.
-        s3 = s.resource(  # pyright: ignore[reportUnknownMemberType]
+        # resolves to S3Client.
+        self.client = s.client(  # pyright: ignore[reportUnknownMemberType]
             "s3",
             endpoint_url=str(s3cfg["endpoint"]),
-            config=BotoConfig(s3={"addressing_style": "path"}),
+            config=BotoConfig(
+                s3={"addressing_style": "path"},
+                max_pool_connections=self._max_pool_connections,
+            ),
         )
-        self.commits_bucket = s3.Bucket(str(s3cfg["commits_bucket"]))
-        self.outputfiles_bucket = s3.Bucket(str(s3cfg["outputfiles_bucket"]))
-        self.files_bucket = s3.Bucket(str(s3cfg["files_bucket"]))
-        self.compilation_files_dir = str(s3cfg["compilation_files_dir"])
-        self.cases_bucket = s3.Bucket(str(s3cfg["cases_bucket"]))
+
+    @property
+    def max_pool_connections(self) -> int:
+        """Size of the HTTP connection pool (derived from concurrency if unset)."""
+        return self._max_pool_connections
+
+    @property
+    @override
+    def fetch_workers(self) -> int:
+        # One thread per pooled connection: more would only wait for one.
+        return self._max_pool_connections
+
+    def locate(self, bucket: str, key: str) -> tuple[str, str]:
+        """Return the S3 bucket name and object key of a BUCKET_* object."""
+        if bucket == BUCKET_COMMITS:
+            return self.commits_bucket, key
+        elif bucket == BUCKET_FILES:
+            return self.files_bucket, os.path.join(self.compilation_files_dir, key)
+        elif bucket == BUCKET_CASES:
+            return self.cases_bucket, key
+        raise ValueError(f"Unknown bucket '{bucket}'")
 
     @override
     def fetch_commit_file(self, commit: Commit, destination: str) -> None:
-        self.commits_bucket.download_file(commit.aws_key, destination)
+        self.fetch_object(BUCKET_COMMITS, commit.aws_key, destination)
 
     @override
     def fetch_exercise_file(self, source: str, destination: str) -> None:
-        source = os.path.join(self.compilation_files_dir, source)
-        self.files_bucket.download_file(source, destination)
+        self.fetch_object(BUCKET_FILES, source, destination)
+
+    @override
+    def fetch_exercise_file_version(self, source: str) -> str | None:
+        # HEAD request: the ETag changes whenever the object is overwritten.
+        bucket, key = self.locate(BUCKET_FILES, source)
+        return self.client.head_object(Bucket=bucket, Key=key)["ETag"]
 
     @override
     def fetch_test_case_input_file(self, test_case: TestCase, destination: str) -> None:
-        self.cases_bucket.download_file(f"{test_case.id}/in", destination)
+        self.fetch_object(BUCKET_CASES, test_case_key(test_case, "in"), destination)
 
     @override
     def fetch_test_case_output_file(
         self, test_case: TestCase, destination: str
     ) -> None:
-        self.cases_bucket.download_file(f"{test_case.id}/out", destination)
+        self.fetch_object(BUCKET_CASES, test_case_key(test_case, "out"), destination)
 
     @override
     def fetch_test_case_files(self, test_case: TestCase, destination: str) -> None:
         for fname in test_case.files:
-            key = f"{test_case.id}/files/{fname}"
-            dest_fname = os.path.join(destination, fname)
-            self.cases_bucket.download_file(key, dest_fname)
+            key = test_case_key(test_case, f"files/{fname}")
+            self.fetch_object(BUCKET_CASES, key, os.path.join(destination, fname))
+
+    @override
+    def fetch_object(self, bucket: str, key: str, destination: str) -> None:
+        bucket, key = self.locate(bucket, key)
+        self.client.download_file(bucket, key, destination)
+
+    @override
+    def store_commit_output(self, commit: Commit, output: IO[bytes]) -> None:
+        metadata: dict[str, str] = {
+            "commitId": str(commit.id),
+            "userEmail": commit.user_email,
+            "exercise": str(commit.exercise_id),
+            "offeringId": str(commit.offering_id),
+            "realOfferingId": str(commit.real_offering_id),
+            "courseId": str(commit.course_id),
+        }
+        # S3 reads are strongly consistent after a successful PUT, so there
+        # is no need to poll for the object afterwards.
+        _ = self.client.put_object(
+            Bucket=self.outputfiles_bucket,
+            Body=output,
+            Key=f"{commit.id}.zip",
+            Metadata=metadata,
+        )
 
     @override
-    def store_commit_output(self, commit: Commit, commit_output_fname: str) -> None:
-        key = os.path.basename(commit_output_fname)
-        with open(commit_output_fname, "rb") as output_file:
-            metadata: dict[str, str] = {
-                "commitId": str(commit.id),
-                "userEmail": commit.user_email,
-                "exercise": str(commit.exercise_id),
-                "offeringId": str(commit.offering_id),
-                "realOfferingId": str(commit.real_offering_id),
-                "courseId": str(commit.course_id),
-            }
-            obj = self.outputfiles_bucket.put_object(
-                Body=output_file, Key=key, Metadata=metadata
-            )
-            obj.wait_until_exists()
+    def close(self) -> None:
+        super().close()
+        self.client.close()
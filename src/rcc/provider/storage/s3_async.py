@@ -0,0 +1,184 @@
+import asyncio
+import contextlib
+import os
+from typing import IO, TYPE_CHECKING, BinaryIO, cast, override
+
+import aiobotocore.session
+from aiobotocore.config import AioConfig
+
+from ...config import Config
+from ...model import Commit, TestCase
+from .s3 import max_pool_connections
+from .storage_provider import (
+    BUCKET_CASES,
+    BUCKET_COMMITS,
+    BUCKET_FILES,
+    AsyncStorageProvider,
+    test_case_key,
+)
+
+if TYPE_CHECKING:
+    from types_aiobotocore_s3.client import S3Client
+
+# Bytes read from a download's response before handing them to the thread
+# writing the destination file.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class AsyncS3(AsyncStorageProvider):
+    """
+    Storage provider for S3 buckets, running on the worker's event loop.
+
+    Uses aiobotocore, so it reads the same ``s3`` settings as `S3` and its
+    requests go through the same botocore signing, retries and error types.
+    Transfers wait on the event loop instead of holding a worker thread each;
+    only the writes to the destination files run in threads. The connection
+    pool is bounded by the same `max_pool_connections`.
+
+    The client is created on first use and is bound to that event loop, so
+    the provider must only be used (and closed) from the loop that opened it.
+    """
+
+    commits_bucket: str
+    outputfiles_bucket: str
+    files_bucket: str
+    cases_bucket: str
+    compilation_files_dir: str
+    max_pool_connections: int
+    _session: aiobotocore.session.AioSession
+    _endpoint: str
+    _region: str
+    _access_key: str
+    _secret_key: str
+    _client: S3Client | None
+    _client_lock: asyncio.Lock
+    _exit_stack: contextlib.AsyncExitStack
+
+    def __init__(self, cfg: Config) -> None:
+        s3cfg = cast(dict[str, object], cfg.s3)
+        self.commits_bucket = str(s3cfg["commits_bucket"])
+        self.outputfiles_bucket = str(s3cfg["outputfiles_bucket"])
+        self.files_bucket = str(s3cfg["files_bucket"])
+        self.compilation_files_dir = str(s3cfg["compilation_files_dir"])
+        self.cases_bucket = str(s3cfg["cases_bucket"])
+        self.max_pool_connections = max_pool_connections(cfg)
+        self._session = aiobotocore.session.get_session()
+        self._endpoint = str(s3cfg["endpoint"])
+        self._region = str(s3cfg["region"])
+        self._access_key = str(s3cfg["access_key"])
+        self._secret_key = str(s3cfg["secret_key"])
+        self._client = None
+        self._client_lock = asyncio.Lock()
+        self._exit_stack = contextlib.AsyncExitStack()
+
+    async def client(self) -> S3Client:
+        """Return the provider's client, creating it on first use."""
+        async with self._client_lock:
+            if self._client is None:
+                # Same partially typed overload set as boto3's in `S3`: only
+                # the s3 extra of the stubs is installed.
+                context = self._session.create_client(  # pyright: ignore[reportUnknownMemberType]
+                    "s3",
+                    region_name=self._region,
+                    endpoint_url=self._endpoint,
+                    aws_access_key_id=self._access_key,
+                    aws_secret_access_key=self._secret_key,
+                    config=AioConfig(
+                        s3={"addressing_style": "path"},
+                        max_pool_connections=self.max_pool_connections,
+                    ),
+                )
+                self._client = await self._exit_stack.enter_async_context(context)
+            client = self._client
+        return client
+
+    def locate(self, bucket: str, key: str) -> tuple[str, str]:
+        """Return the S3 bucket name and object key of a BUCKET_* object."""
+        if bucket == BUCKET_COMMITS:
+            return self.commits_bucket, key
+        elif bucket == BUCKET_FILES:
+            return self.files_bucket, os.path.join(self.compilation_files_dir, key)
+        elif bucket == BUCKET_CASES:
+            return self.cases_bucket, key
+        raise ValueError(f"Unknown bucket '{bucket}'")
+
+    @override
+    async def fetch_commit_file(self, commit: Commit, destination: str) -> None:
+        await self.fetch_object(BUCKET_COMMITS, commit.aws_key, destination)
+
+    @override
+    async def fetch_exercise_file(self, source: str, destination: str) -> None:
+        await self.fetch_object(BUCKET_FILES, source, destination)
+
+    @override
+    async def fetch_exercise_file_version(self, source: str) -> str | None:
+        # HEAD request: the ETag changes whenever the object is overwritten.
+        bucket, key = self.locate(BUCKET_FILES, source)
+        client = await self.client()
+        return (await client.head_object(Bucket=bucket, Key=key))["ETag"]
+
+    @override
+    async def fetch_test_case_input_file(
+        self, test_case: TestCase, destination: str
+    ) -> None:
+        await self.fetch_object(
+            BUCKET_CASES, test_case_key(test_case, "in"), destination
+        )
+
+    @override
+    async def fetch_test_case_output_file(
+        self, test_case: TestCase, destination: str
+    ) -> None:
+        await self.fetch_object(
+            BUCKET_CASES, test_case_key(test_case, "out"), destination
+        )
+
+    @override
+    async def fetch_test_case_files(
+        self, test_case: TestCase, destination: str
+    ) -> None:
+        for fname in test_case.files:
+            key = test_case_key(test_case, f"files/{fname}")
+            await self.fetch_object(BUCKET_CASES, key, os.path.join(destination, fname))
+
+    @override
+    async def fetch_object(self, bucket: str, key: str, destination: str) -> None:
+        bucket, key = self.locate(bucket, key)
+        client = await self.client()
+        response = await client.get_object(Bucket=bucket, Key=key)
+        file = await asyncio.to_thread(open, destination, "wb")
+        try:
+            async with response["Body"] as body:
+                async for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+                    _ = await asyncio.to_thread(file.write, chunk)
+        except BaseException:
+            await asyncio.to_thread(file.close)
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(destination)
+            raise
+        await asyncio.to_thread(file.close)
+
+    @override
+    async def store_commit_output(self, commit: Commit, output: IO[bytes]) -> None:
+        metadata: dict[str, str] = {
+            "commitId": str(commit.id),
+            "userEmail": commit.user_email,
+            "exercise": str(commit.exercise_id),
+            "offeringId": str(commit.offering_id),
+            "realOfferingId": str(commit.real_offering_id),
+            "courseId": str(commit.course_id),
+        }
+        client = await self.client()
+        # The body is streamed from ``output``; like `S3`, no HEAD polling
+        # afterwards (S3 reads are strongly consistent after a PUT).
+        _ = await client.put_object(
+            Bucket=self.outputfiles_bucket,
+            Body=cast(BinaryIO, output),
+            Key=f"{commit.id}.zip",
+            Metadata=metadata,
+        )
+
+    @override
+    async def close(self) -> None:
+        self._client = None
+        await self._exit_stack.aclose()
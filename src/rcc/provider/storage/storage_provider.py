@@ -1,16 +1,59 @@
-from typing import TYPE_CHECKING
+import asyncio
+import concurrent.futures
+import threading
+from typing import IO, TYPE_CHECKING, override
+
+from ...config import PREFETCH_MAX_CONCURRENT_DOWNLOADS
 
 if TYPE_CHECKING:
     from ...model import Commit, TestCase
 
+# Buckets objects are fetched from with `fetch_object`/`fetch_many`. Keys
+# are relative to the bucket's layout: a commit's ``aws_key`` in
+# BUCKET_COMMITS, an exercise file's source (``<exercise id>/<name>``, under
+# the compilation files directory) in BUCKET_FILES and a `test_case_key` in
+# BUCKET_CASES.
+BUCKET_COMMITS = "commits"
+BUCKET_FILES = "files"
+BUCKET_CASES = "cases"
+
+
+def test_case_key(test_case: TestCase, name: str) -> str:
+    """Return the BUCKET_CASES key of a test case's ``name`` file.
+
+    ``name`` is ``in``, ``out`` or ``files/<fname>`` for an additional file.
+    """
+    return f"{test_case.id}/{name}"
+
+
+# Guards the lazy creation of the providers' `fetch_many` executors, which
+# may race between the worker threads of concurrent batches.
+_executor_lock = threading.Lock()
+
 
 class StorageProvider:
+    _executor: concurrent.futures.ThreadPoolExecutor | None = None
+
+    @property
+    def fetch_workers(self) -> int:
+        """Number of threads `fetch_many` downloads with, across all batches."""
+        return PREFETCH_MAX_CONCURRENT_DOWNLOADS
+
     def fetch_commit_file(self, _commit: Commit, _destination: str) -> None:
         raise NotImplementedError()
 
     def fetch_exercise_file(self, _source: str, _destination: str) -> None:
         raise NotImplementedError()
 
+    def fetch_exercise_file_version(self, _source: str) -> str | None:
+        """Return an opaque identifier of an exercise file's current content.
+
+        Used to revalidate cached exercise files without downloading them.
+        The default returns `None` (unknown), so cached copies are only
+        trusted until their cache entry expires.
+        """
+        return None
+
     def fetch_test_case_input_file(
         self, _test_case: TestCase, _destination: str
     ) -> None:
@@ -24,5 +67,192 @@ class StorageProvider:
     def fetch_test_case_files(self, _test_case: TestCase, _destination: str) -> None:
         raise NotImplementedError()
 
-    def store_commit_output(self, _commit: Commit, _commit_output_fname: str) -> None:
+    def store_commit_output(self, _commit: Commit, _output: IO[bytes]) -> None:
+        """Store the commit's output zip, read from ``output`` to its end.
+
+        The object is named ``<commit id>.zip``. ``output`` is a rewound
+        (possibly in-memory) file; it is read, never closed.
+        """
+        raise NotImplementedError()
+
+    def fetch_object(self, _bucket: str, _key: str, _destination: str) -> None:
+        """Download the object ``key`` of ``bucket`` (a BUCKET_* name)."""
+        raise NotImplementedError()
+
+    def fetch_many(
+        self, objects: list[tuple[str, str, str]], max_concurrency: int
+    ) -> None:
+        """Download every ``(bucket, key, destination)`` of ``objects``.
+
+        Runs up to ``max_concurrency`` `fetch_object` calls at once in the
+        provider's thread pool of `fetch_workers` threads, which lives until
+        `close` and is shared by concurrent batches, so providers whose
+        clients are thread-safe reuse their connections. Every download is
+        finished (or failed) when this returns; the first error is raised.
+        """
+        if not objects:
+            return
+        executor = self._fetch_executor()
+        slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        futures: list[concurrent.futures.Future[None]] = []
+        try:
+            for bucket, key, destination in objects:
+                _ = slots.acquire()
+                future = executor.submit(self.fetch_object, bucket, key, destination)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+        finally:
+            _ = concurrent.futures.wait(futures)
+        for future in futures:
+            future.result()
+
+    def _fetch_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        with _executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    self.fetch_workers, thread_name_prefix="fetch"
+                )
+            return self._executor
+
+    def close(self) -> None:
+        """Release the provider's connections and `fetch_many` threads."""
+        with _executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+class AsyncStorageProvider:
+    """Storage provider whose operations are coroutines.
+
+    Runs on the worker's event loop, so in-flight transfers cost no threads.
+    The engine accepts either kind of provider (see `to_async`).
+    """
+
+    async def fetch_commit_file(self, _commit: Commit, _destination: str) -> None:
+        raise NotImplementedError()
+
+    async def fetch_exercise_file(self, _source: str, _destination: str) -> None:
+        raise NotImplementedError()
+
+    async def fetch_exercise_file_version(self, _source: str) -> str | None:
+        """See `StorageProvider.fetch_exercise_file_version`."""
+        return None
+
+    async def fetch_test_case_input_file(
+        self, _test_case: TestCase, _destination: str
+    ) -> None:
+        raise NotImplementedError()
+
+    async def fetch_test_case_output_file(
+        self, _test_case: TestCase, _destination: str
+    ) -> None:
         raise NotImplementedError()
+
+    async def fetch_test_case_files(
+        self, _test_case: TestCase, _destination: str
+    ) -> None:
+        raise NotImplementedError()
+
+    async def store_commit_output(self, _commit: Commit, _output: IO[bytes]) -> None:
+        """See `StorageProvider.store_commit_output`."""
+        raise NotImplementedError()
+
+    async def fetch_object(self, _bucket: str, _key: str, _destination: str) -> None:
+        """See `StorageProvider.fetch_object`."""
+        raise NotImplementedError()
+
+    async def fetch_many(
+        self, objects: list[tuple[str, str, str]], max_concurrency: int
+    ) -> None:
+        """See `StorageProvider.fetch_many`; runs as concurrent tasks."""
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def fetch(bucket: str, key: str, destination: str) -> None:
+            async with semaphore:
+                await self.fetch_object(bucket, key, destination)
+
+        results = await asyncio.gather(
+            *(fetch(*obj) for obj in objects), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def close(self) -> None:
+        """Release the provider's connections. The default does nothing."""
+
+
+class ThreadedStorageProvider(AsyncStorageProvider):
+    """Runs a synchronous `StorageProvider` in worker threads."""
+
+    provider: StorageProvider
+
+    def __init__(self, provider: StorageProvider) -> None:
+        self.provider = provider
+
+    @override
+    async def fetch_commit_file(self, commit: Commit, destination: str) -> None:
+        await asyncio.to_thread(self.provider.fetch_commit_file, commit, destination)
+
+    @override
+    async def fetch_exercise_file(self, source: str, destination: str) -> None:
+        await asyncio.to_thread(self.provider.fetch_exercise_file, source, destination)
+
+    @override
+    async def fetch_exercise_file_version(self, source: str) -> str | None:
+        return await asyncio.to_thread(
+            self.provider.fetch_exercise_file_version, source
+        )
+
+    @override
+    async def fetch_test_case_input_file(
+        self, test_case: TestCase, destination: str
+    ) -> None:
+        await asyncio.to_thread(
+            self.provider.fetch_test_case_input_file, test_case, destination
+        )
+
+    @override
+    async def fetch_test_case_output_file(
+        self, test_case: TestCase, destination: str
+    ) -> None:
+        await asyncio.to_thread(
+            self.provider.fetch_test_case_output_file, test_case, destination
+        )
+
+    @override
+    async def fetch_test_case_files(
+        self, test_case: TestCase, destination: str
+    ) -> None:
+        await asyncio.to_thread(
+            self.provider.fetch_test_case_files, test_case, destination
+        )
+
+    @override
+    async def store_commit_output(self, commit: Commit, output: IO[bytes]) -> None:
+        await asyncio.to_thread(self.provider.store_commit_output, commit, output)
+
+    @override
+    async def fetch_object(self, bucket: str, key: str, destination: str) -> None:
+        await asyncio.to_thread(self.provider.fetch_object, bucket, key, destination)
+
+    @override
+    async def fetch_many(
+        self, objects: list[tuple[str, str, str]], max_concurrency: int
+    ) -> None:
+        await asyncio.to_thread(self.provider.fetch_many, objects, max_concurrency)
+
+    @override
+    async def close(self) -> None:
+        await asyncio.to_thread(self.provider.close)
+
+
+def to_async(provider: StorageProvider | AsyncStorageProvider) -> AsyncStorageProvider:
+    """Return ``provider`` as an `AsyncStorageProvider`.
+
+    Synchronous providers are wrapped so their calls run in worker threads.
+    """
+    if isinstance(provider, AsyncStorageProvider):
+        return provider
+    return ThreadedStorageProvider(provider)
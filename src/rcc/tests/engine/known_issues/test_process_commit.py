@@ -5,7 +5,7 @@ import os
 import shutil
 import sys
 import unittest
-from typing import NotRequired, TextIO, TypedDict, cast, override
+from typing import IO, NotRequired, TextIO, TypedDict, cast, override
 
 import rcc.config
 import rcc.engine
@@ -201,9 +201,13 @@ class MockDataProvider(rcc.provider.data.DataProvider):
 
 class MockStorageProvider(rcc.provider.storage.StorageProvider):
     dirname: str
+    # Exercise of the commit being processed (test case ids repeat across
+    # exercises, and batched fetches only carry the test case id).
+    exercise_id: int
 
-    def __init__(self, cfg: rcc.config.Config) -> None:
+    def __init__(self, exercise_id: int) -> None:
         self.dirname = os.path.dirname(os.path.realpath(__file__))
+        self.exercise_id = exercise_id
 
     @override
     def fetch_commit_file(self, commit: Commit, destination: str) -> None:
@@ -251,20 +255,35 @@ class MockStorageProvider(rcc.provider.storage.StorageProvider):
             _ = shutil.copyfile(source, os.path.join(destination, fname))
 
     @override
-    def store_commit_output(self, commit: Commit, commit_output_fname: str) -> None:
+    def fetch_object(self, bucket: str, key: str, destination: str) -> None:
+        # The engine fetches exercise and test case files in batches; the
+        # BUCKET_CASES keys are "<test case id>/in", "<test case id>/out" and
+        # "<test case id>/files/<fname>".
+        if bucket != rcc.provider.storage.BUCKET_CASES:
+            return
+        test_case_id, name = key.split("/", 1)
+        exercise_dir = os.path.join(self.dirname, "exercises", str(self.exercise_id))
+        if name in ("in", "out"):
+            source = os.path.join(exercise_dir, f"{test_case_id}.{name}")
+        else:
+            fname = name.removeprefix("files/")
+            source = os.path.join(exercise_dir, test_case_id, fname)
+        _ = shutil.copyfile(source, destination)
+
+    @override
+    def store_commit_output(self, commit: Commit, output: IO[bytes]) -> None:
         pass
 
 
 class TestEngineKnownIssues(unittest.TestCase):
     data_prov: MockDataProvider = MockDataProvider()
-    storage_provider_class: object = rcc.provider.storage.S3
+    storage_from_config: object = rcc.provider.storage.from_config
     handler: logging.StreamHandler[TextIO] = logging.StreamHandler(sys.stdout)
 
     @override
     def setUp(self) -> None:
         self.data_prov = MockDataProvider()
-        self.storage_provider_class = rcc.provider.storage.S3
-        rcc.provider.storage.S3 = MockStorageProvider
+        self.storage_from_config = rcc.provider.storage.from_config
         self.handler = logging.StreamHandler(sys.stdout)
         self.handler.setLevel(logging.DEBUG)
         self.handler.setFormatter(
@@ -276,13 +295,20 @@ class TestEngineKnownIssues(unittest.TestCase):
 
     @override
     def tearDown(self) -> None:
-        rcc.provider.storage.S3 = self.storage_provider_class
+        rcc.provider.storage.from_config = self.storage_from_config
         logger = logging.getLogger(rcc.config.DEFAULT_LOGGER)
         logger.removeHandler(self.handler)
 
     def test_process_commit_known_issues(self) -> None:
         for metadata in commit_metadata:
             commit = build_commit(metadata)
+
+            def storage_provider(
+                _cfg: rcc.config.Config, exercise_id: int = commit.real_exercise_id
+            ) -> MockStorageProvider:
+                return MockStorageProvider(exercise_id)
+
+            rcc.provider.storage.from_config = storage_provider
             with self.subTest(name=commit.user_email):
                 cfg = rcc.config.get_config(rcc.config.DEFAULT_CONFIG)
                 asyncio.run(rcc.engine.process_commit(self.data_prov, commit, cfg))
@@ -4,7 +4,7 @@ import logging
 import sys
 import unittest
 import zipfile
-from typing import TextIO, cast, override
+from typing import IO, TextIO, cast, override
 
 import tests.engine.test_process_commit_hello as hello
 
@@ -187,7 +187,17 @@ class MockStorageProvider(rcc.provider.storage.StorageProvider):
         pass
 
     @override
-    def store_commit_output(self, commit: Commit, commit_output_fname: str) -> None:
+    def fetch_object(self, bucket: str, key: str, destination: str) -> None:
+        # The engine fetches exercise and test case files in batches.
+        if bucket == rcc.provider.storage.BUCKET_CASES and key == "5432/in":
+            with open(destination, "w") as in_file:
+                _ = in_file.write("This input should be ignored.\n")
+        elif bucket == rcc.provider.storage.BUCKET_CASES and key == "5432/out":
+            with open(destination, "w") as out_file:
+                _ = out_file.write("Hello, run.codes!\n")
+
+    @override
+    def store_commit_output(self, commit: Commit, output: IO[bytes]) -> None:
         pass
 
 
@@ -0,0 +1,98 @@
+"""
+Builders shared by the test modules: commits, test cases, configs and files.
+"""
+
+import datetime
+import os
+
+import rcc.config
+from rcc.model import Commit, TestCase
+
+
+def make_commit(commit_id: int = 42, status: int = Commit.STATUS_PROCESSING) -> Commit:
+    return Commit(
+        commit_id,
+        "user@example.com",
+        1,
+        5,
+        status,
+        "",
+        0,
+        0.0,
+        False,
+        "",
+        datetime.datetime(2026, 1, 1, tzinfo=datetime.UTC),
+        None,
+        None,
+        None,
+        "",
+        "1.2.3.4",
+        f"commits/{commit_id}/main.c",
+        1,
+        1,
+        1,
+        "main.c",
+    )
+
+
+def make_test_case(
+    test_case_id: int,
+    files: list[str] | None = None,
+    last_update: datetime.datetime | None = None,
+) -> TestCase:
+    return TestCase(
+        test_case_id,
+        1,
+        TestCase.IO_TYPE_TEXT,
+        TestCase.IO_TYPE_TEXT,
+        False,
+        False,
+        0,
+        5,
+        0,
+        False,
+        0,
+        None,
+        last_update,
+        files,
+    )
+
+
+def make_cfg(**values: object) -> rcc.config.Config:
+    # The engine helpers read the registered default config.
+    return rcc.config.from_dict(rcc.config.DEFAULT_CONFIG, values)
+
+
+def make_engine_cfg(exec_dir: str, **overrides: object) -> rcc.config.Config:
+    """Config for driving the engine without a docker daemon."""
+    values: dict[str, object] = {
+        "provider": {"data": "postgres", "storage": "s3"},
+        "concurrency_per_worker": 4,
+        "exec_dir": exec_dir,
+        "exec_dir_remote": exec_dir,
+        "src_dir": "src",
+        "output_files_dir": "outputfiles",
+        "container_cfg_file": "container.config",
+        "monitor_max_file_size": 5242880,
+        "monitor_max_mem_size": 268435456,
+        "compilation_timeout": 10.0,
+        "base_exec_timeout": 5.0,
+        "max_output_file_size": 1048576,
+        "cleanup_on_error": False,
+        # No image is pulled and every container is started for its commit.
+        "images": [],
+        "container_pool": {},
+    }
+    values.update(overrides)
+    return make_cfg(**values)
+
+
+def write_file(path: str, content: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        _ = f.write(content)
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
@@ -0,0 +1,707 @@
+"""
+Tests for the worker's on-disk test case cache (``rcc.cache.FileCache``).
+
+No external services required: "downloads" are coroutines writing a few
+bytes to the path handed over by the cache.
+"""
+
+import asyncio
+import datetime
+import errno
+import fcntl
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+from typing import override
+from unittest import mock
+
+import rcc.cache
+import rcc.config
+import rcc.engine
+from rcc.cache import ExerciseCache, ExerciseCasesCache, FileCache
+from rcc.model import Commit, TestCase
+from rcc.provider.data import DataProvider
+from rcc.provider.storage import BUCKET_CASES, BUCKET_FILES, StorageProvider
+from rcc.tests.helpers import (
+    make_cfg,
+    make_commit,
+    make_test_case,
+    read_file,
+    write_file,
+)
+
+
+class CountingFill:
+    """Writes ``content`` to the requested paths and counts the batches."""
+
+    content: bytes
+    calls: int
+    delay: float
+
+    def __init__(self, content: bytes, delay: float = 0.0) -> None:
+        self.content = content
+        self.calls = 0
+        self.delay = delay
+
+    async def __call__(self, misses: list[tuple[str, str]]) -> None:
+        # fetch_many calls it even when nothing misses.
+        if not misses:
+            return
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        for _, path in misses:
+            write_file(path, self.content)
+
+
+class TestFileCache(unittest.IsolatedAsyncioTestCase):
+    _tmpdir: str
+
+    @override
+    def __init__(self, method_name: str = "runTest") -> None:
+        self._tmpdir = ""
+        super().__init__(method_name)
+
+    @override
+    def setUp(self) -> None:
+        self._tmpdir = tempfile.mkdtemp()
+
+    @override
+    def tearDown(self) -> None:
+        shutil.rmtree(self._tmpdir)
+
+    def _cache(self, max_size: int) -> FileCache:
+        file_cache = FileCache(os.path.join(self._tmpdir, "cache"), max_size)
+        file_cache.open()
+        return file_cache
+
+    def _dest(self, name: str) -> str:
+        return os.path.join(self._tmpdir, name)
+
+    def _read(self, name: str) -> bytes:
+        return read_file(self._dest(name))
+
+    async def test_second_fetch_is_a_hit(self) -> None:
+        file_cache = self._cache(1024)
+        fill = CountingFill(b"hello")
+
+        await file_cache.fetch_many([("k", self._dest("a"))], fill)
+        await file_cache.fetch_many([("k", self._dest("b"))], fill)
+
+        self.assertEqual(fill.calls, 1)
+        self.assertEqual(self._read("a"), b"hello")
+        self.assertEqual(self._read("b"), b"hello")
+        self.assertEqual((file_cache.hits, file_cache.misses), (1, 1))
+        self.assertEqual(file_cache.size, 5)
+
+    async def test_concurrent_misses_share_one_download(self) -> None:
+        file_cache = self._cache(1024)
+        fill = CountingFill(b"data", delay=0.05)
+
+        _ = await asyncio.gather(
+            *(
+                file_cache.fetch_many([("k", self._dest(f"d{i}"))], fill)
+                for i in range(5)
+            )
+        )
+
+        self.assertEqual(fill.calls, 1)
+        self.assertEqual(file_cache.misses, 1)
+        self.assertEqual(file_cache.hits, 4)
+        for i in range(5):
+            self.assertEqual(self._read(f"d{i}"), b"data")
+
+    async def test_fetch_many_fills_every_miss_in_one_call(self) -> None:
+        file_cache = self._cache(1024)
+        await file_cache.fetch_many([("a", self._dest("x"))], CountingFill(b"cached"))
+        batches: list[list[str]] = []
+
+        async def fill(misses: list[tuple[str, str]]) -> None:
+            batches.append([key for key, _ in misses])
+            for key, path in misses:
+                write_file(path, key.encode())
+
+        await file_cache.fetch_many(
+            [("a", self._dest("a")), ("b", self._dest("b")), ("c", self._dest("c"))],
+            fill,
+        )
+
+        self.assertEqual(batches, [["b", "c"]])
+        self.assertEqual(self._read("a"), b"cached")
+        self.assertEqual(self._read("c"), b"c")
+        self.assertEqual((file_cache.hits, file_cache.misses), (1, 3))
+
+    async def test_fetch_many_failure_caches_nothing(self) -> None:
+        file_cache = self._cache(1024)
+
+        async def fill(misses: list[tuple[str, str]]) -> None:
+            write_file(misses[0][1], b"partial")
+            raise OSError("connection reset")
+
+        with self.assertRaises(OSError):
+            await file_cache.fetch_many(
+                [("a", self._dest("a")), ("b", self._dest("b"))], fill
+            )
+
+        self.assertEqual(file_cache.size, 0)
+        self.assertEqual(os.listdir(file_cache.directory), [])
+        fill_again = CountingFill(b"ok")
+        await file_cache.fetch_many([("a", self._dest("a"))], fill_again)
+        self.assertEqual(fill_again.calls, 1)
+
+    async def test_fetch_many_partially_sealed_batch_leaves_nothing(self) -> None:
+        file_cache = self._cache(1024)
+
+        async def fill(misses: list[tuple[str, str]]) -> None:
+            # Reports success without writing the second file, so sealing the
+            # batch fails after moving the first one into place.
+            write_file(misses[0][1], b"first")
+
+        with self.assertRaises(FileNotFoundError):
+            await file_cache.fetch_many(
+                [("a", self._dest("a")), ("b", self._dest("b"))], fill
+            )
+
+        self.assertEqual(file_cache.size, 0)
+        self.assertEqual(os.listdir(file_cache.directory), [])
+
+    async def test_least_recently_used_entry_is_evicted_over_budget(self) -> None:
+        file_cache = self._cache(10)
+        fills = {key: CountingFill(b"12345") for key in ("a", "b", "c")}
+
+        await file_cache.fetch_many([("a", self._dest("x"))], fills["a"])
+        await file_cache.fetch_many([("b", self._dest("x"))], fills["b"])
+        # Touch "a" so "b" becomes the least recently used entry.
+        await file_cache.fetch_many([("a", self._dest("x"))], fills["a"])
+        await file_cache.fetch_many([("c", self._dest("x"))], fills["c"])
+
+        self.assertEqual(file_cache.evictions, 1)
+        self.assertLessEqual(file_cache.size, 10)
+        await file_cache.fetch_many([("a", self._dest("x"))], fills["a"])
+        await file_cache.fetch_many([("b", self._dest("x"))], fills["b"])
+        self.assertEqual(fills["a"].calls, 1)
+        self.assertEqual(fills["b"].calls, 2)
+
+    async def test_oversized_file_is_delivered_but_not_kept(self) -> None:
+        file_cache = self._cache(3)
+        fill = CountingFill(b"too large")
+
+        await file_cache.fetch_many([("k", self._dest("a"))], fill)
+
+        self.assertEqual(self._read("a"), b"too large")
+        self.assertEqual(file_cache.size, 0)
+        self.assertEqual(os.listdir(file_cache.directory), [])
+
+    async def test_failed_fill_caches_nothing(self) -> None:
+        file_cache = self._cache(1024)
+
+        async def failing_fill(misses: list[tuple[str, str]]) -> None:
+            write_file(misses[0][1], b"partial")
+            raise RuntimeError("s3 unavailable")
+
+        with self.assertRaisesRegex(RuntimeError, "s3 unavailable"):
+            await file_cache.fetch_many([("k", self._dest("a"))], failing_fill)
+
+        self.assertEqual(file_cache.size, 0)
+        self.assertEqual(os.listdir(file_cache.directory), [])
+        fill = CountingFill(b"ok")
+        await file_cache.fetch_many([("k", self._dest("a"))], fill)
+        self.assertEqual(fill.calls, 1)
+
+    async def test_cached_files_are_read_only(self) -> None:
+        file_cache = self._cache(1024)
+        await file_cache.fetch_many([("k", self._dest("a"))], CountingFill(b"x"))
+
+        (name,) = os.listdir(file_cache.directory)
+        mode = os.stat(os.path.join(file_cache.directory, name)).st_mode
+        self.assertFalse(mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+    async def test_materialized_files_are_read_only_and_never_the_cached_inode(
+        self,
+    ) -> None:
+        file_cache = self._cache(1024)
+        await file_cache.fetch_many([("k", self._dest("a"))], CountingFill(b"shared"))
+
+        (name,) = os.listdir(file_cache.directory)
+        cached = os.stat(os.path.join(file_cache.directory, name))
+        materialized = os.stat(self._dest("a"))
+        self.assertFalse(materialized.st_mode & stat.S_IWUSR)
+        # A reflink or a copy: never a hardlink the container could write to.
+        self.assertNotEqual(materialized.st_ino, cached.st_ino)
+        self.assertEqual(cached.st_nlink, 1)
+        self.assertEqual(self._read("a"), b"shared")
+
+    async def test_writing_a_materialized_file_leaves_the_cache_unchanged(
+        self,
+    ) -> None:
+        file_cache = self._cache(1024)
+        await file_cache.fetch_many([("k", self._dest("a"))], CountingFill(b"pristine"))
+
+        # What a program running as root in the container can do.
+        os.chmod(self._dest("a"), 0o644)
+        write_file(self._dest("a"), b"tampered")
+        fill = CountingFill(b"unused")
+        await file_cache.fetch_many([("k", self._dest("b"))], fill)
+
+        self.assertEqual(fill.calls, 0)
+        self.assertEqual(self._read("b"), b"pristine")
+
+    async def test_link_hardlinks_without_reflinks(self) -> None:
+        file_cache = self._cache(1024)
+        with mock.patch.object(rcc.cache, "_reflink", return_value=False):
+            await file_cache.fetch_many(
+                [("k", self._dest("a"))], CountingFill(b"linked"), True
+            )
+            await file_cache.fetch_many(
+                [("k", self._dest("b"))], CountingFill(b"linked")
+            )
+
+        (name,) = os.listdir(file_cache.directory)
+        cached = os.stat(os.path.join(file_cache.directory, name))
+        self.assertEqual(os.stat(self._dest("a")).st_ino, cached.st_ino)
+        self.assertNotEqual(os.stat(self._dest("b")).st_ino, cached.st_ino)
+
+    async def test_materialize_replaces_an_existing_destination(self) -> None:
+        file_cache = self._cache(1024)
+        write_file(self._dest("a"), b"stale")
+
+        await file_cache.fetch_many([("k", self._dest("a"))], CountingFill(b"fresh"))
+
+        self.assertEqual(self._read("a"), b"fresh")
+
+    async def test_materialize_falls_back_to_a_copy_across_filesystems(
+        self,
+    ) -> None:
+        file_cache = self._cache(1024)
+        cross_device = OSError(errno.EXDEV, "Invalid cross-device link")
+        with (
+            mock.patch.object(rcc.cache, "_reflink", return_value=False),
+            mock.patch.object(os, "link", side_effect=cross_device),
+        ):
+            await file_cache.fetch_many(
+                [("k", self._dest("a"))], CountingFill(b"copied"), True
+            )
+
+        (name,) = os.listdir(file_cache.directory)
+        cached = os.stat(os.path.join(file_cache.directory, name))
+        materialized = os.stat(self._dest("a"))
+        self.assertNotEqual(materialized.st_ino, cached.st_ino)
+        self.assertFalse(materialized.st_mode & stat.S_IWUSR)
+        self.assertEqual(self._read("a"), b"copied")
+
+    async def test_open_removes_directories_of_dead_processes(self) -> None:
+        root = os.path.join(self._tmpdir, "cache")
+        # PIDs are bounded well below this value on Linux.
+        stale = os.path.join(root, "999999999")
+        os.makedirs(stale)
+        write_file(f"{stale}.lock", b"")
+        write_file(os.path.join(root, "999999998.lock"), b"")
+
+        file_cache = self._cache(1024)
+
+        self.assertEqual(
+            sorted(os.listdir(root)),
+            sorted([str(os.getpid()), f"{os.getpid()}.lock"]),
+        )
+        file_cache.close()
+        self.assertEqual(os.listdir(root), [])
+
+    async def test_open_keeps_directories_of_locked_processes(self) -> None:
+        root = os.path.join(self._tmpdir, "cache")
+        # A live process whose PID is not visible here (another namespace).
+        live = os.path.join(root, "999999999")
+        os.makedirs(live)
+        fd = os.open(f"{live}.lock", os.O_RDWR | os.O_CREAT)
+        self.addCleanup(os.close, fd)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        file_cache = self._cache(1024)
+        file_cache.close()
+
+        self.assertTrue(os.path.isdir(live))
+        self.assertTrue(os.path.exists(f"{live}.lock"))
+
+    async def test_open_clears_leftovers_of_a_crashed_process_with_our_pid(
+        self,
+    ) -> None:
+        root = os.path.join(self._tmpdir, "cache")
+        leftover = os.path.join(root, str(os.getpid()), "stale")
+        write_file(leftover, b"old")
+
+        file_cache = self._cache(1024)
+
+        self.assertEqual(os.listdir(file_cache.directory), [])
+        file_cache.close()
+
+
+class TestTestCaseCacheKey(unittest.TestCase):
+    def test_key_changes_with_last_update(self) -> None:
+        before = make_test_case(
+            7, last_update=datetime.datetime(2026, 1, 1, tzinfo=datetime.UTC)
+        )
+        after = make_test_case(
+            7, last_update=datetime.datetime(2026, 1, 2, tzinfo=datetime.UTC)
+        )
+
+        self.assertNotEqual(
+            rcc.engine.test_case_cache_key(before, "in"),
+            rcc.engine.test_case_cache_key(after, "in"),
+        )
+        self.assertNotEqual(
+            rcc.engine.test_case_cache_key(before, "in"),
+            rcc.engine.test_case_cache_key(before, "out"),
+        )
+
+    def test_test_cases_without_last_update_are_not_cached(self) -> None:
+        self.assertIsNone(rcc.engine.test_case_cache_key(make_test_case(7), "in"))
+
+
+class InputCountingStorage(StorageProvider):
+    """Storage whose test case inputs contain the test case id."""
+
+    input_fetches: int
+
+    def __init__(self) -> None:
+        self.input_fetches = 0
+
+    @override
+    def fetch_object(self, bucket: str, key: str, destination: str) -> None:
+        test_case_id, name = key.split("/", 1)
+        if bucket == BUCKET_CASES and name == "in":
+            self.input_fetches += 1
+        with open(destination, "w") as f:
+            _ = f.write(test_case_id)
+
+
+class TestCopyTestCaseFilesThroughCache(unittest.IsolatedAsyncioTestCase):
+    async def test_inputs_are_downloaded_once_per_worker(self) -> None:
+        storage = InputCountingStorage()
+        last_update = datetime.datetime(2026, 1, 1, tzinfo=datetime.UTC)
+        test_cases = [
+            make_test_case(1, last_update=last_update),
+            make_test_case(2, last_update=last_update),
+        ]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cfg = make_cfg(exec_dir=tmpdir, src_dir="src")
+            rcc.cache.open_caches(cfg)
+            try:
+                for commit_dir in ("commit_1", "commit_2"):
+                    base_dir = os.path.join(tmpdir, commit_dir)
+                    os.makedirs(base_dir)
+                    await rcc.engine.copy_test_case_files(
+                        storage,
+                        test_cases,
+                        base_dir,
+                        2,
+                    )
+                    self.assertEqual(read_file(os.path.join(base_dir, "2.in")), b"2")
+                file_cache = rcc.cache.get_file_cache()
+                assert file_cache is not None
+                self.assertEqual((file_cache.hits, file_cache.misses), (2, 2))
+            finally:
+                rcc.cache.close_caches()
+
+        self.assertEqual(storage.input_fetches, 2)
+        self.assertIsNone(rcc.cache.get_file_cache())
+
+
+class TestExerciseCache(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_lookups_share_one_load(self) -> None:
+        exercise_cache = ExerciseCache(60)
+        loads = 0
+
+        async def load() -> list[tuple[str, str | None]]:
+            nonlocal loads
+            loads += 1
+            await asyncio.sleep(0.05)
+            return [("Makefile", "etag-1")]
+
+        results = await asyncio.gather(*(exercise_cache.get(1, load) for _ in range(5)))
+
+        self.assertEqual(loads, 1)
+        self.assertEqual(results, [[("Makefile", "etag-1")]] * 5)
+        self.assertEqual((exercise_cache.hits, exercise_cache.misses), (4, 1))
+
+    async def test_expired_entries_are_loaded_again(self) -> None:
+        exercise_cache = ExerciseCache(60)
+        versions = iter(["etag-1", "etag-2"])
+
+        async def load() -> list[tuple[str, str | None]]:
+            return [("Makefile", next(versions))]
+
+        self.assertEqual(await exercise_cache.get(1, load), [("Makefile", "etag-1")])
+        self.assertEqual(await exercise_cache.get(1, load), [("Makefile", "etag-1")])
+        with mock.patch.object(time, "monotonic", return_value=time.monotonic() + 61):
+            self.assertEqual(
+                await exercise_cache.get(1, load), [("Makefile", "etag-2")]
+            )
+
+    async def test_unknown_versions_are_unique_per_load(self) -> None:
+        exercise_cache = ExerciseCache(60)
+
+        async def load() -> list[tuple[str, str | None]]:
+            return [("Makefile", None)]
+
+        ((_, first),) = await exercise_cache.get(1, load)
+        with mock.patch.object(time, "monotonic", return_value=time.monotonic() + 61):
+            ((_, second),) = await exercise_cache.get(1, load)
+        self.assertNotEqual(first, second)
+
+
+def make_cases(test_case_id: int) -> list[TestCase]:
+    test_case = make_test_case(test_case_id)
+    test_case.files = ["data.txt"]
+    return [test_case]
+
+
+class TestExerciseCasesCache(unittest.IsolatedAsyncioTestCase):
+    async def test_unchanged_version_is_served_from_the_cache(self) -> None:
+        cases_cache = ExerciseCasesCache(8)
+        loads = 0
+
+        async def probe() -> object:
+            return (1, "2026-01-01")
+
+        async def load() -> list[TestCase]:
+            nonlocal loads
+            loads += 1
+            return make_cases(1)
+
+        first = await cases_cache.get(5, probe, load)
+        second = await cases_cache.get(5, probe, load)
+
+        self.assertEqual(loads, 1)
+        self.assertEqual([tc.id for tc in second], [1])
+        self.assertEqual((cases_cache.hits, cases_cache.misses), (1, 1))
+        # Every caller gets its own copies to mutate.
+        first[0].abs_error = 0.0
+        second[0].files.append("other.txt")
+        third = await cases_cache.get(5, probe, load)
+        self.assertIsNone(third[0].abs_error)
+        self.assertEqual(third[0].files, ["data.txt"])
+
+    async def test_new_version_loads_again(self) -> None:
+        cases_cache = ExerciseCasesCache(8)
+        versions = iter([1, 1, 2])
+        loads = 0
+
+        async def probe() -> object:
+            return next(versions)
+
+        async def load() -> list[TestCase]:
+            nonlocal loads
+            loads += 1
+            return make_cases(loads)
+
+        _ = await cases_cache.get(5, probe, load)
+        _ = await cases_cache.get(5, probe, load)
+        test_cases = await cases_cache.get(5, probe, load)
+
+        self.assertEqual(loads, 2)
+        self.assertEqual([tc.id for tc in test_cases], [2])
+
+    async def test_unknown_version_is_never_cached(self) -> None:
+        cases_cache = ExerciseCasesCache(8)
+        loads = 0
+
+        async def probe() -> object:
+            return None
+
+        async def load() -> list[TestCase]:
+            nonlocal loads
+            loads += 1
+            return []
+
+        for _ in range(2):
+            _ = await cases_cache.get(5, probe, load)
+
+        self.assertEqual(loads, 2)
+        self.assertEqual(cases_cache.stats()["entries"], 0)
+
+    async def test_least_recently_used_exercise_is_evicted(self) -> None:
+        cases_cache = ExerciseCasesCache(2)
+        loaded: list[int] = []
+
+        async def probe() -> object:
+            return 1
+
+        def loader(exercise_id: int):
+            async def load() -> list[TestCase]:
+                loaded.append(exercise_id)
+                return []
+
+            return load
+
+        for exercise_id in (1, 2, 1, 3, 1, 2):
+            _ = await cases_cache.get(exercise_id, probe, loader(exercise_id))
+
+        # Exercise 2 was the least recently used when 3 came in.
+        self.assertEqual(loaded, [1, 2, 3, 2])
+
+    async def test_concurrent_lookups_share_one_load(self) -> None:
+        cases_cache = ExerciseCasesCache(8)
+        loads = 0
+
+        async def probe() -> object:
+            return 1
+
+        async def load() -> list[TestCase]:
+            nonlocal loads
+            loads += 1
+            await asyncio.sleep(0.05)
+            return make_cases(1)
+
+        results = await asyncio.gather(
+            *(cases_cache.get(5, probe, load) for _ in range(4))
+        )
+
+        self.assertEqual(loads, 1)
+        self.assertEqual([len(r) for r in results], [1] * 4)
+
+
+class ExerciseFilesProvider(DataProvider):
+    fetch_count: int
+
+    def __init__(self) -> None:
+        self.fetch_count = 0
+
+    @override
+    async def fetch_exercise_files(self, commit: Commit) -> list[str]:
+        self.fetch_count += 1
+        return ["Makefile", "lib/util.h"]
+
+
+class ExerciseFilesStorage(StorageProvider):
+    """Serves exercise files whose content is their current version."""
+
+    versions: dict[str, str]
+    version_fetches: int
+    downloads: int
+
+    def __init__(self) -> None:
+        self.versions = {"5/Makefile": "v1", "5/lib/util.h": "v1"}
+        self.version_fetches = 0
+        self.downloads = 0
+
+    @override
+    def fetch_object(self, bucket: str, key: str, destination: str) -> None:
+        assert bucket == BUCKET_FILES
+        self.downloads += 1
+        write_file(destination, self.versions[key].encode())
+
+    @override
+    def fetch_exercise_file_version(self, source: str) -> str | None:
+        self.version_fetches += 1
+        return self.versions[source]
+
+
+class TestCopySourceFilesThroughCache(unittest.IsolatedAsyncioTestCase):
+    async def _copy(
+        self,
+        tmpdir: str,
+        commit: Commit,
+        provider: DataProvider,
+        storage: StorageProvider,
+    ) -> str:
+        base_dir = os.path.join(tmpdir, f"commit_{commit.id}")
+        src_dir = os.path.join(base_dir, "src")
+        os.makedirs(src_dir)
+        write_file(os.path.join(src_dir, "main.c"), b"int main() {}")
+        await rcc.engine.copy_source_files(provider, storage, commit, base_dir, 2)
+        return src_dir
+
+    async def test_burst_for_one_exercise_downloads_once(self) -> None:
+        provider = ExerciseFilesProvider()
+        storage = ExerciseFilesStorage()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cfg = make_cfg(exec_dir=tmpdir, src_dir="src")
+            rcc.cache.open_caches(cfg)
+            try:
+                src_dirs = await asyncio.gather(
+                    *(
+                        self._copy(tmpdir, make_commit(i), provider, storage)
+                        for i in range(10)
+                    )
+                )
+                for src_dir in src_dirs:
+                    self.assertEqual(read_file(os.path.join(src_dir, "util.h")), b"v1")
+            finally:
+                rcc.cache.close_caches()
+
+        self.assertEqual(provider.fetch_count, 1)
+        self.assertEqual(storage.version_fetches, 2)
+        self.assertEqual(storage.downloads, 2)
+
+    async def test_changed_file_is_downloaded_again_after_expiry(self) -> None:
+        provider = ExerciseFilesProvider()
+        storage = ExerciseFilesStorage()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cfg = make_cfg(exec_dir=tmpdir, src_dir="src")
+            rcc.cache.open_caches(cfg)
+            try:
+                _ = await self._copy(tmpdir, make_commit(1), provider, storage)
+                storage.versions["5/Makefile"] = "v2"
+                later = time.monotonic() + 61
+                with mock.patch.object(time, "monotonic", return_value=later):
+                    src_dir = await self._copy(
+                        tmpdir, make_commit(2), provider, storage
+                    )
+                self.assertEqual(read_file(os.path.join(src_dir, "Makefile")), b"v2")
+            finally:
+                rcc.cache.close_caches()
+
+        self.assertEqual(provider.fetch_count, 2)
+        # Only the changed file is downloaded again.
+        self.assertEqual(storage.downloads, 3)
+
+    async def test_without_exercise_cache_nothing_is_revalidated(self) -> None:
+        provider = ExerciseFilesProvider()
+        storage = ExerciseFilesStorage()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cfg = make_cfg(exec_dir=tmpdir, src_dir="src", exercise_cache_ttl=0)
+            rcc.cache.open_caches(cfg)
+            try:
+                _ = await self._copy(tmpdir, make_commit(1), provider, storage)
+                _ = await self._copy(tmpdir, make_commit(2), provider, storage)
+            finally:
+                rcc.cache.close_caches()
+
+        self.assertEqual(provider.fetch_count, 2)
+        self.assertEqual(storage.version_fetches, 0)
+        self.assertEqual(storage.downloads, 4)
+
+
+class TestFromConfig(unittest.TestCase):
+    def test_zero_size_disables_the_exercise_cases_cache(self) -> None:
+        cfg = rcc.config.Config({"exercise_cases_cache_size": 0})
+        self.assertIsNone(rcc.cache.exercise_cases_cache_from_config(cfg))
+        cases_cache = rcc.cache.exercise_cases_cache_from_config(rcc.config.Config({}))
+        assert cases_cache is not None
+        self.assertEqual(
+            cases_cache.max_entries, rcc.config.DEFAULT_EXERCISE_CASES_CACHE_SIZE
+        )
+
+    def test_zero_size_disables_the_cache(self) -> None:
+        cfg = rcc.config.Config({"exec_dir": "/tmp", "test_case_cache_size": 0})
+        self.assertIsNone(rcc.cache.from_config(cfg))
+
+    def test_cache_dir_defaults_to_exec_dir(self) -> None:
+        cfg = rcc.config.Config({"exec_dir": "/var/runs"})
+        file_cache = rcc.cache.from_config(cfg)
+        self.assertIsNotNone(file_cache)
+        assert file_cache is not None
+        self.assertEqual(
+            os.path.dirname(file_cache.directory), os.path.join("/var/runs", "cache")
+        )
+        self.assertEqual(file_cache.max_size, rcc.config.DEFAULT_TEST_CASE_CACHE_SIZE)
+
+
+if __name__ == "__main__":
+    _ = unittest.main()
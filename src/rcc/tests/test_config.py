@@ -3,7 +3,8 @@ Tests for configuration defaults, parallelism validation and helpers.
 
 No external services required: these tests exercise ``EnvConfig`` (with a
 scrubbed environment), the parallelism helpers (``parallelism_values``,
-``total_slots``, ``queue_maxsize``) and ``validate`` directly.
+``total_slots``, ``queue_maxsize``, ``queue_page_size``) and ``validate``
+directly.
 """
 
 import os
@@ -12,6 +13,7 @@ from typing import cast, override
 from unittest import mock
 
 import rcc.config
+import rcc.images
 from rcc.config import Config, ConfigError, EnvConfig
 
 
@@ -111,6 +113,46 @@ class TestEnvConfigParallelismDefaults(unittest.TestCase):
             _ = EnvConfig()
         self.assertIn("RUNCODES_COMPILER_CONCURRENCY", str(raised.exception))
 
+    def test_stale_claims_are_only_released_well_past_any_commit(self) -> None:
+        db = cast(dict[str, object], EnvConfig().db)
+        self.assertEqual(db["stale_claim_age"], rcc.config.DEFAULT_STALE_CLAIM_AGE)
+        # Above the longest a commit can wait for its image, and not the
+        # release-everything 0, but minutes rather than an hour.
+        self.assertGreater(rcc.config.DEFAULT_STALE_CLAIM_AGE, rcc.images.WAIT_TIMEOUT)
+        self.assertLessEqual(
+            rcc.config.DEFAULT_STALE_CLAIM_AGE, rcc.images.WAIT_TIMEOUT + 5 * 60
+        )
+
+    def test_container_pool_is_disabled_by_default(self) -> None:
+        self.assertEqual(EnvConfig().container_pool, {})
+
+    def test_container_pool_env_var_lists_sizes_by_language(self) -> None:
+        with mock.patch.dict(
+            os.environ,
+            {"RUNCODES_COMPILER_CONTAINER_POOL": "C=3, C++=1,"},
+            clear=True,
+        ):
+            cfg = EnvConfig()
+        self.assertEqual(cfg.container_pool, {"C": 3, "C++": 1})
+
+    def test_malformed_container_pool_env_var_raises_clear_error(self) -> None:
+        with (
+            mock.patch.dict(
+                os.environ, {"RUNCODES_COMPILER_CONTAINER_POOL": "C:3"}, clear=True
+            ),
+            self.assertRaises(ConfigError) as raised,
+        ):
+            _ = EnvConfig()
+        self.assertIn("RUNCODES_COMPILER_CONTAINER_POOL", str(raised.exception))
+
+    def test_images_env_var_selects_the_pre_pulled_languages(self) -> None:
+        self.assertNotIn("images", EnvConfig().get_dict())
+        with mock.patch.dict(
+            os.environ, {"RUNCODES_COMPILER_IMAGES": "C, Python"}, clear=True
+        ):
+            cfg = EnvConfig()
+        self.assertEqual(cfg.images, ["C", "Python"])
+
 
 class TestParallelismValidation(unittest.TestCase):
     def test_valid_config_passes(self) -> None:
@@ -157,6 +199,26 @@ class TestParallelismValidation(unittest.TestCase):
             rcc.config.validate(cfg)
         self.assertIn("num_workers", str(raised.exception))
 
+    def test_zero_queue_page_size_rejected(self) -> None:
+        # Every poller cycle would claim nothing and start over at once.
+        cfg = Config({"db": {"queue_page_size": 0}})
+        with self.assertRaises(ConfigError) as raised:
+            rcc.config.validate(cfg)
+        self.assertIn("queue_page_size", str(raised.exception))
+
+    def test_non_integer_queue_page_size_rejected(self) -> None:
+        cfg = Config({"db": {"queue_page_size": "all"}})
+        with self.assertRaises(ConfigError):
+            rcc.config.validate(cfg)
+
+    def test_env_queue_page_size_is_validated(self) -> None:
+        with mock.patch.dict(
+            os.environ, {"RUNCODES_DB_QUEUE_PAGE_SIZE": "0"}, clear=True
+        ):
+            cfg = EnvConfig()
+        with self.assertRaises(ConfigError):
+            rcc.config.validate(cfg)
+
 
 class TestQueueMaxsize(unittest.TestCase):
     def test_two_times_total_slots(self) -> None:
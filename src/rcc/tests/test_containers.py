@@ -0,0 +1,438 @@
+"""
+Tests for the worker's docker client and warm container pool
+(``rcc.containers``).
+
+No docker daemon required: ``docker.from_env`` is replaced by a fake client
+recording the containers it starts.
+"""
+
+import asyncio
+import builtins
+import fcntl
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from typing import ClassVar, cast, override
+from unittest import mock
+
+import docker
+
+import rcc.config
+import rcc.containers
+from rcc.containers import (
+    START_FILE,
+    WAIT_ENTRYPOINT,
+    WORK_DIR_LABEL,
+    ContainerPool,
+    WarmContainer,
+)
+from rcc.languages import KNOWN_LANGUAGES
+
+IMAGE = "compiler-images-c"
+IMAGE_ID = "sha256:c0ffee"
+
+
+class FakeContainer:
+    status: str
+    removed: bool
+    labels: dict[str, str]
+
+    def __init__(self, labels: dict[str, str] | None = None) -> None:
+        self.status = "running"
+        self.removed = False
+        self.labels = labels or {}
+
+    def reload(self) -> None:
+        pass
+
+    def remove(self, force: bool = False) -> None:
+        self.removed = force
+
+
+class FakeContainers:
+    started: builtins.list[tuple[FakeContainer, dict[str, object]]]
+    # Containers of earlier workers, listed along with the started ones.
+    leftovers: builtins.list[FakeContainer]
+    # Cleared to hold new containers back (e.g. the pool refills).
+    gate: threading.Event
+    error: Exception | None
+
+    def __init__(self) -> None:
+        self.started = []
+        self.leftovers = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.error = None
+
+    def list(
+        self, all: bool = False, filters: dict[str, str] | None = None
+    ) -> builtins.list[FakeContainer]:
+        assert all and filters is not None
+        containers = self.leftovers + [c for c, _ in self.started]
+        return [c for c in containers if filters["label"] in c.labels]
+
+    def run(self, image: str, **kwargs: object) -> FakeContainer:
+        _ = self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        container = FakeContainer(cast(dict[str, str], kwargs.get("labels")))
+        self.started.append((container, {"image": image, **kwargs}))
+        return container
+
+
+class FakeImage:
+    id: str = IMAGE_ID
+    attrs: ClassVar[dict[str, object]] = {
+        "Config": {"Entrypoint": ["/entrypoint.sh"], "Cmd": ["compile"]}
+    }
+
+
+class FakeImages:
+    def get(self, _image: str) -> FakeImage:
+        return FakeImage()
+
+
+class FakeClient:
+    containers: FakeContainers
+    images: FakeImages
+
+    def __init__(self) -> None:
+        self.containers = FakeContainers()
+        self.images = FakeImages()
+
+
+class TestContainerPool(unittest.IsolatedAsyncioTestCase):
+    _tmpdir: str
+    client: FakeClient
+
+    def __init__(self, methodName: str = "runTest") -> None:
+        super().__init__(methodName)
+        self._tmpdir = ""
+        self.client = FakeClient()
+
+    @override
+    async def asyncSetUp(self) -> None:
+        self._tmpdir = tempfile.mkdtemp()
+        self.client = FakeClient()
+        # Never leave a thread blocked behind the gate (it would hang the
+        # loop's shutdown).
+        self.addCleanup(self.client.containers.gate.set)
+        patcher = mock.patch.object(docker, "from_env", lambda: self.client)
+        _ = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override
+    async def asyncTearDown(self) -> None:
+        shutil.rmtree(self._tmpdir)
+
+    def make_pool(self, size: int = 2) -> ContainerPool:
+        pool = ContainerPool({IMAGE: size}, self._tmpdir, "/remote")
+        pool.open()
+        return pool
+
+    async def wait_idle(self, pool: ContainerPool, idle: int) -> None:
+        async with asyncio.timeout(5):
+            while pool.stats()["idle"] != idle:
+                await asyncio.sleep(0.01)
+
+    async def test_fills_the_pool_in_the_background(self) -> None:
+        pool = self.make_pool()
+        await self.wait_idle(pool, 2)
+
+        self.assertEqual(len(self.client.containers.started), 2)
+        _, kwargs = self.client.containers.started[0]
+        # Started from the pulled image, never from its tag (which may pull).
+        self.assertEqual(kwargs["image"], IMAGE_ID)
+        self.assertEqual(kwargs["entrypoint"], WAIT_ENTRYPOINT)
+        self.assertEqual(kwargs["command"], ["/entrypoint.sh", "compile"])
+        volumes = cast(dict[str, dict[str, str]], kwargs["volumes"])
+        ((remote_dir, bind),) = volumes.items()
+        self.assertEqual(bind["bind"], "/root")
+        self.assertTrue(
+            remote_dir.startswith(os.path.join("/remote", "warm", str(os.getpid())))
+        )
+        labels = cast(dict[str, str], kwargs["labels"])
+        work_dir = labels[WORK_DIR_LABEL]
+        self.assertEqual(os.path.dirname(work_dir), pool.directory)
+        self.assertEqual(os.path.basename(work_dir), os.path.basename(remote_dir))
+        await pool.close()
+
+    async def test_open_removes_what_dead_workers_left(self) -> None:
+        root = os.path.join(self._tmpdir, "warm")
+        # PIDs are bounded well below these values on Linux.
+        dead = os.path.join(root, "999999999")
+        live = os.path.join(root, "999999998")
+        own = os.path.join(root, str(os.getpid()))
+        work_dirs = {
+            "dead": os.path.join(dead, "a"),
+            "live": os.path.join(live, "b"),
+            "own": os.path.join(own, "c"),
+        }
+        for work_dir in work_dirs.values():
+            os.makedirs(work_dir)
+        # A live worker (maybe in another PID namespace) holds its lock.
+        fd = os.open(f"{live}.lock", os.O_RDWR | os.O_CREAT)
+        self.addCleanup(os.close, fd)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        work_dirs["other host"] = "/elsewhere/warm/1/d"
+        leftovers = {
+            name: FakeContainer({WORK_DIR_LABEL: work_dir})
+            for name, work_dir in work_dirs.items()
+        }
+        self.client.containers.leftovers = list(leftovers.values())
+
+        pool = self.make_pool()
+        await self.wait_idle(pool, 2)
+        await pool.close()
+
+        self.assertTrue(leftovers["dead"].removed)
+        self.assertTrue(leftovers["own"].removed)
+        self.assertFalse(leftovers["live"].removed)
+        self.assertFalse(leftovers["other host"].removed)
+        self.assertEqual(sorted(os.listdir(root)), ["999999998", "999999998.lock"])
+
+    async def test_acquire_takes_an_idle_container_and_refills(self) -> None:
+        pool = self.make_pool()
+        await self.wait_idle(pool, 2)
+
+        warm = await pool.acquire(IMAGE)
+
+        assert warm is not None
+        self.assertEqual(pool.stats()["hits"], 1)
+        start_file = os.stat(os.path.join(warm.work_dir, START_FILE))
+        self.assertTrue(stat.S_ISFIFO(start_file.st_mode))
+        warm.release()
+        await self.wait_idle(pool, 2)
+        self.assertEqual(len(self.client.containers.started), 3)
+        self.assertNotIn(
+            cast(object, warm.container),
+            [pooled for pooled, _ in self.client.containers.started[2:]],
+        )
+        await pool.close()
+
+    async def test_acquire_misses_without_an_idle_container(self) -> None:
+        pool = self.make_pool()
+        self.assertIsNone(await pool.acquire("compiler-images-zig"))
+        await self.wait_idle(pool, 2)
+        self.client.containers.gate.clear()
+        _ = await pool.acquire(IMAGE)
+        _ = await pool.acquire(IMAGE)
+
+        self.assertIsNone(await pool.acquire(IMAGE))
+        self.assertEqual(pool.stats()["misses"], 1)
+        self.client.containers.gate.set()
+        await pool.close()
+
+    async def test_stopped_containers_are_discarded(self) -> None:
+        pool = self.make_pool(size=1)
+        await self.wait_idle(pool, 1)
+        stopped, _ = self.client.containers.started[0]
+        stopped.status = "exited"
+        self.client.containers.gate.clear()
+
+        warm = await pool.acquire(IMAGE)
+
+        self.assertIsNone(warm)
+        self.assertTrue(stopped.removed)
+        self.client.containers.gate.set()
+        await pool.close()
+
+    async def test_close_removes_the_idle_containers(self) -> None:
+        pool = self.make_pool()
+        await self.wait_idle(pool, 2)
+
+        await pool.close()
+
+        self.assertTrue(all(c.removed for c, _ in self.client.containers.started))
+        self.assertFalse(os.path.exists(pool.directory))
+        self.assertIsNone(await pool.acquire(IMAGE))
+        self.assertEqual(len(self.client.containers.started), 2)
+
+    async def test_failed_starts_are_counted(self) -> None:
+        self.client.containers.error = RuntimeError("no daemon")
+        pool = self.make_pool()
+        async with asyncio.timeout(5):
+            while pool.stats()["failures"] < 1:
+                await asyncio.sleep(0.01)
+
+        self.assertEqual(pool.stats()["idle"], 0)
+        self.assertEqual(os.listdir(pool.directory), [])
+        await pool.close()
+
+    async def test_pool_recovers_after_a_failed_start(self) -> None:
+        self.client.containers.error = RuntimeError("image not pulled yet")
+        with mock.patch.object(rcc.containers, "REFILL_BACKOFF", 0.1):
+            pool = self.make_pool(size=1)
+            async with asyncio.timeout(5):
+                while pool.stats()["failures"] < 1:
+                    await asyncio.sleep(0.01)
+            self.client.containers.error = None
+
+            # Within the backoff a miss starts nothing.
+            self.assertIsNone(await pool.acquire(IMAGE))
+            await asyncio.sleep(0.03)
+            self.assertEqual(self.client.containers.started, [])
+            await asyncio.sleep(0.1)
+            self.assertIsNone(await pool.acquire(IMAGE))
+            await self.wait_idle(pool, 1)
+
+        self.assertIsNotNone(await pool.acquire(IMAGE))
+        self.assertEqual(pool.stats()["failures"], 1)
+        await pool.close()
+
+
+class FakeDockerClient:
+    closed: bool
+
+    def __init__(self) -> None:
+        self.closed = False
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class TestDockerClient(unittest.TestCase):
+    created: list[dict[str, object]]
+
+    def __init__(self, methodName: str = "runTest") -> None:
+        super().__init__(methodName)
+        self.created = []
+
+    @override
+    def setUp(self) -> None:
+        self.created = []
+
+        def from_env(**kwargs: object) -> FakeDockerClient:
+            self.created.append(kwargs)
+            return FakeDockerClient()
+
+        patcher = mock.patch.object(docker, "from_env", from_env)
+        _ = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(rcc.containers.close_docker_client)
+
+    def test_worker_client_is_created_once_and_shared(self) -> None:
+        cfg = rcc.config.Config(
+            {"concurrency_per_worker": 4, "container_pool": {"C": 2, "Java": 1}}
+        )
+        with mock.patch.object(
+            rcc.containers, "attachable_from_env", return_value=True
+        ):
+            rcc.containers.open_docker_client(cfg)
+        self.assertEqual(self.created, [])
+
+        def get(_: int) -> object:
+            return rcc.containers.docker_client()
+
+        with ThreadPoolExecutor(8) as executor:
+            clients = set(map(id, executor.map(get, range(32))))
+
+        self.assertEqual(len(clients), 1)
+        # Pooled connections for every commit and warm container at once;
+        # log streams read sockets of their own once attached.
+        self.assertEqual(self.created, [{"max_pool_size": 4 + 3}])
+
+    def test_log_reader_threads_get_a_connection_each(self) -> None:
+        cfg = rcc.config.Config({"concurrency_per_worker": 4, "container_pool": {}})
+        # E.g. a docker API behind TLS: logs are followed with docker-py.
+        with mock.patch.object(
+            rcc.containers, "attachable_from_env", return_value=False
+        ):
+            rcc.containers.open_docker_client(cfg)
+        _ = rcc.containers.docker_client()
+
+        self.assertEqual(self.created, [{"max_pool_size": 4 * 2}])
+
+    def test_close_closes_the_client(self) -> None:
+        rcc.containers.open_docker_client(rcc.config.Config({"container_pool": {}}))
+        client = cast(FakeDockerClient, cast(object, rcc.containers.docker_client()))
+
+        rcc.containers.close_docker_client()
+
+        self.assertTrue(client.closed)
+        self.assertIsNone(rcc.containers._client)  # pyright: ignore[reportPrivateUsage]
+
+    def test_new_client_per_call_outside_a_worker(self) -> None:
+        first = rcc.containers.docker_client()
+        second = rcc.containers.docker_client()
+
+        self.assertIsNot(first, second)
+        self.assertEqual(self.created, [{}, {}])
+
+
+def make_warm(work_dir: str) -> WarmContainer:
+    """A warm container whose work directory is set up like the pool does."""
+    os.mkdir(work_dir)
+    start_file = os.path.join(work_dir, START_FILE)
+    os.mkfifo(start_file, 0o600)
+    return WarmContainer(IMAGE, mock.Mock(), work_dir, os.open(start_file, os.O_RDWR))
+
+
+class TestWarmContainer(unittest.TestCase):
+    def test_start_and_finish_move_the_commit_files(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            base_dir = os.path.join(tmpdir, "commit_1")
+            work_dir = os.path.join(tmpdir, "warm")
+            os.makedirs(os.path.join(base_dir, "src"))
+            with open(os.path.join(base_dir, "src", "main.c"), "w") as f:
+                _ = f.write("int main() {}")
+            warm = make_warm(work_dir)
+
+            warm.start(base_dir)
+
+            self.assertEqual(os.listdir(base_dir), [])
+            self.assertEqual(sorted(os.listdir(work_dir)), [START_FILE, "src"])
+
+            # The container only reads the start line after start() wrote it:
+            # the line waits in the FIFO. It then removes the FIFO and writes
+            # its outputs.
+            with open(os.path.join(work_dir, START_FILE), "rb") as fifo:
+                self.assertEqual(fifo.readline(), b"\n")
+            os.unlink(os.path.join(work_dir, START_FILE))
+            os.mkdir(os.path.join(work_dir, "outputfiles"))
+            warm.finish(base_dir)
+
+            self.assertEqual(sorted(os.listdir(base_dir)), ["outputfiles", "src"])
+            self.assertTrue(os.path.exists(os.path.join(base_dir, "src", "main.c")))
+            self.assertFalse(os.path.exists(work_dir))
+
+    def test_released_container_reads_no_start_line(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            warm = make_warm(os.path.join(tmpdir, "warm"))
+            # The container is waiting in its read.
+            with open(os.path.join(warm.work_dir, START_FILE), "rb") as fifo:
+                warm.release()
+
+                # End of file: the entrypoint exits instead of running.
+                self.assertEqual(fifo.readline(), b"")
+            warm.release()
+
+            base_dir = os.path.join(tmpdir, "commit_1")
+            os.mkdir(base_dir)
+            with self.assertRaises(RuntimeError):
+                warm.start(base_dir)
+
+
+class TestPoolSizes(unittest.TestCase):
+    def test_languages_map_to_their_images(self) -> None:
+        cfg = rcc.config.Config({"container_pool": {"C": 2, "Python": 0}})
+        images = {language.name: language.image for language in KNOWN_LANGUAGES}
+
+        self.assertEqual(
+            rcc.containers.pool_sizes(cfg), {images["C"]: 2, images["Python"]: 0}
+        )
+
+    def test_unknown_language_raises(self) -> None:
+        cfg = rcc.config.Config({"container_pool": {"Cobol": 1}})
+        with self.assertRaises(rcc.config.ConfigError):
+            _ = rcc.containers.pool_sizes(cfg)
+
+    def test_empty_pool_is_disabled(self) -> None:
+        cfg = rcc.config.Config(
+            {"container_pool": {"C": 0}, "exec_dir": "/tmp", "exec_dir_remote": "/tmp"}
+        )
+        self.assertIsNone(rcc.containers.from_config(cfg))
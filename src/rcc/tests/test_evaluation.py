@@ -0,0 +1,210 @@
+"""
+Tests for the per-test-case result evaluation of a commit (no docker).
+"""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from collections.abc import Iterator
+from unittest import mock
+
+import rcc.config
+import rcc.engine
+from rcc.model import Commit, TestCase, TestCaseResult
+from rcc.tests.helpers import make_cfg, make_commit, make_test_case, write_file
+
+
+class TestProcessTestResultsBatch(unittest.TestCase):
+    def test_evaluates_concurrently_and_keeps_the_order(self) -> None:
+        cfg = make_cfg(evaluation_threads=4)
+        lock = threading.Lock()
+        active = 0
+        max_active = 0
+
+        def fake_process_test_results(
+            commit: Commit, test_case: TestCase, _base_dir: str, _expected_dir: str
+        ) -> TestCaseResult:
+            nonlocal active, max_active
+            with lock:
+                active += 1
+                max_active = max(max_active, active)
+            # Later test cases finish first.
+            time.sleep(0.01 * (10 - test_case.id))
+            with lock:
+                active -= 1
+            return TestCaseResult(
+                commit.id, test_case.id, "0.1", TestCaseResult.STATUS_CORRECT, ""
+            )
+
+        test_cases = [make_test_case(i) for i in range(8)]
+        with mock.patch.object(
+            rcc.engine, "process_test_results", fake_process_test_results
+        ):
+            results = rcc.engine.process_test_results_batch(
+                make_commit(), test_cases, "base", "expected"
+            )
+
+        self.assertEqual([r.test_case_id for r in results], list(range(8)))
+        self.assertEqual(max_active, cfg.evaluation_threads)
+
+    def test_first_failure_is_raised(self) -> None:
+        _ = make_cfg(evaluation_threads=4)
+
+        def fake_process_test_results(
+            commit: Commit, test_case: TestCase, _base_dir: str, _expected_dir: str
+        ) -> TestCaseResult:
+            if test_case.id == 3:
+                raise FileNotFoundError("3.monitor_out")
+            return TestCaseResult(
+                commit.id, test_case.id, "0.1", TestCaseResult.STATUS_CORRECT, ""
+            )
+
+        with (
+            mock.patch.object(
+                rcc.engine, "process_test_results", fake_process_test_results
+            ),
+            self.assertRaises(FileNotFoundError),
+        ):
+            _ = rcc.engine.process_test_results_batch(
+                make_commit(), [make_test_case(i) for i in range(5)], "b", "e"
+            )
+
+
+class TestCompareOutputs(unittest.TestCase):
+    def test_large_outputs_are_compared_in_the_pool(self) -> None:
+        cfg = make_cfg(evaluation_processes=1, evaluation_process_min_size=1024)
+        rcc.engine.open_compare_pool(cfg)
+        self.addCleanup(rcc.engine.close_compare_pool)
+        pool = rcc.engine._compare_pool  # pyright: ignore[reportPrivateUsage]
+        assert pool is not None
+
+        with (
+            tempfile.TemporaryDirectory() as tmpdir,
+            mock.patch.object(pool, "submit", wraps=pool.submit) as submit,
+        ):
+            small = os.path.join(tmpdir, "small")
+            large = os.path.join(tmpdir, "large")
+            write_file(small, b"42\n")
+            write_file(large, b"x\n" * 1024)
+
+            self.assertEqual(
+                rcc.engine.compare_outputs(small, small, TestCase.IO_TYPE_TEXT, None),
+                TestCaseResult.STATUS_CORRECT,
+            )
+            self.assertEqual(submit.call_count, 0)
+            self.assertEqual(
+                rcc.engine.compare_outputs(large, small, TestCase.IO_TYPE_TEXT, None),
+                TestCaseResult.STATUS_INCORRECT,
+            )
+            self.assertEqual(submit.call_count, 1)
+
+    def test_without_processes_no_pool_is_created(self) -> None:
+        rcc.engine.open_compare_pool(make_cfg(evaluation_processes=0))
+        self.addCleanup(rcc.engine.close_compare_pool)
+        self.assertIsNone(rcc.engine._compare_pool)  # pyright: ignore[reportPrivateUsage]
+
+
+def correct(commit: Commit, test_case: TestCase) -> TestCaseResult:
+    return TestCaseResult(
+        commit.id, test_case.id, "0.1", TestCaseResult.STATUS_CORRECT, ""
+    )
+
+
+class TestCaseEvaluator(unittest.IsolatedAsyncioTestCase):
+    evaluated: list[tuple[int, str]]
+
+    def __init__(self, methodName: str = "runTest") -> None:
+        super().__init__(methodName)
+        self.evaluated = []
+
+    def fake_process_test_results(
+        self, commit: Commit, test_case: TestCase, base_dir: str, _expected_dir: str
+    ) -> TestCaseResult:
+        self.evaluated.append((test_case.id, base_dir))
+        return correct(commit, test_case)
+
+    def make_evaluator(
+        self, expected: asyncio.Task[None] | None = None
+    ) -> rcc.engine.CaseEvaluator:
+        _ = make_cfg(evaluation_threads=4)
+        patcher = mock.patch.object(
+            rcc.engine, "process_test_results", self.fake_process_test_results
+        )
+        _ = patcher.start()
+        self.addCleanup(patcher.stop)
+        if expected is None:
+            expected = asyncio.create_task(asyncio.sleep(0))
+        test_cases = [make_test_case(i) for i in range(4)]
+        return rcc.engine.CaseEvaluator(make_commit(), test_cases, "e", expected)
+
+    async def test_cases_done_are_evaluated_right_away(self) -> None:
+        evaluator = self.make_evaluator()
+
+        evaluator.case_done(2, "warm")
+        evaluator.case_done(0, "warm")
+        await evaluator.wait()
+
+        self.assertEqual(sorted(self.evaluated), [(0, "warm"), (2, "warm")])
+        results = await evaluator.results("base")
+        self.assertEqual([r.test_case_id for r in results], [0, 1, 2, 3])
+        # Cases without a marker are evaluated after the run, where the
+        # outputs end up.
+        self.assertEqual(sorted(self.evaluated[2:]), [(1, "base"), (3, "base")])
+
+    async def test_evaluation_waits_for_the_expected_outputs(self) -> None:
+        downloaded = asyncio.Event()
+
+        async def download() -> None:
+            _ = await downloaded.wait()
+
+        evaluator = self.make_evaluator(asyncio.create_task(download()))
+
+        evaluator.case_done(1, "warm")
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.evaluated, [])
+
+        downloaded.set()
+        await evaluator.wait()
+        self.assertEqual(self.evaluated, [(1, "warm")])
+
+    async def test_unknown_and_repeated_cases_are_ignored(self) -> None:
+        evaluator = self.make_evaluator()
+
+        with self.assertLogs(rcc.config.DEFAULT_LOGGER, "WARNING"):
+            evaluator.case_done(42, "warm")
+        evaluator.case_done(0, "warm")
+        with self.assertLogs(rcc.config.DEFAULT_LOGGER, "WARNING"):
+            evaluator.case_done(0, "warm")
+        await evaluator.wait()
+
+        self.assertEqual(self.evaluated, [(0, "warm")])
+
+
+class TestExpectRunDone(unittest.IsolatedAsyncioTestCase):
+    async def expect(self, lines: list[str], timeout: float = 1.0) -> list[int]:
+        def generator() -> Iterator[bytes]:
+            for line in lines:
+                yield f"{line}\n".encode()
+            # Keep the stream open, like a running container.
+            time.sleep(timeout + 0.5)
+
+        reader = rcc.engine.ContainerLogReader(generator(), asyncio.get_running_loop())
+        reader.start()
+        done: list[int] = []
+        await rcc.engine.expect_run_done(reader, timeout, done.append)
+        return done
+
+    async def test_cases_done_are_reported_until_run_done(self) -> None:
+        done = await self.expect(["case.done 3", "case.done 1", "run.done"])
+        self.assertEqual(done, [3, 1])
+
+    async def test_other_lines_raise(self) -> None:
+        with self.assertRaises(RuntimeError):
+            _ = await self.expect(["case.done x", "run.done"])
+
+    async def test_timeout_bounds_the_whole_wait(self) -> None:
+        with self.assertRaises(TimeoutError):
+            _ = await self.expect(["case.done 1"], timeout=0.05)
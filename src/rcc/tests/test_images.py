@@ -0,0 +1,211 @@
+"""
+Tests for the pre-pulling and pinning of the language images (``rcc.images``).
+
+No docker daemon required: ``docker.from_env`` is replaced by a fake client
+holding the "local" images.
+"""
+
+import asyncio
+import contextlib
+import threading
+import unittest
+from typing import override
+from unittest import mock
+
+import docker
+import docker.errors
+
+import rcc.config
+import rcc.images
+from rcc.images import ImagePins, ImagePuller
+from rcc.languages import KNOWN_LANGUAGES
+
+
+class FakeImage:
+    id: str
+    attrs: dict[str, object]
+
+    def __init__(self, name: str) -> None:
+        self.id = f"sha256:{name}"
+        self.attrs = {"RepoDigests": [f"{name}@sha256:{name}"]}
+
+
+class FakeImages:
+    local: dict[str, FakeImage]
+    pulled: list[str]
+    inspected: list[str]
+    failing: set[str]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.local = {}
+        self.pulled = []
+        self.inspected = []
+        self.failing = set()
+        self._lock = threading.Lock()
+
+    def pull(self, name: str) -> FakeImage:
+        with self._lock:
+            self.pulled.append(name)
+        if name in self.failing:
+            raise docker.errors.APIError("pull access denied")
+        self.local[name] = FakeImage(name)
+        return self.local[name]
+
+    def get(self, name: str) -> FakeImage:
+        with self._lock:
+            self.inspected.append(name)
+        if name not in self.local:
+            raise docker.errors.ImageNotFound(name)
+        return self.local[name]
+
+
+class FakeClient:
+    images: FakeImages
+    closed: bool
+
+    def __init__(self) -> None:
+        self.images = FakeImages()
+        self.closed = False
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class TestImages(unittest.IsolatedAsyncioTestCase):
+    client: FakeClient
+    clients: int
+
+    def __init__(self, methodName: str = "runTest") -> None:
+        super().__init__(methodName)
+        self.client = FakeClient()
+        self.clients = 0
+
+    @override
+    async def asyncSetUp(self) -> None:
+        self.client = FakeClient()
+        self.clients = 0
+
+        def from_env() -> FakeClient:
+            self.clients += 1
+            return self.client
+
+        patcher = mock.patch.object(docker, "from_env", from_env)
+        _ = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_puller_retries_failed_pulls_before_the_refresh(self) -> None:
+        self.client.images.failing.add("b")
+        with (
+            mock.patch.object(rcc.images, "PULL_RETRY_BACKOFF", 0.01),
+            self.assertLogs(rcc.config.DEFAULT_LOGGER, "WARNING"),
+        ):
+            task = asyncio.create_task(ImagePuller(["a", "b", "c"], 3600).run())
+            async with asyncio.timeout(5):
+                while self.client.images.pulled.count("b") < 3:
+                    await asyncio.sleep(0.01)
+            self.client.images.failing.clear()
+            async with asyncio.timeout(5):
+                while "b" not in self.client.images.local:
+                    await asyncio.sleep(0.01)
+            _ = task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+        # The other images wait for the refresh.
+        self.assertEqual(self.client.images.pulled.count("a"), 1)
+        self.assertEqual(self.client.images.pulled.count("c"), 1)
+
+    async def test_puller_pulls_once_without_refresh(self) -> None:
+        await ImagePuller(["a", "b", "c"], 0).run()
+
+        self.assertEqual(sorted(self.client.images.pulled), ["a", "b", "c"])
+        self.assertEqual(sorted(self.client.images.local), ["a", "b", "c"])
+        # One client for all the pulls, closed once they are done.
+        self.assertEqual(self.clients, 1)
+        self.assertTrue(self.client.closed)
+
+    async def test_puller_refreshes_the_images(self) -> None:
+        with mock.patch.object(rcc.images, "PULL_CONCURRENCY", 1):
+            task = asyncio.create_task(ImagePuller(["a"], 0.01).run())
+            async with asyncio.timeout(5):
+                while len(self.client.images.pulled) < 3:
+                    await asyncio.sleep(0.01)
+            _ = task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+        self.assertEqual(self.clients, 1)
+        self.assertTrue(self.client.closed)
+
+    async def test_puller_retries_until_docker_is_reachable(self) -> None:
+        client = self.client
+        attempts = 0
+
+        def from_env() -> FakeClient:
+            nonlocal attempts
+            attempts += 1
+            if attempts < 3:
+                raise docker.errors.DockerException("connection refused")
+            return client
+
+        with (
+            mock.patch.object(docker, "from_env", from_env),
+            mock.patch.object(rcc.images, "PULL_RETRY_BACKOFF", 0.01),
+            self.assertLogs(rcc.config.DEFAULT_LOGGER, "WARNING"),
+        ):
+            await ImagePuller(["a"], 0).run()
+
+        self.assertEqual(attempts, 3)
+        self.assertEqual(client.images.pulled, ["a"])
+        self.assertTrue(client.closed)
+
+    async def test_pins_resolve_local_images_to_their_id(self) -> None:
+        pins = ImagePins(["a"])
+        self.assertIsNone(await pins.resolve("a"))
+        _ = self.client.images.pull("a")
+
+        self.assertEqual(await pins.resolve("a"), "sha256:a")
+        self.assertEqual(await pins.resolve("a"), "sha256:a")
+        # The id is cached: the tag is inspected once more only.
+        self.assertEqual(self.client.images.inspected, ["a", "a"])
+
+    async def test_wait_returns_once_the_image_is_pulled(self) -> None:
+        pins = ImagePins(["a"])
+        with mock.patch.object(rcc.images, "WAIT_INTERVAL", 0.01):
+            waiter = asyncio.create_task(pins.wait("a"))
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiter.done())
+            _ = self.client.images.pull("a")
+
+            self.assertEqual(await waiter, "sha256:a")
+
+    async def test_wait_gives_up_after_the_timeout(self) -> None:
+        pins = ImagePins(["a"])
+        with mock.patch.object(rcc.images, "WAIT_INTERVAL", 0.01):
+            self.assertIsNone(await pins.wait("a", timeout=0.05))
+
+
+class TestImagesFromConfig(unittest.TestCase):
+    def test_defaults_to_every_known_language(self) -> None:
+        images = rcc.images.images_from_config(rcc.config.Config({}))
+        self.assertEqual(images, [language.image for language in KNOWN_LANGUAGES])
+
+    def test_configured_subset(self) -> None:
+        cfg = rcc.config.Config({"images": ["Python", "C"]})
+        images = {language.name: language.image for language in KNOWN_LANGUAGES}
+
+        self.assertEqual(
+            rcc.images.images_from_config(cfg), [images["Python"], images["C"]]
+        )
+
+    def test_unknown_language_raises(self) -> None:
+        cfg = rcc.config.Config({"images": ["Cobol"]})
+        with self.assertRaises(rcc.config.ConfigError):
+            _ = rcc.images.images_from_config(cfg)
+
+    def test_no_images_disables_pulling_and_pins(self) -> None:
+        cfg = rcc.config.Config({"images": []})
+        self.assertIsNone(rcc.images.puller_from_config(cfg))
+        rcc.images.open_image_pins(cfg)
+        self.assertIsNone(rcc.images.get_image_pins())
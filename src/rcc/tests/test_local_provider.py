@@ -0,0 +1,124 @@
+"""
+Tests for the local filesystem storage provider.
+"""
+
+import io
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from typing import override
+
+import rcc.config
+import rcc.provider.storage
+from rcc.provider.storage import Local
+from rcc.tests.helpers import make_commit, make_test_case, read_file, write_file
+
+
+class TestLocal(unittest.TestCase):
+    _tmpdir: str
+
+    def __init__(self, methodName: str = "runTest") -> None:
+        super().__init__(methodName)
+        self._tmpdir = ""
+
+    @override
+    def setUp(self) -> None:
+        self._tmpdir = tempfile.mkdtemp()
+        for name in ("commits", "outputfiles", "files", "cases", "work"):
+            os.mkdir(self.path(name))
+
+    @override
+    def tearDown(self) -> None:
+        shutil.rmtree(self._tmpdir)
+
+    def path(self, *names: str) -> str:
+        return os.path.join(self._tmpdir, *names)
+
+    def make_provider(self) -> Local:
+        cfg = rcc.config.Config(
+            {
+                "provider": {"data": "postgres", "storage": "local"},
+                "local": {
+                    "commits_dir": self.path("commits"),
+                    "outputfiles_dir": self.path("outputfiles"),
+                    "files_dir": self.path("files"),
+                    "cases_dir": self.path("cases"),
+                    "compilation_files_dir": "compilationfiles",
+                },
+            }
+        )
+        provider = rcc.provider.storage.from_config(cfg)
+        assert isinstance(provider, Local)
+        return provider
+
+    def test_fetches_every_kind_of_file(self) -> None:
+        write_file(self.path("commits", "commits/42/main.c"), b"int main() {}")
+        write_file(self.path("files", "compilationfiles/5/Makefile"), b"all:")
+        write_file(self.path("cases", "7/in"), b"1 2")
+        write_file(self.path("cases", "7/out"), b"3")
+        write_file(self.path("cases", "7/files/data.txt"), b"data")
+        provider = self.make_provider()
+        test_case = make_test_case(7, ["data.txt"])
+
+        provider.fetch_commit_file(make_commit(), self.path("work", "main.c"))
+        provider.fetch_exercise_file("5/Makefile", self.path("work", "Makefile"))
+        provider.fetch_test_case_input_file(test_case, self.path("work", "7.in"))
+        provider.fetch_test_case_output_file(test_case, self.path("work", "7.out"))
+        provider.fetch_test_case_files(test_case, self.path("work"))
+
+        self.assertEqual(read_file(self.path("work", "main.c")), b"int main() {}")
+        self.assertEqual(read_file(self.path("work", "Makefile")), b"all:")
+        self.assertEqual(read_file(self.path("work", "7.in")), b"1 2")
+        self.assertEqual(read_file(self.path("work", "7.out")), b"3")
+        self.assertEqual(read_file(self.path("work", "data.txt")), b"data")
+
+    def test_fetched_files_are_copies(self) -> None:
+        write_file(self.path("cases", "7/in"), b"1 2")
+        provider = self.make_provider()
+
+        provider.fetch_test_case_input_file(
+            make_test_case(7), self.path("work", "7.in")
+        )
+        write_file(self.path("work", "7.in"), b"changed")
+
+        self.assertEqual(read_file(self.path("cases", "7/in")), b"1 2")
+
+    def test_missing_file_raises(self) -> None:
+        provider = self.make_provider()
+        with self.assertRaises(FileNotFoundError):
+            provider.fetch_test_case_input_file(
+                make_test_case(7), self.path("work", "7.in")
+            )
+
+    def test_exercise_file_version_changes_when_rewritten(self) -> None:
+        source = self.path("files", "compilationfiles/5/Makefile")
+        write_file(source, b"all:")
+        provider = self.make_provider()
+
+        before = provider.fetch_exercise_file_version("5/Makefile")
+        write_file(source, b"all: main")
+        st = os.stat(source)
+        os.utime(source, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+
+        self.assertNotEqual(provider.fetch_exercise_file_version("5/Makefile"), before)
+
+    def test_store_commit_output_replaces_atomically(self) -> None:
+        write_file(self.path("outputfiles", "42.zip"), b"old")
+        provider = self.make_provider()
+
+        provider.store_commit_output(make_commit(), io.BytesIO(b"PK new"))
+
+        self.assertEqual(os.listdir(self.path("outputfiles")), ["42.zip"])
+        stored = self.path("outputfiles", "42.zip")
+        self.assertEqual(read_file(stored), b"PK new")
+        self.assertEqual(stat.S_IMODE(os.stat(stored).st_mode), 0o644)
+
+    def test_failed_store_leaves_no_temporary_file(self) -> None:
+        provider = self.make_provider()
+        output = io.BytesIO(b"PK")
+        output.close()
+        with self.assertRaises(ValueError):
+            provider.store_commit_output(make_commit(), output)
+        self.assertEqual(os.listdir(self.path("outputfiles")), [])
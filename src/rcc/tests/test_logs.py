@@ -0,0 +1,262 @@
+"""
+Tests for the container log streams followed on the event loop (``rcc.logs``).
+
+No docker daemon required: a fake daemon on a unix socket answers the attach
+requests of a docker-py client.
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import cast, override
+from unittest import mock
+
+import docker
+import docker.errors
+
+import rcc.engine
+import rcc.logs
+from rcc.config import DEFAULT_LOGGER
+from rcc.logs import END, LogStream, LogStreams
+
+CONTAINER_ID = "c0ffee"
+API_VERSION = "1.45"
+
+# Writes the log of the started container on the connection's writer.
+Handler = Callable[[asyncio.StreamWriter], Awaitable[None]]
+
+
+def frame(stream: int, payload: bytes) -> bytes:
+    return bytes([stream, 0, 0, 0]) + len(payload).to_bytes(4, "big") + payload
+
+
+UPGRADED = (
+    b"HTTP/1.1 101 UPGRADED\r\n"
+    b"Content-Type: application/vnd.docker.multiplexed-stream\r\n"
+    b"Connection: Upgrade\r\n"
+    b"Upgrade: tcp\r\n"
+    b"\r\n"
+)
+
+
+class TestLogStreams(unittest.IsolatedAsyncioTestCase):
+    _tmpdir: str
+    api: docker.APIClient | None
+    streams: LogStreams
+    requests: list[str]
+    started: asyncio.Event
+    disconnected: asyncio.Event
+    head: bytes
+    handler: Handler | None
+
+    def __init__(self, methodName: str = "runTest") -> None:
+        super().__init__(methodName)
+        self._tmpdir = ""
+        self.api = None
+        self.streams = LogStreams()
+        self.requests = []
+        self.started = asyncio.Event()
+        self.disconnected = asyncio.Event()
+        self.head = UPGRADED
+        self.handler = None
+
+    @override
+    async def asyncSetUp(self) -> None:
+        self._tmpdir = tempfile.mkdtemp()
+        socket_path = os.path.join(self._tmpdir, "docker.sock")
+        self.streams = LogStreams()
+        self.requests = []
+        self.started = asyncio.Event()
+        self.disconnected = asyncio.Event()
+        self.head = UPGRADED
+        server = await asyncio.start_unix_server(self.serve, socket_path)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        self.api = docker.APIClient(
+            base_url=f"unix://{socket_path}", version=API_VERSION
+        )
+        self.addCleanup(self.api.close)
+
+    @override
+    async def asyncTearDown(self) -> None:
+        await self.streams.close()
+        shutil.rmtree(self._tmpdir)
+
+    async def serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        request_line = (await reader.readline()).decode().strip()
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        self.requests.append(request_line)
+        writer.write(self.head)
+        await writer.drain()
+        if self.head == UPGRADED:
+            # The container only writes once it started, after the attach.
+            _ = await self.started.wait()
+            assert self.handler is not None
+            await self.handler(writer)
+        # Hold the connection until the client closes it.
+        _ = await reader.read()
+        self.disconnected.set()
+        writer.close()
+
+    async def follow(
+        self, container_id: str = CONTAINER_ID, tty: bool = False
+    ) -> LogStream:
+        """Attach to a container, then start it."""
+        assert self.api is not None
+        stream = await self.streams.follow(self.api, container_id, tty)
+        self.started.set()
+        return stream
+
+    async def collect(self, stream: LogStream) -> list[object]:
+        lines: list[object] = []
+        async with asyncio.timeout(5):
+            while (line := await stream.get()) is not END:
+                lines.append(line)
+        return lines
+
+    async def test_demultiplexes_lines(self) -> None:
+        async def handler(writer: asyncio.StreamWriter) -> None:
+            body = (
+                frame(1, b"compilation.start\ncompi")
+                + frame(2, b"warning: unused\n")
+                + frame(1, b"lation.done\n")
+                + frame(1, b"run.start\r\nrun.done")
+            )
+            # Frames split across writes.
+            writer.write(body[:5])
+            await writer.drain()
+            writer.write(body[5:30])
+            await writer.drain()
+            writer.write(body[30:])
+            await writer.drain()
+            writer.write_eof()
+
+        self.handler = handler
+        stream = await self.follow()
+
+        await rcc.engine.expect_message(stream, "compilation.start", 5)
+        self.assertEqual(
+            await self.collect(stream),
+            ["warning: unused", "compilation.done", "run.start", "run.done"],
+        )
+        # Only the output written from now on: no replay of the log.
+        path = f"/v{API_VERSION}/containers/{CONTAINER_ID}/attach"
+        self.assertEqual(
+            self.requests, [f"POST {path}?stdout=1&stderr=1&stream=1 HTTP/1.1"]
+        )
+        # The connection is closed once the stream ended.
+        async with asyncio.timeout(5):
+            _ = await self.disconnected.wait()
+
+    async def test_tty_logs_are_not_multiplexed(self) -> None:
+        async def handler(writer: asyncio.StreamWriter) -> None:
+            writer.write(b"compilation.start\ncompilation.done\n")
+            await writer.drain()
+            writer.close()
+
+        self.handler = handler
+        stream = await self.follow(tty=True)
+
+        self.assertEqual(
+            await self.collect(stream), ["compilation.start", "compilation.done"]
+        )
+
+    async def test_long_lines_are_split(self) -> None:
+        async def handler(writer: asyncio.StreamWriter) -> None:
+            line = b"x" * (rcc.logs.MAX_LINE_SIZE + 10)
+            writer.write(frame(1, line) + frame(1, line + b"\n"))
+            await writer.drain()
+            writer.close()
+
+        self.handler = handler
+        stream = await self.follow()
+
+        sizes = [len(cast(str, line)) for line in await self.collect(stream)]
+        self.assertEqual(sizes, [rcc.logs.MAX_LINE_SIZE] * 2 + [20])
+
+    async def test_failed_attach_raises(self) -> None:
+        message = b'{"message": "No such container"}'
+        self.head = (
+            b"HTTP/1.1 404 Not Found\r\n"
+            + f"Content-Length: {len(message)}\r\n\r\n".encode()
+            + message
+        )
+
+        with self.assertRaisesRegex(docker.errors.NotFound, "No such container"):
+            _ = await self.follow()
+        self.assertEqual(len(self.streams), 0)
+
+    async def assert_fails(self, log: bytes, error: str) -> list[object]:
+        """Check that ``log`` ends the stream with a warning; return its lines."""
+
+        async def handler(writer: asyncio.StreamWriter) -> None:
+            writer.write(log)
+            await writer.drain()
+            writer.close()
+
+        self.handler = handler
+        with self.assertLogs(DEFAULT_LOGGER, "WARNING") as logs:
+            lines = await self.collect(await self.follow())
+        self.assertIn(error, logs.output[0])
+        return lines
+
+    async def test_malformed_frame_ends_the_stream(self) -> None:
+        lines = await self.assert_fails(
+            b"\x07\0\0\0\0\0\0\x01x", "Malformed log frame header"
+        )
+        self.assertEqual(lines, [])
+
+    async def test_truncated_frame_ends_the_stream(self) -> None:
+        started = frame(1, b"compilation.start\n")
+        lines = await self.assert_fails(
+            started + frame(1, b"compilation.done\n")[:-4], "Truncated log frame"
+        )
+        # The lines before the truncated frame still arrive.
+        self.assertEqual(lines, ["compilation.start"])
+
+    async def test_hung_streams_take_no_thread_and_are_closed(self) -> None:
+        async def handler(_: asyncio.StreamWriter) -> None:
+            pass
+
+        self.handler = handler
+        # The attaches themselves run one after another in a thread.
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        asyncio.get_running_loop().set_default_executor(executor)
+        threads = threading.active_count()
+
+        followed = [await self.follow(f"{i}") for i in range(32)]
+
+        self.assertLessEqual(threading.active_count(), threads + 1)
+        self.assertEqual(len(self.streams), 32)
+        followed[0].stop()
+        self.assertIs(await followed[0].get(), END)
+        await self.streams.close()
+        self.assertEqual(len(self.streams), 0)
+        for stream in followed[1:]:
+            self.assertIs(await stream.get(), END)
+
+
+class TestAttachableFromEnv(unittest.TestCase):
+    def attachable(self, **env: str) -> bool:
+        with mock.patch.dict(os.environ, env, clear=True):
+            return rcc.logs.attachable_from_env()
+
+    def test_unix_socket(self) -> None:
+        self.assertTrue(self.attachable())
+        self.assertTrue(self.attachable(DOCKER_HOST="unix:///run/d.sock"))
+
+    def test_plain_tcp(self) -> None:
+        self.assertTrue(self.attachable(DOCKER_HOST="tcp://10.0.0.1:2375"))
+
+    def test_tls_and_ssh_are_followed_in_threads(self) -> None:
+        self.assertFalse(self.attachable(DOCKER_HOST="https://10.0.0.1:2376"))
+        self.assertFalse(self.attachable(DOCKER_HOST="ssh://me@docker"))
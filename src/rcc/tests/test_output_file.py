@@ -0,0 +1,102 @@
+"""
+Tests for packing a commit's output files (``rcc.engine.prepare_output_file``).
+"""
+
+import os
+import tempfile
+import unittest
+import zipfile
+
+import rcc.engine
+from rcc.tests.helpers import make_cfg, make_commit, write_file
+
+
+def write_output(base_dir: str, name: str, content: bytes) -> None:
+    write_file(os.path.join(base_dir, "outputfiles", name), content)
+
+
+class TestPrepareOutputFile(unittest.TestCase):
+    def test_small_output_is_built_in_memory(self) -> None:
+        with tempfile.TemporaryDirectory() as base_dir:
+            _ = make_cfg(
+                exec_dir=base_dir,
+                output_files_dir="outputfiles",
+                max_output_file_size=1024,
+            )
+            write_output(base_dir, "1.output", b"x" * 2048)
+            write_output(base_dir, "test_1/result.txt", b"ok")
+
+            with rcc.engine.prepare_output_file(make_commit(), base_dir) as output:
+                self.assertEqual(sorted(os.listdir(base_dir)), ["outputfiles"])
+                with zipfile.ZipFile(output) as archive:
+                    self.assertEqual(archive.read("1.output"), b"x" * 1024)
+                    self.assertEqual(archive.read("test_1/result.txt"), b"ok")
+
+    def test_large_output_spills_without_leaving_files(self) -> None:
+        with tempfile.TemporaryDirectory() as base_dir:
+            _ = make_cfg(
+                exec_dir=base_dir,
+                output_files_dir="outputfiles",
+                max_output_file_size=1024,
+                output_spool_size=16,
+            )
+            content = os.urandom(4096)
+            write_output(base_dir, "image.bin", content)
+
+            with (
+                rcc.engine.prepare_output_file(make_commit(), base_dir) as output,
+                zipfile.ZipFile(output) as archive,
+            ):
+                self.assertEqual(archive.read("image.bin"), content)
+            # The spilled archive is an anonymous temporary file.
+            self.assertEqual(os.listdir(base_dir), ["outputfiles"])
+
+    def test_program_output_is_cut_without_touching_the_file(self) -> None:
+        with tempfile.TemporaryDirectory() as base_dir:
+            _ = make_cfg(
+                exec_dir=base_dir,
+                output_files_dir="outputfiles",
+                max_output_file_size=1024,
+            )
+            write_output(base_dir, "1.error", b"e" * 4096)
+            write_output(base_dir, "data.txt", b"d" * 4096)
+            error_fname = os.path.join(base_dir, "outputfiles", "1.error")
+            before = os.stat(error_fname)
+
+            with (
+                rcc.engine.prepare_output_file(make_commit(), base_dir) as output,
+                zipfile.ZipFile(output) as archive,
+            ):
+                self.assertEqual(archive.read("1.error"), b"e" * 1024)
+                self.assertEqual(archive.read("data.txt"), b"d" * 4096)
+
+            after = os.stat(error_fname)
+            self.assertEqual(after.st_size, 4096)
+            self.assertEqual(after.st_mtime_ns, before.st_mtime_ns)
+
+    def test_compression_depends_on_size_and_type(self) -> None:
+        with tempfile.TemporaryDirectory() as base_dir:
+            _ = make_cfg(
+                exec_dir=base_dir,
+                output_files_dir="outputfiles",
+                max_output_file_size=1 << 20,
+            )
+            write_output(base_dir, "small.output", b"s" * 100)
+            write_output(base_dir, "large.output", b"l" * 100_000)
+            write_output(base_dir, "plot.png", b"p" * 100_000)
+
+            with (
+                rcc.engine.prepare_output_file(make_commit(), base_dir) as output,
+                zipfile.ZipFile(output) as archive,
+            ):
+                methods = {i.filename: i.compress_type for i in archive.infolist()}
+                self.assertEqual(archive.read("large.output"), b"l" * 100_000)
+
+            self.assertEqual(
+                methods,
+                {
+                    "small.output": zipfile.ZIP_STORED,
+                    "large.output": zipfile.ZIP_DEFLATED,
+                    "plot.png": zipfile.ZIP_STORED,
+                },
+            )
@@ -9,7 +9,6 @@ Covers:
 
 import argparse
 import asyncio
-import datetime
 import logging
 import multiprocessing as mp
 import multiprocessing.queues as mp_queues
@@ -18,93 +17,65 @@ import threading
 import time
 import unittest
 from collections.abc import Callable, Iterable
-from typing import ClassVar, Protocol, Self, cast, override
+from typing import IO, ClassVar, Protocol, Self, cast, override
 from unittest import mock
 
 import rcc
 import rcc.config
 import rcc.engine
+import rcc.images
 import rcc.provider.data
 import rcc.provider.storage
 import rcc.util
-from rcc.model import Commit, TestCase, TestCaseResult
+from rcc.languages import Language, language_from_extension
+from rcc.model import Commit, PackedCommit, TestCase, TestCaseResult
 from rcc.provider.data import DataProvider
+from rcc.tests.helpers import make_commit, make_engine_cfg
 
 
-def make_commit(commit_id: int) -> Commit:
-    return Commit(
-        commit_id,
-        f"user{commit_id}@example.com",
-        1,
-        1,
-        Commit.STATUS_IN_QUEUE,
-        "",
-        0,
-        0.0,
-        False,
-        "",
-        datetime.datetime(2026, 1, 1, tzinfo=datetime.UTC),
-        None,
-        None,
-        None,
-        "",
-        "1.2.3.4",
-        f"commits/{commit_id}/main.c",
-        1,
-        1,
-        1,
-        "main.c",
-    )
-
-
-def make_cfg(concurrency: int, exec_dir: str | None = None) -> rcc.config.Config:
-    if exec_dir is None:
-        exec_dir = tempfile.gettempdir()
-    return rcc.config.Config(
-        {
-            "provider": {"data": "postgres", "storage": "s3"},
-            "concurrency_per_worker": concurrency,
-            "exec_dir": exec_dir,
-            "exec_dir_remote": exec_dir,
-            "src_dir": "src",
-            "output_files_dir": "outputfiles",
-            "container_cfg_file": "container.config",
-            "monitor_max_file_size": 5242880,
-            "monitor_max_mem_size": 268435456,
-            "compilation_timeout": 10.0,
-            "base_exec_timeout": 5.0,
-            "max_output_file_size": 1048576,
-            "cleanup_on_error": False,
-        }
-    )
-
-
-class FakeStorage:
+class FakeStorage(rcc.provider.storage.StorageProvider):
     """Synchronous no-op storage provider (its methods run in worker threads)."""
 
+    close_count: int
+
     def __init__(self, cfg: rcc.config.Config) -> None:
-        pass
+        super().__init__()
+        self.close_count = 0
 
+    @override
     def fetch_commit_file(self, _commit: Commit, _destination: str) -> None:
         pass
 
+    @override
     def fetch_exercise_file(self, _source: str, _destination: str) -> None:
         pass
 
+    @override
     def fetch_test_case_input_file(self, _test_case: object, _destination: str) -> None:
         pass
 
+    @override
     def fetch_test_case_output_file(
         self, _test_case: object, _destination: str
     ) -> None:
         pass
 
+    @override
     def fetch_test_case_files(self, _test_case: object, _destination: str) -> None:
         pass
 
-    def store_commit_output(self, _commit: Commit, _commit_output_fname: str) -> None:
+    @override
+    def store_commit_output(self, _commit: Commit, _output: IO[bytes]) -> None:
         pass
 
+    @override
+    def fetch_object(self, _bucket: str, _key: str, _destination: str) -> None:
+        pass
+
+    @override
+    def close(self) -> None:
+        self.close_count += 1
+
 
 class TrackingProvider(rcc.provider.data.DataProvider):
     """Counts pool lifecycle events and records commit statuses; no real DB."""
@@ -181,6 +152,62 @@ class ClaimingProvider(TrackingProvider):
         self.claimed.discard(commit.id)
 
 
+class QueuedClaimingProvider(ClaimingProvider):
+    """Serves a fixed queue to the default ``claim_batch``."""
+
+    queued: list[Commit]
+
+    def __init__(self, queued: list[Commit]) -> None:
+        super().__init__()
+        self.queued = queued
+
+    @override
+    async def fetch_commits_in_queue(self) -> list[Commit]:
+        return [commit for commit in self.queued if commit.id not in self.claimed]
+
+
+class StaleClaimsProvider(QueuedClaimingProvider):
+    """Records the order of the stale claim recovery and the claims."""
+
+    calls: list[str]
+
+    def __init__(self, queued: list[Commit]) -> None:
+        super().__init__(queued)
+        self.calls = []
+
+    @override
+    async def release_stale_claims(self) -> int:
+        self.calls.append("release_stale_claims")
+        return 2
+
+    @override
+    async def claim_batch(self, n: int) -> list[Commit]:
+        self.calls.append("claim_batch")
+        return await super().claim_batch(n)
+
+
+class ListeningProvider(QueuedClaimingProvider):
+    """Records the timeouts of ``wait_for_commits``; listening after the first."""
+
+    timeouts: list[float]
+    notify_poll_interval: float
+
+    def __init__(self, queued: list[Commit]) -> None:
+        super().__init__(queued)
+        self.timeouts = []
+        self.notify_poll_interval = 0.05
+
+    @property
+    @override
+    def listening(self) -> bool:
+        return len(self.timeouts) > 0
+
+    @override
+    async def wait_for_commits(self, timeout: float) -> bool:
+        self.timeouts.append(timeout)
+        return await super().wait_for_commits(timeout)
+
+
 class _SemLock(Protocol):
     """Shape of ``multiprocessing.synchronize.SemLock`` (not in typeshed)."""
 
@@ -296,12 +323,12 @@ class TestWorkerConcurrency(unittest.IsolatedAsyncioTestCase):
         commits: list[Commit],
         concurrency: int,
         fake_process_commit: Callable[..., object],
-    ) -> tuple[TrackingProvider, mp_queues.JoinableQueue[Commit | None]]:
+    ) -> tuple[TrackingProvider, mp_queues.JoinableQueue[PackedCommit | None]]:
         provider = TrackingProvider()
-        cfg = make_cfg(concurrency)
-        task_queue: mp_queues.JoinableQueue[Commit | None] = mp.JoinableQueue()
+        cfg = make_engine_cfg(tempfile.gettempdir(), concurrency_per_worker=concurrency)
+        task_queue: mp_queues.JoinableQueue[PackedCommit | None] = mp.JoinableQueue()
         for commit in commits:
-            task_queue.put(commit)
+            task_queue.put(commit.pack())
         task_queue.put(None)
         with mock.patch.object(rcc.engine, "process_commit", fake_process_commit):
             await rcc.engine.process_commits(provider, task_queue, cfg)
@@ -354,6 +381,83 @@ class TestWorkerConcurrency(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(provider.open_count, 1)
         self.assertEqual(provider.close_count, 1)
 
+    async def test_commit_waits_for_its_image_without_a_slot(self) -> None:
+        python_image = cast(Language, language_from_extension("py")).image
+        pulled = asyncio.Event()
+        processed: list[int] = []
+
+        class FakePins:
+            images: frozenset[str] = frozenset({python_image})
+
+            async def resolve(self, _image: str) -> str | None:
+                return "sha256:1" if pulled.is_set() else None
+
+            async def wait(self, _image: str) -> str | None:
+                _ = await pulled.wait()
+                return "sha256:1"
+
+        async def fake(
+            _data_provider: DataProvider,
+            commit: Commit,
+            _cfg: rcc.config.Config | None = None,
+        ) -> None:
+            processed.append(commit.id)
+            # The C commit ran while the Python one waited; now "pull".
+            pulled.set()
+
+        waiting = make_commit(1)
+        waiting.fname = "main.py"
+        with mock.patch.object(rcc.engine, "get_image_pins", FakePins):
+            _, task_queue = await self._drive([waiting, make_commit(2)], 1, fake)
+
+        self.assertEqual(processed, [2, 1])
+        self.assertEqual(unfinished_tasks(task_queue), 0)
+
+    async def test_commits_waiting_for_an_image_without_a_slot_are_capped(
+        self,
+    ) -> None:
+        python_image = cast(Language, language_from_extension("py")).image
+        pulled = asyncio.Event()
+        waiting = 0
+        processed: list[int] = []
+
+        class FakePins:
+            images: frozenset[str] = frozenset({python_image})
+
+            async def resolve(self, _image: str) -> str | None:
+                return "sha256:1" if pulled.is_set() else None
+
+            async def wait(self, _image: str) -> str | None:
+                nonlocal waiting
+                waiting += 1
+                if waiting == 4:
+                    # Every slot and waiter place is taken; "pull" soon.
+                    _ = asyncio.get_running_loop().call_later(0.1, pulled.set)
+                _ = await pulled.wait()
+                return "sha256:1"
+
+        async def fake(
+            _data_provider: DataProvider,
+            commit: Commit,
+            _cfg: rcc.config.Config | None = None,
+        ) -> None:
+            processed.append(commit.id)
+            if commit.id == 4:
+                ran_after_pull.append(pulled.is_set())
+
+        ran_after_pull: list[bool] = []
+        commits = [make_commit(i) for i in range(5)]
+        for commit in commits[:4]:
+            commit.fname = "main.py"
+        with mock.patch.object(rcc.engine, "get_image_pins", FakePins):
+            _, task_queue = await self._drive(commits, 2, fake)
+
+        # Two Python commits wait without a slot and two keep theirs, so the
+        # C commit only runs once the image is pulled.
+        self.assertEqual(ran_after_pull, [True])
+        self.assertEqual(sorted(processed), [0, 1, 2, 3, 4])
+        self.assertEqual(unfinished_tasks(task_queue), 0)
+
     async def test_retryable_failure_does_not_leak_a_slot(self) -> None:
         active = 0
         max_active = 0
@@ -416,9 +520,11 @@ class TestWorkerConcurrency(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(provider.open_count, 1)
         self.assertEqual(provider.close_count, 1)
 
-    async def test_duplicate_commits_are_processed_once(self) -> None:
-        """Copies of the same commit (the poller re-enqueues IN_QUEUE
-        commits) are claimed by exactly one worker."""
+    async def test_worker_processes_claimed_commits_without_claiming(
+        self,
+    ) -> None:
+        """The poller claims commits before enqueueing them: workers just
+        process what they pull."""
         processed: list[int] = []
 
         async def fake(
@@ -429,18 +535,16 @@ class TestWorkerConcurrency(unittest.IsolatedAsyncioTestCase):
             processed.append(commit.id)
 
         provider = ClaimingProvider()
-        cfg = make_cfg(2)
-        task_queue: mp_queues.JoinableQueue[Commit | None] = mp.JoinableQueue()
-        for commit in (make_commit(1), make_commit(1), make_commit(2)):
-            task_queue.put(commit)
+        cfg = make_engine_cfg(tempfile.gettempdir(), concurrency_per_worker=2)
+        task_queue: mp_queues.JoinableQueue[PackedCommit | None] = mp.JoinableQueue()
+        for commit in (make_commit(1), make_commit(2)):
+            task_queue.put(commit.pack())
         task_queue.put(None)
         with mock.patch.object(rcc.engine, "process_commit", fake):
             await rcc.engine.process_commits(provider, task_queue, cfg)
 
-        # The duplicate copy of commit 1 was claimed and skipped.
         self.assertEqual(sorted(processed), [1, 2])
-        self.assertEqual(provider.claim_count, 3)
-        self.assertEqual(provider.claimed, {1, 2})
+        self.assertEqual(provider.claim_count, 0)
         self.assertEqual(unfinished_tasks(task_queue), 0)
 
     async def test_retryable_failure_releases_the_claim(self) -> None:
@@ -454,14 +558,14 @@ class TestWorkerConcurrency(unittest.IsolatedAsyncioTestCase):
             raise RuntimeError("retryable failure")
 
         provider = ClaimingProvider()
-        cfg = make_cfg(2)
-        task_queue: mp_queues.JoinableQueue[Commit | None] = mp.JoinableQueue()
-        task_queue.put(make_commit(1))
+        provider.claimed.add(1)
+        cfg = make_engine_cfg(tempfile.gettempdir(), concurrency_per_worker=2)
+        task_queue: mp_queues.JoinableQueue[PackedCommit | None] = mp.JoinableQueue()
+        task_queue.put(make_commit(1).pack())
         task_queue.put(None)
         with mock.patch.object(rcc.engine, "process_commit", fake):
             await rcc.engine.process_commits(provider, task_queue, cfg)
 
-        self.assertEqual(provider.claim_count, 1)
         self.assertEqual(provider.release_count, 1)
         # The claim was given back: a later pull may take the commit again.
         self.assertEqual(provider.claimed, set())
@@ -492,13 +596,15 @@ class TestProcessCommitIntegration(unittest.IsolatedAsyncioTestCase):
             return []
 
         with tempfile.TemporaryDirectory() as tmpdir:
-            cfg = make_cfg(2, exec_dir=tmpdir)
+            cfg = make_engine_cfg(tmpdir, concurrency_per_worker=2)
             provider = TrackingProvider()
             storage = FakeStorage(cfg)
-            task_queue: mp_queues.JoinableQueue[Commit | None] = mp.JoinableQueue()
+            task_queue: mp_queues.JoinableQueue[PackedCommit | None] = (
+                mp.JoinableQueue()
+            )
             commits = [make_commit(i) for i in range(3)]
             for commit in commits:
-                task_queue.put(commit)
+                task_queue.put(commit.pack())
             task_queue.put(None)
 
             with (
@@ -520,8 +626,44 @@ class TestProcessCommitIntegration(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(provider.open_count, 1)
         self.assertEqual(provider.close_count, 1)
 
+    async def test_storage_provider_is_shared_by_the_worker(self) -> None:
+        """One storage provider per worker process, closed when it stops."""
+        created: list[FakeStorage] = []
+
+        def fake_storage_from_config(cfg: rcc.config.Config) -> FakeStorage:
+            storage = FakeStorage(cfg)
+            created.append(storage)
+            return storage
+
+        async def fake_run_tests(*_args: object) -> list[TestCaseResult]:
+            return []
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cfg = make_engine_cfg(tmpdir, concurrency_per_worker=2)
+            provider = TrackingProvider()
+            task_queue: mp_queues.JoinableQueue[PackedCommit | None] = (
+                mp.JoinableQueue()
+            )
+            for i in range(4):
+                task_queue.put(make_commit(i).pack())
+            task_queue.put(None)
+
+            with (
+                mock.patch.object(
+                    rcc.provider.storage, "from_config", fake_storage_from_config
+                ),
+                mock.patch.object(rcc.engine, "run_tests", fake_run_tests),
+            ):
+                await rcc.engine.process_commits(provider, task_queue, cfg)
+
+        self.assertEqual(len(created), 1)
+        self.assertEqual(created[0].close_count, 1)
+        self.assertIsNone(rcc.provider.storage.get_shared())
+        for i in range(4):
+            self.assertEqual(provider.commit_statuses[i], Commit.STATUS_COMPLETED)
+
 
-class RecordingJoinableQueue(mp_queues.JoinableQueue[Commit | None]):
+class RecordingJoinableQueue(mp_queues.JoinableQueue[PackedCommit | None]):
     """Records the maxsize used to construct the queue.
 
     ``multiprocessing.JoinableQueue`` is a factory function, so the concrete
@@ -539,7 +681,7 @@ class RecordingJoinableQueue(mp_queues.JoinableQueue[Commit | None]):
         RecordingJoinableQueue.instances.append(self)
 
 
-class RecordingPutQueue(mp_queues.JoinableQueue[Commit | None]):
+class RecordingPutQueue(mp_queues.JoinableQueue[PackedCommit | None]):
     """JoinableQueue that records the ids of everything put into it."""
 
     instances: ClassVar[list[RecordingPutQueue]] = []
@@ -553,12 +695,12 @@ class RecordingPutQueue(mp_queues.JoinableQueue[Commit | None]):
     @override
     def put(
         self,
-        obj: Commit | None,
+        obj: PackedCommit | None,
         block: bool = True,
         timeout: float | None = None,
     ) -> None:
         if obj is not None:
-            self.put_ids.append(obj.id)
+            self.put_ids.append(Commit.unpack(obj).id)
         super().put(obj, block, timeout)
 
 
@@ -606,7 +748,7 @@ WORKER_COMMIT_SECONDS = 0.3
 
 def fake_worker(
     _data_provider: DataProvider,
-    task_queue: mp_queues.JoinableQueue[Commit | None],
+    task_queue: mp_queues.JoinableQueue[PackedCommit | None],
     _cfg: rcc.config.Config,
 ) -> None:
     """Stand-in for ``rcc.engine.run_worker`` inside a FakeProcess thread.
@@ -624,14 +766,18 @@ def fake_worker(
 
 
 class PollingProvider(rcc.provider.data.DataProvider):
+    """Hands out its queued commits through ``claim_batch``."""
+
     _commits: list[Commit]
-    fetch_count: int
+    batch_sizes: list[int]
+    claimed_count: int
     open_count: int
     close_count: int
 
     def __init__(self, commits: list[Commit]) -> None:
         self._commits = commits
-        self.fetch_count = 0
+        self.batch_sizes = []
+        self.claimed_count = 0
         self.open_count = 0
         self.close_count = 0
 
@@ -644,11 +790,11 @@ class PollingProvider(rcc.provider.data.DataProvider):
         self.close_count += 1
 
     @override
-    async def fetch_commits_in_queue(self) -> list[Commit]:
-        self.fetch_count += 1
-        if self.fetch_count == 1:
-            return list(self._commits)
-        return []
+    async def claim_batch(self, n: int) -> list[Commit]:
+        self.batch_sizes.append(n)
+        batch, self._commits = self._commits[:n], self._commits[n:]
+        self.claimed_count += len(batch)
+        return batch
 
     @override
     async def update_commit(self, commit: Commit) -> None:
@@ -673,30 +819,6 @@ class PollingProvider(rcc.provider.data.DataProvider):
         return []
 
 
-class RepeatingProvider(rcc.provider.data.DataProvider):
-    """Returns the same commit on every poll cycle; counts the cycles."""
-
-    _commit: Commit
-    fetch_count: int
-
-    def __init__(self, commit: Commit) -> None:
-        self._commit = commit
-        self.fetch_count = 0
-
-    @override
-    async def open(self) -> None:
-        pass
-
-    @override
-    async def close(self) -> None:
-        pass
-
-    @override
-    async def fetch_commits_in_queue(self) -> list[Commit]:
-        self.fetch_count += 1
-        return [self._commit]
-
-
 class TestMainBackpressure(unittest.IsolatedAsyncioTestCase):
     def test_queue_maxsize_is_two_times_total_slots(self) -> None:
         cfg = rcc.config.Config({"num_workers": 3, "concurrency_per_worker": 4})
@@ -708,7 +830,7 @@ class TestMainBackpressure(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(rcc.task_queue_maxsize(cfg), expected)
 
     async def test_polling_loop_blocks_on_a_full_queue(self) -> None:
-        provider = PollingProvider([make_commit(i) for i in range(5)])
+        provider = PollingProvider([make_commit(i) for i in range(20)])
         cfg = rcc.config.Config(
             {
                 "provider": {"data": "postgres", "storage": "s3"},
@@ -718,6 +840,7 @@ class TestMainBackpressure(unittest.IsolatedAsyncioTestCase):
                 "max_sleep_time": 0.01,
                 "lock_file": "compiler.lock",
                 "log": None,
+                "images": [],
             }
         )
         RecordingJoinableQueue.instances = []
@@ -742,10 +865,12 @@ class TestMainBackpressure(unittest.IsolatedAsyncioTestCase):
             main_task = asyncio.create_task(rcc.main())
             await asyncio.sleep(0.5)
 
-            # The bounded queue (maxsize 2) filled after two instant puts; the
-            # third put blocks until the slow fake worker consumes one, so the
-            # polling loop must not have fetched a second batch yet.
-            self.assertEqual(provider.fetch_count, 1)
+            # The bounded queue (maxsize 2) fills at once and the poller
+            # claims no more than it can put: in 0.5 s the slow fake worker
+            # took at most two commits, two wait in the queue and one more
+            # claim may be blocked on put.
+            self.assertEqual(provider.batch_sizes[0], 2)
+            self.assertLessEqual(provider.claimed_count, 6)
             (task_queue,) = RecordingJoinableQueue.instances
             self.assertEqual(task_queue.maxsize, 2)
 
@@ -763,7 +888,7 @@ class TestMainBackpressure(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(provider.close_count, 1)
         self.assertEqual(unfinished_tasks(task_queue), 0)
 
-    async def _run_main_with_repeating_commit(
+    async def _run_main(
         self, provider: DataProvider, cfg: rcc.config.Config, runtime: float
     ) -> RecordingPutQueue:
         """Drive rcc.main() for ``runtime`` seconds, then cancel it."""
@@ -796,9 +921,9 @@ class TestMainBackpressure(unittest.IsolatedAsyncioTestCase):
         (task_queue,) = RecordingPutQueue.instances
         return task_queue
 
-    async def test_poller_suppresses_recent_commits(self) -> None:
-        """A commit that stays IN_QUEUE is put on the queue only once."""
-        provider = RepeatingProvider(make_commit(1))
+    async def test_poller_enqueues_a_claimed_commit_once(self) -> None:
+        """A claimed commit leaves the queue: later polls do not re-enqueue it."""
+        provider = QueuedClaimingProvider([make_commit(1)])
         cfg = rcc.config.Config(
             {
                 "provider": {"data": "postgres", "storage": "s3"},
@@ -808,74 +933,220 @@ class TestMainBackpressure(unittest.IsolatedAsyncioTestCase):
                 "max_sleep_time": 0.02,
                 "lock_file": "compiler.lock",
                 "log": None,
+                "images": [],
             }
         )
 
-        task_queue = await self._run_main_with_repeating_commit(
-            provider, cfg, runtime=0.6
+        task_queue = await self._run_main(provider, cfg, runtime=0.4)
+
+        self.assertEqual(task_queue.put_ids, [1])
+        self.assertEqual(provider.claimed, {1})
+
+    async def test_stale_claims_are_released_once_before_claiming(self) -> None:
+        provider = StaleClaimsProvider([make_commit(1)])
+        cfg = rcc.config.Config(
+            {
+                "provider": {"data": "postgres", "storage": "s3"},
+                "num_workers": 1,
+                "concurrency_per_worker": 1,
+                "min_sleep_time": 0.02,
+                "max_sleep_time": 0.02,
+                "lock_file": "compiler.lock",
+                "log": None,
+                "images": [],
+            }
         )
 
-        # The poller fetched several times but only enqueued the commit once.
-        self.assertGreaterEqual(provider.fetch_count, 2)
+        task_queue = await self._run_main(provider, cfg, runtime=0.3)
+
+        self.assertEqual(provider.calls[0], "release_stale_claims")
+        self.assertEqual(provider.calls.count("release_stale_claims"), 1)
+        self.assertIn("claim_batch", provider.calls)
         self.assertEqual(task_queue.put_ids, [1])
 
-    async def test_poller_reenqueues_after_suppression_expires(self) -> None:
-        """A commit still IN_QUEUE after the window is enqueued again."""
-        provider = RepeatingProvider(make_commit(1))
+    async def test_stale_claims_are_swept_while_polling(self) -> None:
+        provider = StaleClaimsProvider([])
         cfg = rcc.config.Config(
             {
                 "provider": {"data": "postgres", "storage": "s3"},
                 "num_workers": 1,
                 "concurrency_per_worker": 1,
-                "min_sleep_time": 0.03,
-                "max_sleep_time": 0.03,
+                "min_sleep_time": 0.02,
+                "max_sleep_time": 0.02,
                 "lock_file": "compiler.lock",
                 "log": None,
-                "commit_enqueue_suppression": 0.1,
+                "images": [],
             }
         )
 
-        task_queue = await self._run_main_with_repeating_commit(
-            provider, cfg, runtime=0.8
+        with mock.patch.object(rcc.config, "STALE_CLAIM_SWEEP_INTERVAL", 0.05):
+            _ = await self._run_main(provider, cfg, runtime=0.4)
+
+        self.assertEqual(provider.calls[0], "release_stale_claims")
+        self.assertGreater(provider.calls.count("release_stale_claims"), 2)
+
+    async def test_zero_stale_claim_age_only_sweeps_before_claiming(self) -> None:
+        provider = StaleClaimsProvider([])
+        provider.stale_claim_age = 0
+        cfg = rcc.config.Config(
+            {
+                "provider": {"data": "postgres", "storage": "s3"},
+                "num_workers": 1,
+                "concurrency_per_worker": 1,
+                "min_sleep_time": 0.02,
+                "max_sleep_time": 0.02,
+                "lock_file": "compiler.lock",
+                "log": None,
+                "images": [],
+            }
         )
 
-        # After the 0.1 s window expired the poller re-enqueued the commit on
-        # the following cycles (a worker may have died before claiming it).
-        self.assertGreaterEqual(task_queue.put_ids.count(1), 3)
+        with mock.patch.object(rcc.config, "STALE_CLAIM_SWEEP_INTERVAL", 0.05):
+            _ = await self._run_main(provider, cfg, runtime=0.4)
+
+        # It would release this engine's own claims.
+        self.assertEqual(provider.calls.count("release_stale_claims"), 1)
+
+    async def test_listening_poller_polls_at_the_notify_interval(self) -> None:
+        provider = ListeningProvider([])
+        cfg = rcc.config.Config(
+            {
+                "provider": {"data": "postgres", "storage": "s3"},
+                "num_workers": 1,
+                "concurrency_per_worker": 1,
+                "min_sleep_time": 0.02,
+                "max_sleep_time": 0.02,
+                "lock_file": "compiler.lock",
+                "log": None,
+                "images": [],
+            }
+        )
+
+        _ = await self._run_main(provider, cfg, runtime=0.3)
+
+        # The backoff until the listener is up, then the long interval.
+        self.assertEqual(provider.timeouts[0], 0.02)
+        self.assertGreater(len(provider.timeouts), 1)
+        self.assertEqual(set(provider.timeouts[1:]), {0.05})
+
+    async def test_image_puller_is_cancelled_and_awaited_on_exit(self) -> None:
+        provider = QueuedClaimingProvider([])
+        cfg = rcc.config.Config(
+            {
+                "provider": {"data": "postgres", "storage": "s3"},
+                "num_workers": 1,
+                "concurrency_per_worker": 1,
+                "min_sleep_time": 0.02,
+                "max_sleep_time": 0.02,
+                "lock_file": "compiler.lock",
+                "log": None,
+                "images": [],
+            }
+        )
+        stopped: list[bool] = []
+
+        class ForeverPuller:
+            async def run(self) -> None:
+                try:
+                    _ = await asyncio.Event().wait()
+                finally:
+                    # Cleanup that suspends: main() must wait for it.
+                    await asyncio.sleep(0.05)
+                    stopped.append(True)
+
+        with mock.patch.object(
+            rcc.images, "puller_from_config", return_value=ForeverPuller()
+        ):
+            _ = await self._run_main(provider, cfg, runtime=0.2)
+
+        self.assertEqual(stopped, [True])
+
+
+class TestEnqueueClaimed(unittest.IsolatedAsyncioTestCase):
+    logger: logging.Logger = logging.getLogger("rcc.tests.enqueue")
+
+    async def test_cancellation_releases_the_commits_not_put(self) -> None:
+        task_queue: mp_queues.JoinableQueue[PackedCommit | None] = mp.JoinableQueue(
+            maxsize=1
+        )
+        task_queue.put(make_commit(0).pack())
+        provider = ClaimingProvider()
+        provider.claimed = {1, 2, 3}
+        commits = [make_commit(i) for i in (1, 2, 3)]
+
+        task = asyncio.create_task(
+            rcc.enqueue_claimed(commits, task_queue, provider, self.logger)
+        )
+        await asyncio.sleep(0.1)
+        _ = task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        # The put blocked in its thread may still land: that commit stays
+        # claimed; the ones never put are back in the queue.
+        self.assertEqual(provider.claimed, {1})
+        self.assertEqual(provider.release_count, 2)
+        _ = task_queue.get(timeout=5)
+        item = task_queue.get(timeout=5)
+        self.assertIsNotNone(item)
+        self.assertEqual(Commit.unpack(cast(PackedCommit, item)).id, 1)
+
+    async def test_failed_put_releases_every_commit_left(self) -> None:
+        task_queue: mp_queues.JoinableQueue[PackedCommit | None] = mp.JoinableQueue()
+        task_queue.close()
+        provider = ClaimingProvider()
+        provider.claimed = {1, 2, 3}
+        commits = [make_commit(i) for i in (1, 2, 3)]
+
+        with self.assertRaises(ValueError):
+            await rcc.enqueue_claimed(commits, task_queue, provider, self.logger)
+
+        self.assertEqual(provider.claimed, set())
+        self.assertEqual(provider.release_count, 3)
+
+
+class TestClaimBatch(unittest.IsolatedAsyncioTestCase):
+    async def test_default_claims_up_to_n_oldest_commits(self) -> None:
+        provider = QueuedClaimingProvider([make_commit(i) for i in (1, 2, 3)])
+
+        first = await provider.claim_batch(2)
+        second = await provider.claim_batch(2)
+
+        self.assertEqual([c.id for c in first], [1, 2])
+        self.assertEqual([c.id for c in second], [3])
+        self.assertEqual(await provider.claim_batch(2), [])
 
+    async def test_default_skips_commits_lost_to_another_claimer(self) -> None:
+        provider = QueuedClaimingProvider([make_commit(i) for i in (1, 2, 3)])
+        lost = {2}
 
-class TestSelectNewCommits(unittest.TestCase):
-    """Unit tests for the poller's duplicate-enqueue suppression helper."""
+        async def fetch() -> list[Commit]:
+            # Another claimer takes commit 2 between the fetch and the claim.
+            commits = [c for c in provider.queued if c.id not in provider.claimed]
+            provider.claimed |= lost
+            return commits
 
-    def test_recent_commits_are_suppressed_and_tracking_is_pruned(self) -> None:
-        tracker: dict[int, float] = {}
-        c1, c2 = make_commit(1), make_commit(2)
+        with mock.patch.object(provider, "fetch_commits_in_queue", fetch):
+            claimed = await provider.claim_batch(3)
 
-        # First appearance: both are new.
-        new = rcc.select_new_commits([c1, c2], tracker, 60)
-        self.assertEqual([c.id for c in new], [1, 2])
-        tracker[1] = time.monotonic()
-        tracker[2] = time.monotonic()
+        self.assertEqual([c.id for c in claimed], [1, 3])
 
-        # Still IN_QUEUE within the window: suppressed.
-        self.assertEqual(rcc.select_new_commits([c1, c2], tracker, 60), [])
+    async def test_default_claims_oldest_by_commit_time_then_id(self) -> None:
+        provider = QueuedClaimingProvider([make_commit(i) for i in (3, 1, 2)])
 
-        # A claimed commit leaves the fetch: its entry is pruned...
-        self.assertEqual(rcc.select_new_commits([c1], tracker, 60), [])
-        self.assertEqual(set(tracker), {1})
+        claimed = await provider.claim_batch(2)
 
-        # ...so a commit released back to IN_QUEUE is re-enqueued at once.
-        new = rcc.select_new_commits([c2], tracker, 60)
-        self.assertEqual([c.id for c in new], [2])
-        tracker[2] = time.monotonic()
+        self.assertEqual([c.id for c in claimed], [1, 2])
 
-        # A commit still IN_QUEUE past the window is re-enqueued (its worker
-        # may have died between pulling and claiming it).
-        tracker[1] = time.monotonic() - 61
-        new = rcc.select_new_commits([c1, c2], tracker, 60)
-        self.assertEqual([c.id for c in new], [1])
-        self.assertNotIn(1, tracker)
-        self.assertIn(2, tracker)
+    def test_batch_size_is_the_free_queue_slots(self) -> None:
+        task_queue: mp_queues.JoinableQueue[PackedCommit | None] = mp.JoinableQueue(4)
+        self.assertEqual(rcc.claim_batch_size(task_queue, 4), 4)
+        task_queue.put(make_commit(1).pack())
+        self.assertEqual(rcc.claim_batch_size(task_queue, 4), 3)
+        for i in (2, 3, 4):
+            task_queue.put(make_commit(i).pack())
+        # Full: claim one anyway, its put() waits for a free slot.
+        self.assertEqual(rcc.claim_batch_size(task_queue, 4), 1)
 
 
 if __name__ == "__main__":
@@ -7,23 +7,32 @@ pool lifecycle, transaction semantics (commit/rollback), pool exhaustion and
 row mapping without external services.
 """
 
+import asyncio
 import base64
+import contextlib
 import datetime
 import inspect
+import pickle
 import unittest
-from collections.abc import Iterator
+from collections.abc import AsyncGenerator, AsyncIterator, Iterable, Iterator
 from typing import ClassVar, Self, cast, override
 from unittest import mock
 
 import psycopg
 import psycopg_pool
+from psycopg import sql
 
 import rcc.config
 from rcc.languages import Language
-from rcc.model import Commit, TestCase, TestCaseResult
+from rcc.model import Commit, PackedCommit, TestCase, TestCaseResult
+from rcc.model.commit import RESET_FIELDS
 from rcc.provider.data.postgres import Postgres
 
 
+def query_text(query: str | sql.Composable) -> str:
+    return query if isinstance(query, str) else query.as_string()
+
+
 class FakeCursor:
     """Imitates ``psycopg.AsyncCursor``: execute + async iteration support."""
 
@@ -32,6 +41,9 @@ class FakeCursor:
     rowcounts: list[int]
     rowcount: int
     executed: list[tuple[str, object | None]]
+    executed_many: list[tuple[str, list[object]]]
+    # Rows of the last execute() call.
+    rows: list[object]
     _iter: Iterator[object]
 
     def __init__(
@@ -47,6 +59,8 @@ class FakeCursor:
         self.rowcounts = list(rowcounts or [])
         self.rowcount = 0
         self.executed = []
+        self.executed_many = []
+        self.rows = []
         self._iter = iter(())
 
     async def __aenter__(self) -> Self:
@@ -60,13 +74,25 @@ class FakeCursor:
     ) -> bool:
         return False
 
-    async def execute(self, query: str, params: object | None = None) -> None:
+    async def execute(
+        self, query: str | sql.Composable, params: object | None = None
+    ) -> None:
         if self.error is not None:
             raise self.error
-        self.executed.append((query, params))
+        self.executed.append((query_text(query), params))
         self.rowcount = self.rowcounts.pop(0) if self.rowcounts else 0
-        rows = self.result_sets.pop(0) if self.result_sets else []
-        self._iter = iter(rows)
+        self.rows = self.result_sets.pop(0) if self.result_sets else []
+        self._iter = iter(self.rows)
+
+    async def executemany(
+        self, query: str | sql.Composable, params_seq: Iterable[object]
+    ) -> None:
+        if self.error is not None:
+            raise self.error
+        self.executed_many.append((query_text(query), list(params_seq)))
+
+    async def fetchone(self) -> object | None:
+        return next(self._iter, None)
 
     def __aiter__(self) -> FakeCursor:
         return self
@@ -78,6 +104,38 @@ class FakeCursor:
             raise StopAsyncIteration
 
 
+class BlockingCursor(FakeCursor):
+    """A cursor whose executemany() waits for ``release`` to be set."""
+
+    release: asyncio.Event
+    started: asyncio.Event
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.release = asyncio.Event()
+        self.started = asyncio.Event()
+
+    @override
+    async def executemany(
+        self, query: str | sql.Composable, params_seq: Iterable[object]
+    ) -> None:
+        self.started.set()
+        _ = await self.release.wait()
+        await super().executemany(query, params_seq)
+
+
+class FakeResult:
+    """The cursor returned by ``FakeConnection.execute``."""
+
+    _rows: list[object]
+
+    def __init__(self, rows: list[object]) -> None:
+        self._rows = rows
+
+    async def fetchall(self) -> list[object]:
+        return self._rows
+
+
 class FakeConnection:
     """Imitates ``psycopg.AsyncConnection`` transaction context semantics."""
 
@@ -85,16 +143,31 @@ class FakeConnection:
     committed: bool
     rolled_back: bool
     autocommit: bool | None
+    prepare_threshold: int | None
+    pipelines: int
 
     def __init__(self, cursor: FakeCursor) -> None:
         self._cursor = cursor
         self.committed = False
         self.rolled_back = False
         self.autocommit = None
+        self.prepare_threshold = 5
+        self.pipelines = 0
 
     def cursor(self) -> FakeCursor:
         return self._cursor
 
+    async def execute(
+        self, query: str | sql.Composable, params: object | None = None
+    ) -> FakeResult:
+        await self._cursor.execute(query, params)
+        return FakeResult(self._cursor.rows)
+
+    @contextlib.asynccontextmanager
+    async def pipeline(self) -> AsyncGenerator[None]:
+        self.pipelines += 1
+        yield
+
     async def set_autocommit(self, value: bool) -> None:
         # psycopg3 async connections expose autocommit through this awaitable
         # setter (the property itself is read-only).
@@ -187,6 +260,40 @@ class RecordingPool:
         self.closed = True
 
 
+class FakeListener:
+    """Stands in for the autocommit connection ``wait_for_commits`` listens on."""
+
+    pending: list[str]
+    executed: list[object]
+    waits: list[float | None]
+    fail: bool
+    closed: bool
+
+    def __init__(self, pending: list[str] | None = None, fail: bool = False) -> None:
+        self.pending = list(pending or [])
+        self.executed = []
+        self.waits = []
+        self.fail = fail
+        self.closed = False
+
+    async def execute(self, query: object) -> None:
+        self.executed.append(query)
+
+    async def notifies(
+        self, *, timeout: float | None = None, stop_after: int | None = None
+    ) -> AsyncIterator[str]:
+        self.waits.append(timeout)
+        if self.fail:
+            raise psycopg.OperationalError("connection lost")
+        count = len(self.pending) if stop_after is None else stop_after
+        while self.pending and count > 0:
+            yield self.pending.pop(0)
+            count -= 1
+
+    async def close(self) -> None:
+        self.closed = True
+
+
 def make_cfg(
     concurrency: int | None = None, **db_overrides: object
 ) -> rcc.config.Config:
@@ -258,6 +365,33 @@ def make_commit(**overrides: object) -> Commit:
     )
 
 
+def make_commit_row(commit_id: int, status: int) -> list[object]:
+    """A row of ``COMMIT_COLUMNS`` for a C commit of exercise 5."""
+    return [
+        commit_id,  # id
+        "user@example.com",  # user_email
+        5,  # exercise_id
+        status,  # status
+        "hash",  # hash
+        0,  # corrects
+        0.0,  # score
+        False,  # compiled
+        "",  # compiled_message
+        datetime.datetime(2026, 1, 2, tzinfo=datetime.UTC),  # commit_time
+        None,  # compilation_started
+        None,  # compilation_finished
+        None,  # compiled_signal
+        "",  # compiled_error
+        "1.2.3.4",  # ip
+        f"commits/{commit_id}/main.c",  # aws_key
+        2,  # offering_id
+        False,  # ghost
+        5,  # real_id (real_exercise_id)
+        3,  # course_id
+        2,  # real_offering_id
+    ]
+
+
 def encode_b64(text: str | None) -> str:
     return base64.b64encode((text or "").encode("utf8")).decode("utf8")
 
@@ -288,7 +422,7 @@ class TestPostgresPool(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(pool.kwargs["max_size"], 5)
         self.assertEqual(pool.kwargs["timeout"], 10.0)
         self.assertFalse(pool.kwargs["open"])
-        self.assertEqual(pool.kwargs["configure"], Postgres.configure_connection)
+        self.assertEqual(pool.kwargs["configure"], provider.configure_connection)
         conninfo = cast(str, pool.kwargs["conninfo"])
         self.assertIn("host=dbhost", conninfo)
         self.assertIn("port=5433", conninfo)
@@ -349,16 +483,28 @@ class TestPostgresPool(unittest.IsolatedAsyncioTestCase):
     async def test_use_before_open_raises(self) -> None:
         provider = Postgres(make_cfg())
         with self.assertRaises(RuntimeError):
-            _ = await provider.fetch_commits_in_queue()
+            _ = await provider.claim_batch(1)
 
     async def test_configure_callback_disables_autocommit(self) -> None:
         conn = FakeConnection(FakeCursor())
-        await Postgres.configure_connection(
+        await Postgres(make_cfg()).configure_connection(
             cast(psycopg.AsyncConnection, cast(object, conn))
         )
         # Must go through the async setter, not the read-only property.
         self.assertFalse(conn.autocommit)
 
+    async def test_configure_callback_prepares_statements(self) -> None:
+        conn = FakeConnection(FakeCursor())
+        await Postgres(make_cfg()).configure_connection(
+            cast(psycopg.AsyncConnection, cast(object, conn))
+        )
+        self.assertEqual(conn.prepare_threshold, 0)
+
+        await Postgres(make_cfg(None, prepare_threshold=-1)).configure_connection(
+            cast(psycopg.AsyncConnection, cast(object, conn))
+        )
+        self.assertIsNone(conn.prepare_threshold)
+
     async def test_async_autocommit_api_contract(self) -> None:
         # Guard against assigning to `conn.autocommit` directly: on psycopg3
         # async connections the property setter raises AttributeError, which
@@ -398,48 +544,60 @@ class TestPostgresQueries(unittest.IsolatedAsyncioTestCase):
         )
         return provider, connection
 
-    async def test_update_commit_commits_on_success(self) -> None:
+    async def test_update_commit_writes_changed_columns(self) -> None:
         cursor = FakeCursor()
         conn = FakeConnection(cursor)
         provider, _ = self._provider_with(conn)
         commit = make_commit()
+        commit.status = Commit.STATUS_COMPLETED
+        commit.score = 7.5
+        commit.compiled_message = "done"
 
         await provider.update_commit(commit)
 
         self.assertTrue(conn.committed)
         self.assertFalse(conn.rolled_back)
         ((query, params),) = cursor.executed
-        self.assertIn("UPDATE commits SET", query)
-        expected = (
-            commit.user_email,
-            commit.exercise_id,
-            commit.status,
-            commit.commit_hash,
-            commit.corrects,
-            commit.score,
-            commit.is_compiled,
-            encode_b64(commit.compiled_message),
-            commit.commit_time,
-            commit.compilation_started_time,
-            commit.compilation_finished_time,
-            commit.compiled_signal,
-            encode_b64(commit.compiled_error),
-            commit.id,
+        self.assertEqual(
+            query,
+            (
+                'UPDATE commits SET "compiled_message" = %s, "score" = %s,'
+                ' "status" = %s WHERE id = %s'
+            ),
         )
-        self.assertEqual(params, expected)
+        self.assertEqual(
+            params, (encode_b64("done"), 7.5, Commit.STATUS_COMPLETED, commit.id)
+        )
+        self.assertEqual(commit.dirty_fields(), frozenset())
+
+    async def test_update_commit_skips_unchanged_commits(self) -> None:
+        cursor = FakeCursor()
+        conn = FakeConnection(cursor)
+        provider, _ = self._provider_with(conn)
+        commit = make_commit(status=Commit.STATUS_COMPLETED)
+        commit.score = commit.score
+
+        await provider.update_commit(commit)
+
+        self.assertEqual(cursor.executed, [])
+        self.assertFalse(conn.committed)
 
     async def test_update_commit_rolls_back_on_error(self) -> None:
         cursor = FakeCursor(error=psycopg.OperationalError("syntax error"))
         conn = FakeConnection(cursor)
         provider, _ = self._provider_with(conn)
+        commit = make_commit()
+        commit.status = Commit.STATUS_ERROR
 
         with self.assertRaises(psycopg.Error):
-            await provider.update_commit(make_commit())
+            await provider.update_commit(commit)
 
         self.assertTrue(conn.rolled_back)
         self.assertFalse(conn.committed)
+        # The change is written by the next update.
+        self.assertEqual(commit.dirty_fields(), {"status"})
 
-    async def test_store_commit_test_results_uses_single_transaction(self) -> None:
+    async def test_store_commit_test_results_inserts_in_one_batch(self) -> None:
         cursor = FakeCursor()
         conn = FakeConnection(cursor)
         provider, _ = self._provider_with(conn)
@@ -451,16 +609,26 @@ class TestPostgresQueries(unittest.IsolatedAsyncioTestCase):
 
         await provider.store_commit_test_results(commit, results)
 
-        self.assertEqual(len(cursor.executed), 2)
-        self.assertTrue(
-            all(
-                q.startswith("INSERT INTO commits_exercise_cases")
-                for q, _ in cursor.executed
-            )
+        self.assertEqual(cursor.executed, [])
+        ((query, rows),) = cursor.executed_many
+        self.assertTrue(query.startswith("INSERT INTO commits_exercise_cases"))
+        self.assertEqual(
+            [cast(tuple[object, ...], row)[:2] for row in rows],
+            [(commit.id, 1), (commit.id, 2)],
         )
         self.assertTrue(conn.committed)
         self.assertFalse(conn.rolled_back)
 
+    async def test_store_commit_test_results_skips_empty_results(self) -> None:
+        cursor = FakeCursor()
+        conn = FakeConnection(cursor)
+        provider, _ = self._provider_with(conn)
+
+        await provider.store_commit_test_results(make_commit(), [])
+
+        self.assertEqual(cursor.executed_many, [])
+        self.assertFalse(conn.committed)
+
     async def test_store_commit_test_results_rolls_back_if_an_insert_fails(
         self,
     ) -> None:
@@ -482,47 +650,45 @@ class TestPostgresQueries(unittest.IsolatedAsyncioTestCase):
             cast(object, ExhaustedPool()),
         )
 
+        commit = make_commit()
+        commit.status = Commit.STATUS_COMPLETED
         with self.assertRaises(psycopg_pool.PoolTimeout):
-            await provider.update_commit(make_commit())
+            await provider.update_commit(commit)
 
-    async def test_fetch_commits_in_queue_maps_rows_and_language(self) -> None:
-        row: list[object] = [
-            1,  # id
-            "user@example.com",  # user_email
-            5,  # exercise_id
-            Commit.STATUS_IN_QUEUE,  # status
-            "hash",  # hash
-            0,  # corrects
-            0.0,  # score
-            False,  # compiled
-            "",  # compiled_message
-            datetime.datetime(2026, 1, 2, tzinfo=datetime.UTC),  # commit_time
-            None,  # compilation_started
-            None,  # compilation_finished
-            None,  # compiled_signal
-            "",  # compiled_error
-            "1.2.3.4",  # ip
-            "commits/1/main.c",  # aws_key
-            2,  # offering_id
-            False,  # ghost
-            5,  # real_id (real_exercise_id)
-            3,  # course_id
-            "commits/1/main.c",  # real_offering_id
+    def test_queue_page_size_is_configurable(self) -> None:
+        self.assertEqual(
+            Postgres(make_cfg()).queue_page_size, rcc.config.DEFAULT_QUEUE_PAGE_SIZE
+        )
+        self.assertEqual(Postgres(make_cfg(None, queue_page_size=7)).queue_page_size, 7)
+
+    async def test_claim_batch_claims_and_hydrates_in_one_query(self) -> None:
+        rows: list[object] = [
+            make_commit_row(i, Commit.STATUS_PROCESSING) for i in (1, 2)
         ]
-        cursor = FakeCursor(result_sets=[[row]])
-        provider, _ = self._provider_with(FakeConnection(cursor))
+        cursor = FakeCursor(result_sets=[rows])
+        conn = FakeConnection(cursor)
+        provider, _ = self._provider_with(conn)
 
-        commits = await provider.fetch_commits_in_queue()
+        commits = await provider.claim_batch(10)
 
-        ((_query, params),) = cursor.executed
-        self.assertEqual(params, (Commit.STATUS_IN_QUEUE,))
-        self.assertEqual(len(commits), 1)
-        commit = commits[0]
-        self.assertEqual(commit.id, 1)
-        self.assertEqual(commit.real_exercise_id, 5)
-        self.assertEqual(commit.fname, "main.c")
-        self.assertIsNotNone(commit.language)
-        self.assertEqual(cast(Language, commit.language).name, "C")
+        ((query, params),) = cursor.executed
+        self.assertIn("FOR UPDATE OF com SKIP LOCKED", query)
+        self.assertIn("RETURNING", query)
+        # The DB column is `compilation_started` (no `_time` suffix): a wrong
+        # column name would fail every claim against the real schema.
+        self.assertIn("compilation_started = %s", query)
+        params_tuple = cast(tuple[object, ...], params)
+        self.assertEqual(
+            params_tuple[:3],
+            (Commit.STATUS_IN_QUEUE, 10, Commit.STATUS_PROCESSING),
+        )
+        self.assertIsInstance(params_tuple[3], datetime.datetime)
+        self.assertTrue(conn.committed)
+        self.assertEqual([c.id for c in commits], [1, 2])
+        self.assertEqual([c.status for c in commits], [Commit.STATUS_PROCESSING] * 2)
+        self.assertEqual(commits[0].real_exercise_id, 5)
+        self.assertEqual(commits[0].fname, "main.c")
+        self.assertEqual(cast(Language, commits[0].language).name, "C")
 
     async def test_fetch_test_cases_reads_cases_and_files(self) -> None:
         case_row: list[object] = [
@@ -546,7 +712,8 @@ class TestPostgresQueries(unittest.IsolatedAsyncioTestCase):
                 [(101, "in.txt"), (101, "data.bin")],
             ]
         )
-        provider, _ = self._provider_with(FakeConnection(cursor))
+        conn = FakeConnection(cursor)
+        provider, _ = self._provider_with(conn)
         commit = make_commit()
 
         test_cases = await provider.fetch_test_cases(commit)
@@ -556,10 +723,12 @@ class TestPostgresQueries(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(test_case.id, 101)
         self.assertEqual(test_case.output_type, TestCase.IO_TYPE_NUMERIC)
         self.assertEqual(test_case.files, ["in.txt", "data.bin"])
-        self.assertEqual(len(cursor.executed), 2)
-        self.assertEqual(cursor.executed[0][1], (commit.real_exercise_id,))
-        # The per-case N+1 loop is replaced by one batched query over the ids.
-        self.assertEqual(cursor.executed[1][1], ([101],))
+        # Both queries are keyed by the exercise and sent in one pipeline.
+        self.assertEqual(conn.pipelines, 1)
+        self.assertEqual(
+            [params for _, params in cursor.executed],
+            [(commit.real_exercise_id,), (commit.real_exercise_id,)],
+        )
 
     async def test_fetch_test_cases_batches_files_across_cases(self) -> None:
         def case_row(case_id: int) -> list[object]:
@@ -594,16 +763,27 @@ class TestPostgresQueries(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(test_cases[0].files, ["a.in", "data.bin"])
         self.assertEqual(test_cases[1].files, ["b.in"])
         self.assertEqual(len(cursor.executed), 2)
-        self.assertEqual(cursor.executed[1][1], ([101, 102],))
 
-    async def test_fetch_test_cases_skips_files_query_without_cases(self) -> None:
-        cursor = FakeCursor(result_sets=[[]])
+    async def test_fetch_test_cases_without_cases(self) -> None:
+        cursor = FakeCursor(result_sets=[[], []])
         provider, _ = self._provider_with(FakeConnection(cursor))
 
         test_cases = await provider.fetch_test_cases(make_commit())
 
         self.assertEqual(test_cases, [])
-        self.assertEqual(len(cursor.executed), 1)
+
+    async def test_fetch_test_cases_version_probes_the_exercise(self) -> None:
+        last_update = datetime.datetime(2026, 1, 2, tzinfo=datetime.UTC)
+        cursor = FakeCursor(result_sets=[[(3, last_update, 4)]])
+        provider, _ = self._provider_with(FakeConnection(cursor))
+        commit = make_commit()
+
+        version = await provider.fetch_test_cases_version(commit)
+
+        self.assertEqual(version, (3, last_update, 4))
+        ((query, params),) = cursor.executed
+        self.assertIn("max(cas.last_update)", query)
+        self.assertEqual(params, (commit.real_exercise_id, commit.real_exercise_id))
 
     async def test_fetch_exercise_files_reads_rows(self) -> None:
         cursor = FakeCursor(result_sets=[[("Makefile",), ("util.c",)]])
@@ -614,57 +794,350 @@ class TestPostgresQueries(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(fnames, ["Makefile", "util.c"])
         self.assertEqual(cursor.executed[0][1], (7,))
 
-    async def test_claim_commit_flips_in_queue_to_processing(self) -> None:
+    async def test_release_commit_restores_in_queue_state(self) -> None:
         cursor = FakeCursor(rowcounts=[1])
         conn = FakeConnection(cursor)
         provider, _ = self._provider_with(conn)
         commit = make_commit()
 
-        claimed = await provider.claim_commit(commit)
+        await provider.release_commit(commit)
 
-        self.assertTrue(claimed)
         self.assertTrue(conn.committed)
         ((query, params),) = cursor.executed
         self.assertIn("UPDATE commits", query)
-        self.assertIn("status = %s", query)
-        self.assertIn("WHERE id = %s AND status = %s", query)
-        # The DB column is `compilation_started` (no `_time` suffix): a wrong
-        # column name would fail every claim against the real schema.
-        self.assertIn("compilation_started = %s", query)
+        self.assertIn("compilation_started = NULL", query)
         self.assertNotIn("compilation_started_time", query)
-        status, started, commit_id, expected_status = cast(tuple[object, ...], params)
-        self.assertEqual(status, Commit.STATUS_PROCESSING)
-        self.assertIsInstance(started, datetime.datetime)
-        self.assertEqual(commit_id, commit.id)
-        self.assertEqual(expected_status, Commit.STATUS_IN_QUEUE)
-
-    async def test_claim_commit_loses_when_already_taken(self) -> None:
-        # Zero rows updated: the commit is no longer IN_QUEUE.
-        cursor = FakeCursor(rowcounts=[0])
+        self.assertIn("status = ANY(%s)", query)
+        self.assertEqual(
+            params,
+            (
+                Commit.STATUS_IN_QUEUE,
+                commit.id,
+                sorted(
+                    [
+                        Commit.STATUS_PROCESSING,
+                        Commit.STATUS_COMPILING,
+                        Commit.STATUS_COMPILED,
+                        Commit.STATUS_RUNNING,
+                    ]
+                ),
+            ),
+        )
+
+    async def test_release_commit_covers_a_claim_never_started(self) -> None:
+        # The poller claims a commit, then fails to hand it to a worker.
+        row = make_commit_row(1, Commit.STATUS_PROCESSING)
+        cursor = FakeCursor(result_sets=[[row]])
         provider, _ = self._provider_with(FakeConnection(cursor))
+        (commit,) = await provider.claim_batch(1)
 
-        claimed = await provider.claim_commit(make_commit())
+        await provider.release_commit(commit)
 
-        self.assertFalse(claimed)
-        ((_query, params),) = cursor.executed
-        params_tuple = cast(tuple[object, ...], params)
-        self.assertEqual(params_tuple[0], Commit.STATUS_PROCESSING)
-        self.assertEqual(params_tuple[2], 42)
-        self.assertEqual(params_tuple[3], Commit.STATUS_IN_QUEUE)
+        (_, claim_params), (_, release_params) = cursor.executed
+        claimed_status = cast(tuple[object, ...], claim_params)[2]
+        released_statuses = cast(tuple[object, ...], release_params)[2]
+        self.assertIn(claimed_status, cast(list[int], released_statuses))
 
-    async def test_release_commit_restores_in_queue_state(self) -> None:
-        cursor = FakeCursor(rowcounts=[1])
+    async def test_release_stale_claims_requeues_old_in_progress_commits(
+        self,
+    ) -> None:
+        cursor = FakeCursor(rowcounts=[3])
         conn = FakeConnection(cursor)
-        provider, _ = self._provider_with(conn)
-        commit = make_commit()
+        provider = Postgres(make_cfg(None, stale_claim_age=600))
+        provider._pool = cast(  # pyright: ignore[reportPrivateUsage]
+            psycopg_pool.AsyncConnectionPool[psycopg.AsyncConnection],
+            cast(object, FakePool(conn)),
+        )
+        age = datetime.timedelta(seconds=600)
+        before = datetime.datetime.now(tz=datetime.UTC)
 
-        await provider.release_commit(commit)
+        released = await provider.release_stale_claims()
+
+        after = datetime.datetime.now(tz=datetime.UTC)
 
+        self.assertEqual(released, 3)
         self.assertTrue(conn.committed)
         ((query, params),) = cursor.executed
-        self.assertIn("UPDATE commits", query)
         self.assertIn("compilation_started = NULL", query)
-        self.assertNotIn("compilation_started_time", query)
+        self.assertIn("compilation_started <= %s", query)
+        status, in_progress, claimed_before = cast(tuple[object, ...], params)
+        self.assertEqual(status, Commit.STATUS_IN_QUEUE)
+        self.assertEqual(
+            in_progress,
+            sorted(
+                [
+                    Commit.STATUS_PROCESSING,
+                    Commit.STATUS_COMPILING,
+                    Commit.STATUS_COMPILED,
+                    Commit.STATUS_RUNNING,
+                ]
+            ),
+        )
+        claimed_before = cast(datetime.datetime, claimed_before)
+        self.assertTrue(before - age <= claimed_before <= after - age)
+
+    async def test_negative_stale_claim_age_disables_the_recovery(self) -> None:
+        cursor = FakeCursor()
+        provider = Postgres(make_cfg(None, stale_claim_age=-1))
+        provider._pool = cast(  # pyright: ignore[reportPrivateUsage]
+            psycopg_pool.AsyncConnectionPool[psycopg.AsyncConnection],
+            cast(object, FakePool(FakeConnection(cursor))),
+        )
+
+        self.assertEqual(await provider.release_stale_claims(), 0)
+        self.assertEqual(cursor.executed, [])
+
+
+class TestPostgresNotifications(unittest.IsolatedAsyncioTestCase):
+    def _provider_with(
+        self, listener: FakeListener, **db_overrides: object
+    ) -> tuple[Postgres, mock.AsyncMock]:
+        provider = Postgres(make_cfg(None, **db_overrides))
+        connect = mock.AsyncMock(return_value=listener)
+        patcher = mock.patch.object(psycopg.AsyncConnection, "connect", connect)
+        _ = patcher.start()
+        self.addCleanup(patcher.stop)
+        return provider, connect
+
+    async def test_notification_wakes_and_drains_the_burst(self) -> None:
+        listener = FakeListener(pending=["", "", ""])
+        provider, connect = self._provider_with(listener)
+
+        self.assertTrue(await provider.wait_for_commits(5))
+
+        connect.assert_awaited_once()
+        assert connect.await_args is not None
+        self.assertTrue(connect.await_args.kwargs["autocommit"])
+        (query,) = listener.executed
+        self.assertEqual(
+            query,
+            sql.SQL("LISTEN {}").format(
+                sql.Identifier(rcc.config.DEFAULT_NOTIFY_CHANNEL)
+            ),
+        )
+        self.assertEqual(listener.pending, [])
+        self.assertEqual(listener.waits, [5, 0])
+
+    async def test_listening_once_the_listener_is_open(self) -> None:
+        listener = FakeListener()
+        provider, _ = self._provider_with(listener, notify_poll_interval=30)
+        self.assertEqual(provider.notify_poll_interval, 30.0)
+        self.assertFalse(provider.listening)
+
+        _ = await provider.wait_for_commits(0.01)
+        self.assertTrue(provider.listening)
+
+        listener.closed = True
+        self.assertFalse(provider.listening)
+
+    async def test_timeout_without_notification_reuses_the_listener(self) -> None:
+        listener = FakeListener()
+        provider, connect = self._provider_with(listener)
+
+        self.assertFalse(await provider.wait_for_commits(0.01))
+        self.assertFalse(await provider.wait_for_commits(0.01))
+
+        connect.assert_awaited_once()
+        self.assertEqual(len(listener.executed), 1)
+
+    async def test_listener_failure_falls_back_to_sleeping(self) -> None:
+        listener = FakeListener(fail=True)
+        provider, _ = self._provider_with(listener)
+
+        with (
+            mock.patch("asyncio.sleep", new=mock.AsyncMock()) as sleep,
+            self.assertLogs(rcc.config.DEFAULT_LOGGER, "WARNING"),
+        ):
+            self.assertFalse(await provider.wait_for_commits(5))
+
+        sleep.assert_awaited_once_with(5)
+        self.assertTrue(listener.closed)
+        self.assertIsNone(provider._listener)  # pyright: ignore[reportPrivateUsage]
+        self.assertFalse(provider.listening)
+
+    async def test_empty_channel_disables_listening(self) -> None:
+        provider, connect = self._provider_with(FakeListener(), notify_channel="")
+
+        with mock.patch("asyncio.sleep", new=mock.AsyncMock()) as sleep:
+            self.assertFalse(await provider.wait_for_commits(5))
+
+        sleep.assert_awaited_once_with(5)
+        connect.assert_not_awaited()
+
+    async def test_close_closes_the_listener(self) -> None:
+        listener = FakeListener()
+        provider, _ = self._provider_with(listener)
+        _ = await provider.wait_for_commits(0.01)
+
+        await provider.close()
+
+        self.assertTrue(listener.closed)
+        self.assertIsNone(provider._listener)  # pyright: ignore[reportPrivateUsage]
+
+
+def in_progress(status: int) -> Commit:
+    """A commit whose status just changed to ``status``."""
+    commit = make_commit()
+    commit.status = status
+    return commit
+
+
+class TestPostgresWriteBehind(unittest.IsolatedAsyncioTestCase):
+    def _provider_with(
+        self, connection: FakeConnection, interval: float = 0.01
+    ) -> Postgres:
+        provider = Postgres(make_cfg(None, status_flush_interval=interval))
+        provider._pool = cast(  # pyright: ignore[reportPrivateUsage]
+            psycopg_pool.AsyncConnectionPool[psycopg.AsyncConnection],
+            cast(object, FakePool(connection)),
+        )
+        return provider
+
+    async def test_in_progress_states_are_merged_and_batched(self) -> None:
+        cursor = FakeCursor()
+        provider = self._provider_with(FakeConnection(cursor))
+        first, second = make_commit(commit_id=1), make_commit(commit_id=2)
+
+        for status in (Commit.STATUS_COMPILING, Commit.STATUS_RUNNING):
+            first.status = status
+            await provider.update_commit(first)
+        second.status = Commit.STATUS_COMPILED
+        await provider.update_commit(second)
+        self.assertEqual(cursor.executed_many, [])
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(cursor.executed, [])
+        ((query, rows),) = cursor.executed_many
+        self.assertEqual(
+            query,
+            'UPDATE commits SET "status" = %s WHERE id = %s AND status = ANY(%s)',
+        )
+        by_id = {
+            cast(tuple[object, ...], row)[1]: cast(tuple[object, ...], row)
+            for row in rows
+        }
         self.assertEqual(
-            params, (Commit.STATUS_IN_QUEUE, commit.id, Commit.STATUS_PROCESSING)
+            {cid: row[0] for cid, row in by_id.items()},
+            {1: Commit.STATUS_RUNNING, 2: Commit.STATUS_COMPILED},
         )
+        self.assertNotIn(Commit.STATUS_COMPLETED, cast(list[int], by_id[1][2]))
+
+    async def test_final_state_is_written_at_once_and_drops_pending(self) -> None:
+        cursor = FakeCursor()
+        provider = self._provider_with(FakeConnection(cursor), interval=60)
+        commit = make_commit()
+        commit.status = Commit.STATUS_RUNNING
+        commit.compilation_finished_time = None
+        await provider.update_commit(commit)
+
+        commit.status = Commit.STATUS_COMPLETED
+        await provider.update_commit(commit)
+        await provider.close()
+
+        # The final write carries the pending change of the commit too.
+        ((query, params),) = cursor.executed
+        self.assertIn('"compilation_finished" = %s, "status" = %s', query)
+        self.assertEqual(params, (None, Commit.STATUS_COMPLETED, commit.id))
+        self.assertEqual(cursor.executed_many, [])
+
+    async def test_close_writes_pending_states(self) -> None:
+        cursor = FakeCursor()
+        provider = self._provider_with(FakeConnection(cursor), interval=60)
+
+        await provider.update_commit(in_progress(Commit.STATUS_COMPILING))
+        await provider.close()
+
+        ((_query, rows),) = cursor.executed_many
+        self.assertEqual(len(rows), 1)
+
+    async def test_final_state_carries_the_batch_being_flushed(self) -> None:
+        cursor = BlockingCursor()
+        provider = self._provider_with(FakeConnection(cursor))
+        commit = make_commit(is_compiled=False)
+        commit.status = Commit.STATUS_RUNNING
+        commit.is_compiled = True
+        await provider.update_commit(commit)
+        _ = await cursor.started.wait()
+
+        commit.status = Commit.STATUS_COMPLETED
+        await provider.update_commit(commit)
+        cursor.release.set()
+        await provider.close()
+
+        ((query, params),) = cursor.executed
+        self.assertIn('"compiled" = %s, "status" = %s', query)
+        self.assertEqual(params, (True, Commit.STATUS_COMPLETED, commit.id))
+
+    async def test_close_writes_the_batch_being_flushed(self) -> None:
+        cursor = BlockingCursor()
+        provider = self._provider_with(FakeConnection(cursor))
+        await provider.update_commit(in_progress(Commit.STATUS_COMPILING))
+        _ = await cursor.started.wait()
+
+        close = asyncio.create_task(provider.close())
+        await asyncio.sleep(0)
+        cursor.release.set()
+        await close
+
+        ((_query, rows),) = cursor.executed_many
+        self.assertEqual(len(rows), 1)
+
+    async def test_failed_flush_is_retried(self) -> None:
+        cursor = FakeCursor(error=psycopg.OperationalError("connection lost"))
+        provider = self._provider_with(FakeConnection(cursor))
+
+        with self.assertLogs(rcc.config.DEFAULT_LOGGER, "WARNING"):
+            await provider.update_commit(in_progress(Commit.STATUS_RUNNING))
+            await asyncio.sleep(0.05)
+        cursor.error = None
+        await asyncio.sleep(0.05)
+
+        ((_query, rows),) = cursor.executed_many
+        self.assertEqual(len(rows), 1)
+
+    async def test_zero_interval_writes_every_state(self) -> None:
+        cursor = FakeCursor()
+        provider = self._provider_with(FakeConnection(cursor), interval=0)
+
+        await provider.update_commit(in_progress(Commit.STATUS_COMPILING))
+
+        self.assertEqual(len(cursor.executed), 1)
+
+
+class TestCommitChanges(unittest.TestCase):
+    def test_only_changed_values_are_tracked(self) -> None:
+        commit = make_commit()
+        self.assertEqual(commit.dirty_fields(), frozenset())
+
+        commit.score = commit.score
+        commit.status = Commit.STATUS_RUNNING
+        commit.extension = ".c"
+        self.assertEqual(commit.dirty_fields(), {"status", "extension"})
+
+        commit.mark_clean()
+        self.assertEqual(commit.dirty_fields(), frozenset())
+
+    def test_reset_marks_the_cleared_fields(self) -> None:
+        commit = make_commit(status=Commit.STATUS_COMPLETED, compiled_error="boom")
+        commit.reset()
+        self.assertEqual(commit.dirty_fields(), RESET_FIELDS)
+
+    def test_unpacked_commit_is_the_reset_packed_one(self) -> None:
+        commit = make_commit()
+        commit.status = Commit.STATUS_RUNNING
+        packed = cast(PackedCommit, pickle.loads(pickle.dumps(commit.pack())))
+
+        unpacked = Commit.unpack(packed)
+
+        commit.reset()
+        for field in PackedCommit._fields:
+            self.assertEqual(getattr(unpacked, field), getattr(commit, field), field)
+        for field in RESET_FIELDS:
+            self.assertEqual(getattr(unpacked, field), getattr(commit, field), field)
+        assert unpacked.language is not None
+        self.assertEqual(unpacked.language.name, "C")
+        # The reset fields are written by the first update, nothing else is.
+        self.assertEqual(unpacked.dirty_fields(), RESET_FIELDS)
+        self.assertEqual(commit.dirty_fields() - RESET_FIELDS, frozenset())
+        self.assertNotIn(b"compiled ok", pickle.dumps(packed))
+        self.assertLess(len(pickle.dumps(packed)), len(pickle.dumps(commit)) // 2)
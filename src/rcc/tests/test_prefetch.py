@@ -3,7 +3,8 @@ Unit tests for the parallel prefetch phase of ``process_commit()`` (no docker).
 
 The prefetch overlaps three independent IO steps — ``fetch_test_cases``,
 ``delete_commit_test_results`` and the commit-file S3 download — and downloads
-exercise/test-case files concurrently behind a semaphore. The overlap tests
+exercise/test-case files as parallel batches. The expected outputs are
+downloaded while the container runs. The overlap tests
 use event-based coordination: each mock fetcher waits for the other one to
 *start*, so a sequential implementation would deadlock and time out.
 Completing within the timeout therefore proves the operations ran
@@ -11,13 +12,12 @@ concurrently.
 """
 
 import asyncio
-import datetime
 import os
 import tempfile
 import threading
 import time
 import unittest
-from typing import override
+from typing import IO, override
 from unittest import mock
 
 import rcc.config
@@ -26,83 +26,49 @@ import rcc.provider.storage
 from rcc.model import Commit, TestCase, TestCaseResult
 from rcc.provider.data import DataProvider
 from rcc.provider.storage import StorageProvider
+from rcc.tests.helpers import make_commit, make_engine_cfg
 
 
-def make_commit(commit_id: int = 1) -> Commit:
-    return Commit(
-        commit_id,
-        f"user{commit_id}@example.com",
-        1,
-        1,
-        Commit.STATUS_IN_QUEUE,
-        "",
-        0,
-        0.0,
-        False,
-        "",
-        datetime.datetime(2026, 1, 1, tzinfo=datetime.UTC),
-        None,
-        None,
-        None,
-        "",
-        "1.2.3.4",
-        f"commits/{commit_id}/main.c",
-        1,
-        1,
-        1,
-        "main.c",
-    )
-
-
-def make_cfg(exec_dir: str, **overrides: object) -> rcc.config.Config:
-    values: dict[str, object] = {
-        "provider": {"data": "postgres", "storage": "s3"},
-        "concurrency_per_worker": 4,
-        "exec_dir": exec_dir,
-        "exec_dir_remote": exec_dir,
-        "src_dir": "src",
-        "output_files_dir": "outputfiles",
-        "container_cfg_file": "container.config",
-        "monitor_max_file_size": 5242880,
-        "monitor_max_mem_size": 268435456,
-        "compilation_timeout": 10.0,
-        "base_exec_timeout": 5.0,
-        "max_output_file_size": 1048576,
-        "cleanup_on_error": True,
-    }
-    values.update(overrides)
-    cfg = rcc.config.Config(values)
-    # process_commit()'s helper functions read the registered default config.
-    _ = rcc.config.from_dict(rcc.config.DEFAULT_CONFIG, values)
-    return cfg
-
-
-class NoopStorage:
+class NoopStorage(StorageProvider):
     """Synchronous storage provider whose downloads do nothing."""
 
     def __init__(self, cfg: rcc.config.Config | None) -> None:
         pass
 
+    @override
     def fetch_commit_file(self, _commit: Commit, _destination: str) -> None:
         pass
 
+    @override
     def fetch_exercise_file(self, _source: str, _destination: str) -> None:
         pass
 
+    @override
     def fetch_test_case_input_file(
         self, _test_case: TestCase, _destination: str
     ) -> None:
         pass
 
+    @override
     def fetch_test_case_output_file(
         self, _test_case: TestCase, _destination: str
     ) -> None:
         pass
 
+    @override
     def fetch_test_case_files(self, _test_case: TestCase, _destination: str) -> None:
         pass
 
-    def store_commit_output(self, _commit: Commit, _commit_output_fname: str) -> None:
+    @override
+    def store_commit_output(self, _commit: Commit, _output: IO[bytes]) -> None:
+        pass
+
+    @override
+    def fetch_object(self, _bucket: str, _key: str, _destination: str) -> None:
+        pass
+
+    @override
+    def close(self) -> None:
         pass
 
 
@@ -234,7 +200,7 @@ class CountingStorage(NoopStorage):
         self._download()
 
     @override
-    def fetch_exercise_file(self, source: str, destination: str) -> None:
+    def fetch_object(self, bucket: str, key: str, destination: str) -> None:
         self._download()
 
 
@@ -275,8 +241,8 @@ class TestPrefetch(unittest.IsolatedAsyncioTestCase):
         storage = EventCoordinatedStorage(fetch_started, download_started)
 
         with tempfile.TemporaryDirectory() as tmpdir:
-            cfg = make_cfg(tmpdir)
-            commit = make_commit()
+            cfg = make_engine_cfg(tmpdir, cleanup_on_error=True)
+            commit = make_commit(status=Commit.STATUS_IN_QUEUE)
             with (
                 mock.patch.object(
                     rcc.provider.storage, "from_config", return_value=storage
@@ -322,8 +288,8 @@ class TestPrefetch(unittest.IsolatedAsyncioTestCase):
         storage = BlockingStorage(None)
 
         with tempfile.TemporaryDirectory() as tmpdir:
-            cfg = make_cfg(tmpdir)
-            commit = make_commit()
+            cfg = make_engine_cfg(tmpdir, cleanup_on_error=True)
+            commit = make_commit(status=Commit.STATUS_IN_QUEUE)
             with (
                 mock.patch.object(
                     rcc.provider.storage, "from_config", return_value=storage
@@ -353,8 +319,10 @@ class TestPrefetch(unittest.IsolatedAsyncioTestCase):
         provider = ExerciseFilesProvider([f"f{i}.c" for i in range(6)])
 
         with tempfile.TemporaryDirectory() as tmpdir:
-            cfg = make_cfg(tmpdir, concurrency_per_worker=2)
-            commit = make_commit()
+            cfg = make_engine_cfg(
+                tmpdir, concurrency_per_worker=2, cleanup_on_error=True
+            )
+            commit = make_commit(status=Commit.STATUS_IN_QUEUE)
             with (
                 mock.patch.object(
                     rcc.provider.storage, "from_config", return_value=storage
@@ -380,8 +348,8 @@ class TestPrefetch(unittest.IsolatedAsyncioTestCase):
         storage = NoopStorage(None)
 
         with tempfile.TemporaryDirectory() as tmpdir:
-            cfg = make_cfg(tmpdir)  # cleanup_on_error=True
-            commit = make_commit()
+            cfg = make_engine_cfg(tmpdir, cleanup_on_error=True)
+            commit = make_commit(status=Commit.STATUS_IN_QUEUE)
             base_dir = os.path.join(tmpdir, f"commit_{commit.id}")
             with (
                 mock.patch.object(
@@ -408,8 +376,8 @@ class TestPrefetch(unittest.IsolatedAsyncioTestCase):
         storage = FailingStorage(None)
 
         with tempfile.TemporaryDirectory() as tmpdir:
-            cfg = make_cfg(tmpdir)
-            commit = make_commit()
+            cfg = make_engine_cfg(tmpdir, cleanup_on_error=True)
+            commit = make_commit(status=Commit.STATUS_IN_QUEUE)
             base_dir = os.path.join(tmpdir, f"commit_{commit.id}")
             with (
                 mock.patch.object(
@@ -434,8 +402,8 @@ class TestPrefetch(unittest.IsolatedAsyncioTestCase):
         storage = NoopStorage(None)
 
         with tempfile.TemporaryDirectory() as tmpdir:
-            cfg = make_cfg(tmpdir)
-            commit = make_commit()
+            cfg = make_engine_cfg(tmpdir, cleanup_on_error=True)
+            commit = make_commit(status=Commit.STATUS_IN_QUEUE)
             with (
                 mock.patch.object(
                     rcc.provider.storage, "from_config", return_value=storage
@@ -451,5 +419,83 @@ class TestPrefetch(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(provider.update_count, 0)
 
 
+def write_run_output(base_dir: str, test_case_id: int, output: str) -> None:
+    """Write the files the container leaves for a passing test case."""
+    for name, content in (
+        (f"{test_case_id}.output", output),
+        (f"{test_case_id}.error", ""),
+        (f"{test_case_id}.monitor_out", "time=0.01\nsignal=\n"),
+    ):
+        with open(os.path.join(base_dir, name), "w") as f:
+            _ = f.write(content)
+
+
+class ExpectedOutputStorage(NoopStorage):
+    """Serves ``42`` as every expected output, recording the fetched keys."""
+
+    fetched: list[str]
+
+    def __init__(self) -> None:
+        super().__init__(None)
+        self.fetched = []
+
+    @override
+    def fetch_object(self, bucket: str, key: str, destination: str) -> None:
+        with open(destination, "w") as f:
+            _ = f.write("42\n")
+        self.fetched.append(key)
+
+
+class TestExpectedOutputs(unittest.IsolatedAsyncioTestCase):
+    async def test_downloaded_during_the_run_outside_the_mounted_dir(self) -> None:
+        storage = ExpectedOutputStorage()
+        test_case = TestCase(
+            7,
+            1,
+            TestCase.IO_TYPE_TEXT,
+            TestCase.IO_TYPE_TEXT,
+            False,
+            False,
+            0,
+            5,
+            0,
+            False,
+            0,
+            None,
+            None,
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            _ = make_engine_cfg(tmpdir, cleanup_on_error=True)
+            base_dir = os.path.join(tmpdir, "commit_1")
+            os.makedirs(base_dir)
+            seen_in_base_dir: list[str] = []
+
+            async def fake_run(*_args: object) -> None:
+                # The container is still "running": the download must finish
+                # without waiting for the run to return.
+                async with asyncio.timeout(5):
+                    while "7/out" not in storage.fetched:
+                        await asyncio.sleep(0.01)
+                seen_in_base_dir.extend(os.listdir(base_dir))
+                write_run_output(base_dir, 7, "42\n")
+
+            with mock.patch.object(rcc.engine, "run", fake_run):
+                results = await rcc.engine.run_tests(
+                    RecordingProvider(),
+                    storage,
+                    make_commit(status=Commit.STATUS_IN_QUEUE),
+                    [test_case],
+                    base_dir,
+                    base_dir,
+                )
+
+            self.assertEqual(seen_in_base_dir, [])
+            self.assertEqual(
+                [r.status for r in results], [TestCaseResult.STATUS_CORRECT]
+            )
+            self.assertEqual(os.listdir(tmpdir), ["commit_1"])
+
+
 if __name__ == "__main__":
     _ = unittest.main()
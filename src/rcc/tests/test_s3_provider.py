@@ -0,0 +1,399 @@
+"""
+Tests for the S3 storage providers (boto3 and aiobotocore).
+
+Creating a boto3 client does not touch the network, so the client setup tests
+use a dummy endpoint. The transfer tests run the providers against a local
+S3 stand-in: a small in-process HTTP server that keeps objects in memory.
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import cast, override
+
+from botocore.exceptions import ClientError
+
+import rcc.config
+import rcc.provider.storage
+from rcc.config import DEFAULT_CONCURRENCY_PER_WORKER, PREFETCH_MAX_CONCURRENT_DOWNLOADS
+from rcc.provider.storage import BUCKET_CASES
+from rcc.provider.storage.s3 import S3
+from rcc.provider.storage.s3_async import AsyncS3
+from rcc.tests.helpers import make_commit, make_test_case, read_file
+
+
+def make_cfg(
+    concurrency: int | None = None, /, **s3_overrides: object
+) -> rcc.config.Config:
+    s3: dict[str, object] = {
+        "region": "sa-east-1",
+        "endpoint": "http://s3.invalid:8333",
+        "access_key": "key",
+        "secret_key": "secret",
+        "commits_bucket": "runcodes-commits",
+        "outputfiles_bucket": "runcodes-outputfiles",
+        "files_bucket": "runcodes-files",
+        "cases_bucket": "runcodes-cases",
+        "compilation_files_dir": "compilationfiles",
+    }
+    s3.update(s3_overrides)
+    cfg: dict[str, object] = {"s3": s3}
+    if concurrency is not None:
+        cfg["concurrency_per_worker"] = concurrency
+    return rcc.config.Config(cfg)
+
+
+def client_option(provider: S3, name: str) -> object:
+    # botocore sets its Config options as dynamic attributes.
+    options: dict[str, object] = vars(provider.client.meta.config)
+    return options[name]
+
+
+class TestS3Client(unittest.TestCase):
+    def test_pool_sized_for_every_concurrent_download(self) -> None:
+        provider = S3(make_cfg(4))
+        self.assertEqual(
+            provider.max_pool_connections, 4 * PREFETCH_MAX_CONCURRENT_DOWNLOADS
+        )
+        self.assertEqual(
+            client_option(provider, "max_pool_connections"),
+            provider.max_pool_connections,
+        )
+
+    def test_pool_size_uses_default_concurrency(self) -> None:
+        provider = S3(make_cfg())
+        self.assertEqual(
+            provider.max_pool_connections,
+            DEFAULT_CONCURRENCY_PER_WORKER * PREFETCH_MAX_CONCURRENT_DOWNLOADS,
+        )
+
+    def test_explicit_pool_size_wins(self) -> None:
+        provider = S3(make_cfg(4, max_pool_connections=100))
+        self.assertEqual(client_option(provider, "max_pool_connections"), 100)
+
+    def test_path_style_addressing(self) -> None:
+        provider = S3(make_cfg())
+        self.assertEqual(client_option(provider, "s3"), {"addressing_style": "path"})
+
+
+class FakeS3Server(ThreadingHTTPServer):
+    """In-memory S3 stand-in supporting path-style GET, HEAD and PUT."""
+
+    daemon_threads: bool = True
+    objects: dict[str, tuple[bytes, dict[str, str]]]
+    authorizations: list[str]
+    active: int
+    max_active: int
+    delay: float
+    lock: threading.Lock
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), FakeS3Handler)
+        self.objects = {}
+        self.authorizations = []
+        self.active = 0
+        self.max_active = 0
+        self.delay = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def put(self, path: str, content: bytes) -> None:
+        self.objects[path] = (content, {})
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version: str = "HTTP/1.1"
+
+    @property
+    def fake(self) -> FakeS3Server:
+        return cast(FakeS3Server, self.server)
+
+    @override
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self._handle(send_body=True)
+
+    def do_HEAD(self) -> None:
+        self._handle(send_body=False)
+
+    def do_PUT(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        self._begin()
+        try:
+            metadata = {
+                name.lower(): value
+                for name, value in self.headers.items()
+                if name.lower().startswith("x-amz-meta-")
+            }
+            self.fake.objects[self._path()] = (body, metadata)
+            self._respond(200, {"ETag": _etag(body)}, b"")
+        finally:
+            self._end()
+
+    def _handle(self, send_body: bool) -> None:
+        self._begin()
+        try:
+            obj = self.fake.objects.get(self._path())
+            if obj is None:
+                body = (
+                    b"<Error><Code>NoSuchKey</Code><Message>Not found</Message></Error>"
+                )
+                self._respond(404, {}, body if send_body else b"", len(body))
+                return
+            content, metadata = obj
+            headers = {"ETag": _etag(content), **metadata}
+            self._respond(200, headers, content if send_body else b"", len(content))
+        finally:
+            self._end()
+
+    def _begin(self) -> None:
+        """Record the request and take the configured delay."""
+        with self.fake.lock:
+            self.fake.authorizations.append(self.headers.get("Authorization", ""))
+            self.fake.active += 1
+            self.fake.max_active = max(self.fake.max_active, self.fake.active)
+        time.sleep(self.fake.delay)
+
+    def _end(self) -> None:
+        with self.fake.lock:
+            self.fake.active -= 1
+
+    def _path(self) -> str:
+        return urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+
+    def _respond(
+        self,
+        status: int,
+        headers: dict[str, str],
+        body: bytes,
+        length: int | None = None,
+    ) -> None:
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body) if length is None else length))
+        self.end_headers()
+        _ = self.wfile.write(body)
+
+
+def _etag(content: bytes) -> str:
+    return f'"{hashlib.md5(content).hexdigest()}"'
+
+
+class S3StandInTestCase(unittest.IsolatedAsyncioTestCase):
+    """Starts a fresh S3 stand-in and a scratch directory for every test."""
+
+    _server: FakeS3Server | None
+    _thread: threading.Thread | None
+    _tmpdir: str
+
+    def __init__(self, methodName: str = "runTest") -> None:
+        super().__init__(methodName)
+        self._server = None
+        self._thread = None
+        self._tmpdir = ""
+
+    @property
+    def server(self) -> FakeS3Server:
+        assert self._server is not None
+        return self._server
+
+    @override
+    def setUp(self) -> None:
+        self._server = FakeS3Server()
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={"poll_interval": 0.01}
+        )
+        self._thread.start()
+        self._tmpdir = tempfile.mkdtemp()
+
+    @override
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        shutil.rmtree(self._tmpdir)
+
+    def cfg(self, **s3_overrides: object) -> rcc.config.Config:
+        return make_cfg(endpoint=self.server.endpoint, **s3_overrides)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self._tmpdir, name)
+
+
+class TestS3(S3StandInTestCase):
+    async def test_sync_fetch_many_runs_in_parallel(self) -> None:
+        for i in range(6):
+            self.server.put(f"/runcodes-cases/{i}/in", str(i).encode())
+        self.server.delay = 0.05
+        provider = S3(self.cfg())
+        try:
+            await asyncio.to_thread(
+                provider.fetch_many,
+                [(BUCKET_CASES, f"{i}/in", self.path(f"{i}.in")) for i in range(6)],
+                3,
+            )
+        finally:
+            provider.close()
+        self.assertEqual(read_file(self.path("5.in")), b"5")
+        self.assertEqual(self.server.max_active, 3)
+
+    async def test_sync_fetch_many_reuses_one_pool_until_closed(self) -> None:
+        for i in range(4):
+            self.server.put(f"/runcodes-cases/{i}/in", str(i).encode())
+        self.server.delay = 0.02
+        provider = S3(self.cfg(max_pool_connections=2))
+        batch = [(BUCKET_CASES, f"{i}/in", self.path(f"{i}.in")) for i in range(4)]
+
+        def fetch_threads() -> set[threading.Thread]:
+            return {t for t in threading.enumerate() if t.name.startswith("fetch")}
+
+        try:
+            await asyncio.to_thread(provider.fetch_many, batch, 4)
+            threads = fetch_threads()
+            await asyncio.to_thread(provider.fetch_many, batch, 4)
+            self.assertEqual(fetch_threads(), threads)
+        finally:
+            provider.close()
+        # Sized to the connection pool, whatever the batch asks for.
+        self.assertEqual(len(threads), 2)
+        self.assertEqual(self.server.max_active, 2)
+        self.assertFalse(any(t.is_alive() for t in threads))
+
+    async def test_sync_store_is_a_single_request(self) -> None:
+        provider = S3(self.cfg())
+        try:
+            await asyncio.to_thread(
+                provider.store_commit_output, make_commit(), io.BytesIO(b"PK")
+            )
+        finally:
+            provider.close()
+        content, metadata = self.server.objects["/runcodes-outputfiles/42.zip"]
+        self.assertEqual(content, b"PK")
+        self.assertEqual(metadata["x-amz-meta-commitid"], "42")
+        # No HEAD polling for the object after the PUT.
+        self.assertEqual(len(self.server.authorizations), 1)
+
+    async def test_sync_provider_reads_the_same_objects(self) -> None:
+        # Keeps the stand-in honest: boto3 accepts it as S3.
+        self.server.put("/runcodes-cases/7/in", b"1 2")
+        self.server.put("/runcodes-files/compilationfiles/5/Makefile", b"all:")
+        provider = S3(self.cfg())
+        try:
+            await asyncio.to_thread(
+                provider.fetch_test_case_input_file,
+                make_test_case(7),
+                self.path("7.in"),
+            )
+            version = await asyncio.to_thread(
+                provider.fetch_exercise_file_version, "5/Makefile"
+            )
+        finally:
+            provider.close()
+        self.assertEqual(read_file(self.path("7.in")), b"1 2")
+        self.assertEqual(version, _etag(b"all:"))
+
+
+class TestAsyncS3(S3StandInTestCase):
+    async def test_client_shares_the_pool_size_and_addressing(self) -> None:
+        provider = AsyncS3(make_cfg(4))
+        try:
+            client = await provider.client()
+            self.assertIs(await provider.client(), client)
+            options: dict[str, object] = vars(client.meta.config)
+        finally:
+            await provider.close()
+        self.assertEqual(
+            options["max_pool_connections"], 4 * PREFETCH_MAX_CONCURRENT_DOWNLOADS
+        )
+        self.assertEqual(options["s3"], {"addressing_style": "path"})
+
+    async def test_fetch_many_runs_concurrently_on_the_loop(self) -> None:
+        for i in range(6):
+            self.server.put(f"/runcodes-cases/{i}/in", str(i).encode())
+        self.server.delay = 0.05
+        provider = AsyncS3(self.cfg())
+        threads = threading.active_count()
+        try:
+            await provider.fetch_many(
+                [(BUCKET_CASES, f"{i}/in", self.path(f"{i}.in")) for i in range(6)],
+                3,
+            )
+        finally:
+            await provider.close()
+        self.assertEqual(read_file(self.path("5.in")), b"5")
+        self.assertEqual(self.server.max_active, 3)
+        # Only the file writes went through threads: the default executor
+        # spawns at most a few, never one per in-flight download.
+        self.assertLessEqual(threading.active_count() - threads, 3)
+
+    async def test_reads_the_same_objects_as_the_boto3_provider(self) -> None:
+        self.server.put("/runcodes-cases/7/in", b"1 2")
+        self.server.put("/runcodes-cases/7/files/data.txt", b"data")
+        self.server.put("/runcodes-files/compilationfiles/5/Makefile", b"all:")
+        test_case = make_test_case(7)
+        test_case.files = ["data.txt"]
+        provider = AsyncS3(self.cfg())
+        try:
+            await provider.fetch_test_case_input_file(test_case, self.path("7.in"))
+            await provider.fetch_test_case_files(test_case, self._tmpdir)
+            await provider.fetch_exercise_file("5/Makefile", self.path("Makefile"))
+            version = await provider.fetch_exercise_file_version("5/Makefile")
+        finally:
+            await provider.close()
+        self.assertEqual(read_file(self.path("7.in")), b"1 2")
+        self.assertEqual(read_file(self.path("data.txt")), b"data")
+        self.assertEqual(read_file(self.path("Makefile")), b"all:")
+        self.assertEqual(version, _etag(b"all:"))
+
+    async def test_missing_object_raises_and_leaves_no_file(self) -> None:
+        provider = AsyncS3(self.cfg())
+        try:
+            with self.assertRaises(ClientError):
+                await provider.fetch_object(BUCKET_CASES, "8/in", self.path("8.in"))
+        finally:
+            await provider.close()
+        self.assertFalse(os.path.exists(self.path("8.in")))
+
+    async def test_store_is_a_single_request(self) -> None:
+        provider = AsyncS3(self.cfg())
+        try:
+            await provider.store_commit_output(make_commit(), io.BytesIO(b"PK"))
+        finally:
+            await provider.close()
+        content, metadata = self.server.objects["/runcodes-outputfiles/42.zip"]
+        self.assertEqual(content, b"PK")
+        self.assertEqual(metadata["x-amz-meta-commitid"], "42")
+        self.assertEqual(len(self.server.authorizations), 1)
+
+
+class TestFromConfig(unittest.TestCase):
+    def test_s3_selects_the_boto3_provider(self) -> None:
+        cfg = make_cfg()
+        cfg.update({"provider": {"data": "postgres", "storage": "s3"}})
+        self.assertIsInstance(rcc.provider.storage.from_config(cfg), S3)
+
+    def test_s3_async_selects_the_aiobotocore_provider(self) -> None:
+        cfg = make_cfg()
+        cfg.update({"provider": {"data": "postgres", "storage": "s3_async"}})
+        self.assertIsInstance(rcc.provider.storage.from_config(cfg), AsyncS3)
+
+    def test_unknown_provider_is_rejected(self) -> None:
+        cfg = make_cfg()
+        cfg.update({"provider": {"data": "postgres", "storage": "gcs"}})
+        with self.assertRaises(ValueError):
+            _ = rcc.provider.storage.from_config(cfg)
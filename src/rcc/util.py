@@ -2,9 +2,11 @@
 Collection of utilities.
 """
 
+import contextlib
 import datetime
 import fcntl
 import os
+import shutil
 import signal
 import time
 import zipfile
@@ -180,6 +182,82 @@ def is_compilable(ext: str | None) -> bool:
     return False
 
 
+def lock_pid_directory(directory: str) -> int:
+    """Lock a per-process ``<parent>/<pid>`` directory; return the lock's fd.
+
+    The lock is an exclusive ``flock`` on ``<directory>.lock``, held until
+    `unlock_pid_directory`. The kernel drops it when the process dies, so
+    `remove_unlocked_siblings` can tell the directories of live processes
+    from leftovers even after a PID is reused, or when the parent is shared
+    by processes of other PID namespaces. The directory itself is not
+    created.
+    """
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    fd = _lock(f"{directory}.lock", blocking=True)
+    assert fd is not None
+    return fd
+
+
+def unlock_pid_directory(directory: str, fd: int) -> None:
+    """Release a lock taken with `lock_pid_directory`."""
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(f"{directory}.lock")
+    os.close(fd)
+
+
+def remove_unlocked_siblings(directory: str) -> None:
+    """Remove the ``<pid>`` siblings of ``directory`` nobody holds locked.
+
+    Their lock files go with them, and so do lock files left without a
+    directory.
+    """
+    parent = os.path.dirname(directory)
+    own = os.path.basename(directory)
+    pids = {name.removesuffix(".lock") for name in os.listdir(parent)}
+    for pid in pids:
+        if pid == own or not pid.isdigit():
+            continue
+        sibling = os.path.join(parent, pid)
+        fd = _lock(f"{sibling}.lock", blocking=False)
+        if fd is None:
+            continue
+        try:
+            shutil.rmtree(sibling, ignore_errors=True)
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(f"{sibling}.lock")
+        finally:
+            os.close(fd)
+
+
+def _lock(path: str, blocking: bool) -> int | None:
+    """Return a descriptor holding an exclusive ``flock`` on ``path``.
+
+    The file is created if needed. Without ``blocking``, returns `None` when
+    another process holds the lock or the file disappears meanwhile.
+    """
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        except BaseException:
+            os.close(fd)
+            raise
+        # The previous holder may have unlinked the file while we waited:
+        # only a lock on the inode still at ``path`` counts.
+        try:
+            current = os.stat(path).st_ino
+        except FileNotFoundError:
+            current = None
+        if current == os.fstat(fd).st_ino:
+            return fd
+        os.close(fd)
+        if not blocking:
+            return None
+
+
 def from_datetime_to_timestamp(dt: datetime.datetime) -> int:
     epoch = datetime.datetime.fromtimestamp(0, tz=datetime.UTC)
     return int((dt - epoch).total_seconds())